@@ -0,0 +1,336 @@
+# In async_chat.py
+
+import asyncio
+import concurrent.futures
+import contextlib
+import threading
+import time
+from collections import OrderedDict, deque
+from ollama_client import AsyncPooledOllamaClient
+from config import (
+    FIXED_SYSTEM_INSTRUCTION, MODEL_NAME, GENERATION_MAX_CONCURRENT, QUEUE_POLL_SECONDS, PROMPT_LAYOUT,
+    OLLAMA_KEEP_ALIVE, COLOR_WARN, PREFETCH_TTL_SECONDS, PREFETCH_MAX_ENTRIES
+)
+from pdf_utils import CHAT_HISTORY, OLLAMA_HOST, index_generation
+from history_utils import count_message_tokens
+from rag_utils import retrieve_relevant_chunks, embed_query
+from response_cache import get_response_cache, context_fingerprint, replay_stream
+
+STOPPED_MARKER = "\n\n**[Response stopped by user]**"
+
+def lookup_cached_answer(query_embedding, rag_context, conversation=()):
+    """
+    Checks the semantic answer cache; conversation is the history before the question.
+    Returns (cache_key, answer): answer is None on a miss, and cache_key is None when
+    the answer must not be cached (retrieval or query embedding failed).
+    """
+    if query_embedding is None or rag_context.startswith("Error"):
+        return None, None
+    cache_key = (query_embedding, context_fingerprint(rag_context, conversation))
+    return cache_key, get_response_cache().lookup(*cache_key)
+
+def format_user_turn(rag_context, user_query):
+    """The latest user message in the stable layout: this turn's retrieved context, then the question."""
+    return f"Context from the uploaded documents:\n{rag_context}\n\nQuestion: {user_query}"
+
+def turn_messages(history, rag_context, layout=PROMPT_LAYOUT):
+    """
+    Messages for the current turn (history must already end with the user's question).
+    In the stable layout the context is attached to that last message only, so the
+    system prompt and every earlier message are byte-identical from turn to turn, and
+    Ollama re-evaluates just the tail of the prompt. History itself stores the bare question.
+    """
+    messages = history.messages()
+    if layout == "stable" and messages and messages[-1]["role"] == "user":
+        messages[-1] = {"role": "user", "content": format_user_turn(rag_context, messages[-1]["content"])}
+    return messages
+
+class PromptStats:
+    """
+    Compares each turn's prompt size with the tokens Ollama actually evaluated
+    (prompt_eval_count only covers tokens not served from its prompt cache).
+    """
+
+    def __init__(self):
+        self.turns = 0
+        self.prompt_tokens = 0
+        self.evaluated_tokens = 0
+
+    def record(self, messages, final_chunk):
+        evaluated = final_chunk.get("prompt_eval_count")
+        if evaluated is None:
+            return None
+        # Our token estimate is approximate, so never report negative savings
+        prompt_tokens = max(count_message_tokens(messages), evaluated)
+        self.turns += 1
+        self.prompt_tokens += prompt_tokens
+        self.evaluated_tokens += evaluated
+        seconds = (final_chunk.get("prompt_eval_duration") or 0) / 1e9
+        print(COLOR_WARN + f"\n[Prompt] Evaluated {evaluated} of ~{prompt_tokens} prompt tokens "
+              f"(~{prompt_tokens - evaluated} reused from cache, {seconds:.2f}s).")
+        return prompt_tokens - evaluated
+
+    def summary(self):
+        return {"turns": self.turns, "prompt_tokens": self.prompt_tokens,
+                "evaluated_tokens": self.evaluated_tokens,
+                "saved_tokens": self.prompt_tokens - self.evaluated_tokens}
+
+async def _embed_query_or_none(query):
+    try:
+        return await asyncio.to_thread(embed_query, query)
+    except Exception:
+        return None
+
+# ----------------------------------------------------
+# Generation scheduler: caps concurrent generations per model
+# ----------------------------------------------------
+class GenerationTicket:
+    """A request's place in the generation queue (position is 0 once it is generating)."""
+
+    def __init__(self):
+        self.position = 0
+
+class GenerationScheduler:
+    """
+    Lets at most `max_concurrent` generations per model run at once; the rest wait in
+    arrival order and are handed a slot as soon as one frees up. Lives on the engine's
+    event loop, so it needs no locking.
+    """
+
+    def __init__(self, max_concurrent=GENERATION_MAX_CONCURRENT):
+        self.max_concurrent = max_concurrent
+        self._running = {}  # model -> generations in progress
+        self._waiting = {}  # model -> deque of (ticket, future) in arrival order
+
+    def status(self, model):
+        """Returns (running, queued) for a model."""
+        return self._running.get(model, 0), len(self._waiting.get(model, ()))
+
+    def _renumber(self, model):
+        for position, (ticket, _) in enumerate(self._waiting.get(model, ()), start=1):
+            ticket.position = position
+
+    def _release(self, model):
+        waiting = self._waiting.get(model)
+        while waiting:
+            ticket, future = waiting.popleft()
+            if not future.done():
+                # Hand the slot straight to the next waiter; the running count is unchanged
+                ticket.position = 0
+                future.set_result(None)
+                self._renumber(model)
+                return
+        self._running[model] -= 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, model, ticket=None):
+        """Waits for a generation slot for model and holds it for the body of the with block."""
+        ticket = ticket or GenerationTicket()
+        waiting = self._waiting.setdefault(model, deque())
+        if self._running.get(model, 0) < self.max_concurrent and not waiting:
+            self._running[model] = self._running.get(model, 0) + 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            waiting.append((ticket, future))
+            ticket.position = len(waiting)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # Gave up while queued (e.g. stop pressed): leave the queue
+                    waiting.remove((ticket, future))
+                    self._renumber(model)
+                else:
+                    # A slot was handed over just as we were cancelled: pass it on
+                    self._release(model)
+                raise
+        try:
+            yield ticket
+        finally:
+            self._release(model)
+
+# ----------------------------------------------------
+# Async chat engine (shared by the CLI and the Streamlit GUI)
+# ----------------------------------------------------
+class AsyncChatEngine:
+    """
+    Runs chat turns as async generators of response text.
+    Blocking work (query embedding, Chroma and BM25 search) runs in worker threads, so
+    one event loop keeps every in-flight turn streaming while others retrieve, and
+    retrieval for a query can be started before the turn itself with prefetch().
+    """
+
+    def __init__(self, model_name=MODEL_NAME, host=OLLAMA_HOST):
+        self.model_name = model_name
+        self.client = AsyncPooledOllamaClient(host=host)
+        self.scheduler = GenerationScheduler()
+        self.prompt_stats = PromptStats()
+        self._prefetched = OrderedDict()  # (query, web_store) -> (retrieval task, started, index generation)
+
+    async def warm(self, model_name=None):
+        """
+        Loads the chat model and evaluates the fixed system prompt, so the first real turn
+        starts from a warm model with the prompt prefix already cached.
+        """
+        system = FIXED_SYSTEM_INSTRUCTION if PROMPT_LAYOUT == "stable" else None
+        messages = [{"role": "system", "content": system}] if system else []
+        await self.client.chat(model=model_name or self.model_name, messages=messages,
+                               options={"num_predict": 1}, keep_alive=OLLAMA_KEEP_ALIVE)
+
+    def _drop_stale_prefetches(self):
+        """Forgets prefetches that were never used in time or predate an index change."""
+        generation, now = index_generation(), time.monotonic()
+        for key, (task, started, task_generation) in list(self._prefetched.items()):
+            if task_generation != generation or now - started > PREFETCH_TTL_SECONDS:
+                task.cancel()
+                del self._prefetched[key]
+        while len(self._prefetched) > PREFETCH_MAX_ENTRIES:
+            self._prefetched.popitem(last=False)[1][0].cancel()
+
+    def prefetch(self, user_query, web_store=None):
+        """Starts retrieval for a query that is about to be asked. Must be called on the engine's loop."""
+        self._drop_stale_prefetches()
+        # Keyed by session too: each session's own web results are part of its retrieval
+        key = (user_query, web_store)
+        if key not in self._prefetched:
+            task = asyncio.ensure_future(asyncio.to_thread(retrieve_relevant_chunks, user_query, web_store=web_store))
+            self._prefetched[key] = (task, time.monotonic(), index_generation())
+            self._drop_stale_prefetches()
+
+    async def stream(self, user_query, history=CHAT_HISTORY, model_name=None, ticket=None):
+        """
+        Yields the assistant's reply piece by piece and records the turn in history.
+        Generation waits for a scheduler slot; `ticket` shows the turn's queue position meanwhile.
+        """
+        model_name = model_name or self.model_name
+        self._drop_stale_prefetches()
+        prefetched = self._prefetched.pop((user_query, history.web_store), None)
+        if prefetched is not None:
+            retrieval = prefetched[0]
+        else:
+            retrieval = asyncio.ensure_future(
+                asyncio.to_thread(retrieve_relevant_chunks, user_query, web_store=history.web_store))
+        # The conversation so far is read (it may wait for the background summarizer) while
+        # retrieval embeds the query and searches. It excludes the system prompt, and keys the
+        # answer cache so a follow-up never replays an answer given in another conversation.
+        rag_context, conversation = await asyncio.gather(retrieval, asyncio.to_thread(history.conversation))
+        # Retrieval has just embedded the query, so this is an embedding-cache hit
+        query_embedding = await _embed_query_or_none(user_query)
+
+        if PROMPT_LAYOUT == "stable":
+            history.set_system(FIXED_SYSTEM_INSTRUCTION)
+        else:
+            history.set_system(FIXED_SYSTEM_INSTRUCTION + "\n\n" + rag_context)
+        history.add_user(user_query)
+        cache_key, cached_answer = lookup_cached_answer(query_embedding, rag_context, conversation)
+
+        reply = ""
+        finished = failed = False
+        try:
+            if cached_answer is not None:
+                # Same question over the same context: replay the earlier answer, no LLM call
+                for piece in replay_stream(cached_answer):
+                    reply += piece
+                    yield piece
+            else:
+                async with self.scheduler.slot(model_name, ticket):
+                    messages = turn_messages(history, rag_context)
+                    stream = await self.client.chat(model=model_name, messages=messages, stream=True,
+                                                    keep_alive=OLLAMA_KEEP_ALIVE)
+                    async for chunk in stream:
+                        text = chunk["message"]["content"]
+                        reply += text
+                        if chunk.get("done"):
+                            self.prompt_stats.record(messages, chunk)
+                        yield text
+            finished = True
+        except Exception:
+            failed = True
+            history.discard_last_user()
+            raise
+        finally:
+            if finished:
+                history.add_assistant(reply)
+                if cached_answer is None and cache_key is not None and reply.strip():
+                    get_response_cache().store(*cache_key, reply)
+            elif not failed:
+                # The consumer stopped reading (user pressed stop): keep what was said
+                history.add_assistant(reply + STOPPED_MARKER)
+
+# ----------------------------------------------------
+# Background event loop, so synchronous front ends can drive the engine
+# ----------------------------------------------------
+_LOOP = None
+_ENGINE = None
+_LOOP_LOCK = threading.Lock()
+
+def get_event_loop():
+    """Returns the event loop the chat engine lives on, starting its thread on first use."""
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name="chat-engine-loop", daemon=True).start()
+        return _LOOP
+
+def get_chat_engine():
+    global _ENGINE
+    with _LOOP_LOCK:
+        if _ENGINE is None:
+            _ENGINE = AsyncChatEngine()
+        return _ENGINE
+
+def warm_chat_model(model_name=None):
+    """Starts warming the chat model in the background (see AsyncChatEngine.warm)."""
+    future = asyncio.run_coroutine_threadsafe(get_chat_engine().warm(model_name), get_event_loop())
+
+    def report(done):
+        if done.exception() is not None:
+            print(COLOR_WARN + f"[Warmup] Could not preload the chat model: {done.exception()}")
+    future.add_done_callback(report)
+    return future
+
+def prefetch(user_query, web_store=None):
+    """Thread-safe: starts retrieval for user_query (and the session's web_store) on the engine loop."""
+    get_event_loop().call_soon_threadsafe(get_chat_engine().prefetch, user_query, web_store)
+
+def iter_sync(async_generator, on_wait=None):
+    """
+    Consumes an async generator from synchronous code, one item at a time.
+    While an item is pending, on_wait() is called every QUEUE_POLL_SECONDS on the caller's thread.
+    Closing the returned generator early (e.g. a stop button) closes the async one too.
+    """
+    loop = get_event_loop()
+    pending = None
+    try:
+        while True:
+            pending = asyncio.run_coroutine_threadsafe(async_generator.__anext__(), loop)
+            while True:
+                try:
+                    item = pending.result(timeout=QUEUE_POLL_SECONDS)
+                    break
+                except concurrent.futures.TimeoutError:
+                    if on_wait is not None:
+                        on_wait()
+                except StopAsyncIteration:
+                    return
+            pending = None
+            yield item
+    finally:
+        if pending is not None and not pending.done():
+            # Abandoned mid-item (e.g. while queued): cancel it; that also finishes the generator
+            pending.cancel()
+        try:
+            asyncio.run_coroutine_threadsafe(async_generator.aclose(), loop).result()
+        except RuntimeError:
+            pass # Still unwinding from the cancellation above
+
+def stream_chat(user_query, history=CHAT_HISTORY, model_name=None, on_queue=None):
+    """
+    Synchronous iterator over one chat turn's reply text.
+    on_queue(position) is called periodically while the turn waits; position is 0 once it generates.
+    """
+    ticket = GenerationTicket()
+    on_wait = (lambda: on_queue(ticket.position)) if on_queue is not None else None
+    engine = get_chat_engine()
+    return iter_sync(engine.stream(user_query, history=history, model_name=model_name, ticket=ticket), on_wait)
@@ -0,0 +1,443 @@
+# In benchmark.py
+#
+# Retrieval benchmark for the RAG stack. Builds a corpus, ingests it through the normal
+# pipeline and runs labeled queries against vector (Chroma) and hybrid retrieval.
+# By default it talks to a local fake Ollama embedding server, so it runs offline.
+#
+#   python benchmark.py --docs 50 --pages 20 --queries 200 --output results.json
+#   python benchmark.py --pdf-folder data_pdfs --labels labels.jsonl --ollama-host http://127.0.0.1:11434
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from colorama import Fore, init
+
+RESULTS_VERSION = 1
+
+# ----------------------------------------------------
+# Fake Ollama embedding server
+# ----------------------------------------------------
+def fake_embedding(text, dimensions):
+    """Hashed bag-of-words vector: texts sharing words are close, so rankings are meaningful."""
+    vector = [0.0] * dimensions
+    for word in re.findall(r"\w+", text.lower()):
+        bucket = int.from_bytes(hashlib.md5(word.encode("utf-8")).digest()[:4], "little")
+        vector[bucket % dimensions] += 1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+def fake_relevance_scores(prompt):
+    """
+    Grades a reranker prompt (see rerank_utils) by the query words each passage contains,
+    weighting words that few of the passages share (a rough stand-in for a real grader).
+    """
+    query_part, _, passages_part = prompt.partition("\n\nPassages:\n")
+    query_words = set(re.findall(r"\w+", query_part.lower())) - {"query"}
+    passages = [set(re.findall(r"\w+", passage.lower())) for passage in re.split(r"\n(?=\[\d+\] )", passages_part)]
+    weights = {word: math.log(1 + len(passages) / (1 + sum(word in words for words in passages)))
+               for word in query_words}
+    total = sum(weights.values()) or 1.0
+    return [round(10 * sum(weights[word] for word in query_words & words) / total, 2) for words in passages]
+
+class FakeOllamaServer:
+    """
+    Serves /api/embed and /api/embeddings (plus /api/tags and /api/version) on localhost,
+    and JSON-format /api/chat calls from the reranker (graded by word overlap).
+    latency_ms is added to every embedding request to mimic a real model.
+    """
+
+    def __init__(self, dimensions=384, latency_ms=0.0):
+        self.dimensions = dimensions
+        self.latency_ms = latency_ms
+        self.requests = 0
+        self.texts = 0
+        self.chats = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def host(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def _embed(self, texts):
+        with self._lock:
+            self.requests += 1
+            self.texts += len(texts)
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [fake_embedding(text, self.dimensions) for text in texts]
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True # Otherwise delayed ACKs add ~40 ms to every request
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.startswith("/api/tags"):
+                    return self._reply({"models": []})
+                self._reply({"version": "fake"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/api/embed":
+                    texts = request.get("input") or []
+                    texts = [texts] if isinstance(texts, str) else texts
+                    return self._reply({"model": request.get("model"), "embeddings": server._embed(texts)})
+                if self.path == "/api/embeddings":
+                    return self._reply({"embedding": server._embed([request.get("prompt", "")])[0]})
+                if self.path == "/api/chat" and request.get("format") == "json" and not request.get("stream", True):
+                    with server._lock:
+                        server.chats += 1
+                    prompt = request["messages"][-1]["content"]
+                    content = json.dumps({"scores": fake_relevance_scores(prompt)})
+                    return self._reply({"model": request.get("model"), "done": True,
+                                        "message": {"role": "assistant", "content": content}})
+                self.send_error(404)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+# ----------------------------------------------------
+# Synthetic corpus (PDFs with one labeled fact per page)
+# ----------------------------------------------------
+FILLER_WORDS = (
+    "revenue margin growth quarter customer platform service market product team cost "
+    "forecast region strategy pipeline partner contract budget risk roadmap launch "
+    "analysis report segment demand supply pricing operations hiring compliance audit"
+).split()
+CODENAME_PARTS = ("amber", "basalt", "cobalt", "delta", "ember", "falcon", "granite", "harbor",
+                  "indigo", "juniper", "kestrel", "lumen", "meridian", "nimbus", "onyx", "pylon")
+PEOPLE = ("Avery", "Blake", "Carmen", "Dana", "Elliot", "Farah", "Gideon", "Hana", "Ivo", "Jules")
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_text_pdf(path, pages, line_chars=95):
+    """Writes a minimal PDF (Helvetica text, one string per page) that pypdf can extract."""
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for text in pages:
+        lines = []
+        for paragraph in text.split("\n"):
+            words, line = paragraph.split(), ""
+            for word in words:
+                if line and len(line) + len(word) + 1 > line_chars:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = f"{line} {word}" if line else word
+            lines.append(line)
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({_pdf_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_ref)
+        page_refs.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % ref for ref in page_refs), len(page_refs))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+def build_synthetic_corpus(pdf_folder, docs, pages, words_per_page, seed=0):
+    """
+    Writes docs PDFs of pages pages each. Every page holds filler text plus one fact
+    about a unique project; returns labeled queries [{"query", "source", "page"}].
+    """
+    rng = random.Random(seed)
+    os.makedirs(pdf_folder, exist_ok=True)
+    labels = []
+    for doc in range(docs):
+        filename = f"synthetic_report_{doc:04d}.pdf"
+        page_texts = []
+        for page in range(pages):
+            codename = f"{rng.choice(CODENAME_PARTS)}{doc:04d}x{page:03d}"
+            person, budget = rng.choice(PEOPLE), rng.randint(2, 950)
+            fact = f"Project {codename} is led by {person} and has a budget of {budget} million dollars."
+            filler, words = [], 0
+            while words < words_per_page:
+                length = rng.randint(6, 20)
+                filler.append(" ".join(rng.choice(FILLER_WORDS) for _ in range(length)).capitalize() + ".")
+                words += length
+            filler.insert(rng.randint(0, len(filler)), fact)
+            page_texts.append(" ".join(filler))
+            labels.append({"query": f"Who leads project {codename} and what is its budget?",
+                           "source": filename, "page": page + 1})
+        write_text_pdf(os.path.join(pdf_folder, filename), page_texts)
+    return labels
+
+def load_labels(path):
+    """Labeled queries from a JSON-lines file: {"query": ..., "source": ..., "page": optional}."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# ----------------------------------------------------
+# Metrics
+# ----------------------------------------------------
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+def latency_summary(seconds):
+    milliseconds = [s * 1000 for s in seconds]
+    return {
+        "p50": percentile(milliseconds, 50),
+        "p95": percentile(milliseconds, 95),
+        "p99": percentile(milliseconds, 99),
+        "mean": sum(milliseconds) / len(milliseconds) if milliseconds else None,
+        "max": max(milliseconds) if milliseconds else None,
+    }
+
+def first_relevant_rank(hits, label):
+    """1-based rank of the first hit from the labeled source (and page, if given), or None."""
+    for rank, hit in enumerate(hits, start=1):
+        metadata = hit.get("metadata") or {}
+        if metadata.get("source") != label["source"]:
+            continue
+        if label.get("page") is None or metadata.get("page") == label["page"]:
+            return rank
+    return None
+
+def quality_summary(ranks, top_k):
+    found = [rank for rank in ranks if rank is not None and rank <= top_k]
+    return {
+        f"recall@{top_k}": len(found) / len(ranks) if ranks else None,
+        "mrr": sum(1.0 / rank for rank in found) / len(ranks) if ranks else None,
+    }
+
+# ----------------------------------------------------
+# Benchmark runs
+# ----------------------------------------------------
+def _quietly(func, *args, **kwargs):
+    # The RAG functions print diagnostics for every query; keep them out of the timings' way
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+def run_ingest(pdf_utils, pdf_folder):
+    start = time.perf_counter()
+    _quietly(pdf_utils.load_pdfs_into_context, pdf_folder=pdf_folder, clear_existing=True)
+    seconds = time.perf_counter() - start
+    catalog = pdf_utils.get_document_catalog()
+    pages = sum(entry["pages"] or 0 for entry in catalog.values())
+    chunks = sum(entry["chunks"] or 0 for entry in catalog.values())
+    return {
+        "seconds": seconds,
+        "documents": len(catalog),
+        "pages": pages,
+        "chunks": chunks,
+        "bytes": sum(entry["size"] or 0 for entry in catalog.values()),
+        "pages_per_second": pages / seconds if seconds else None,
+        "chunks_per_second": chunks / seconds if seconds else None,
+    }
+
+def run_queries(search, labels, top_k, concurrency):
+    """Sequential pass for latency and quality, then a concurrent pass for throughput."""
+    latencies, ranks = [], []
+    for label in labels:
+        start = time.perf_counter()
+        hits = _quietly(search, label["query"], top_k)
+        latencies.append(time.perf_counter() - start)
+        ranks.append(first_relevant_rank(hits, label))
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda label: search(label["query"], top_k), labels))
+    wall = time.perf_counter() - start
+
+    return {
+        "queries": len(labels),
+        "latency_ms": latency_summary(latencies),
+        "qps": len(labels) / wall if wall else None,
+        "concurrency": concurrency,
+        **quality_summary(ranks, top_k),
+    }
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def run_benchmark(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="joel_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    fake_server = None
+    if args.ollama_host:
+        ollama_host = args.ollama_host
+    else:
+        fake_server = FakeOllamaServer(dimensions=args.dimensions, latency_ms=args.embed_latency_ms).start()
+        ollama_host = fake_server.host
+
+    # The RAG modules read the host at import time and keep their data in relative paths,
+    # so point them at the target server and run them inside the scratch directory
+    os.environ["JOEL_OLLAMA_HOST"] = ollama_host
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    previous_cwd = os.getcwd()
+    if args.pdf_folder:
+        args.pdf_folder = os.path.abspath(args.pdf_folder)
+    if args.labels:
+        args.labels = os.path.abspath(args.labels)
+    os.chdir(workdir)
+    try:
+        if args.pdf_folder:
+            pdf_folder = args.pdf_folder
+            corpus = {"kind": "folder", "path": pdf_folder}
+            labels = load_labels(args.labels) if args.labels else []
+        else:
+            pdf_folder = os.path.join(workdir, "bench_pdfs")
+            shutil.rmtree(pdf_folder, ignore_errors=True)
+            print(Fore.YELLOW + f"[Bench] Writing synthetic corpus: {args.docs} docs x {args.pages} pages...")
+            labels = build_synthetic_corpus(pdf_folder, args.docs, args.pages, args.words_per_page, args.seed)
+            corpus = {"kind": "synthetic", "docs": args.docs, "pages": args.pages,
+                      "words_per_page": args.words_per_page, "seed": args.seed}
+        if args.queries and len(labels) > args.queries:
+            labels = random.Random(args.seed).sample(labels, args.queries)
+
+        import pdf_utils
+        import rag_utils
+
+        print(Fore.YELLOW + "[Bench] Ingesting...")
+        ingest = run_ingest(pdf_utils, pdf_folder)
+        print(Fore.GREEN + f"[Bench] Ingested {ingest['chunks']} chunks from {ingest['pages']} pages "
+              f"in {ingest['seconds']:.2f}s ({ingest['chunks_per_second']:.1f} chunks/s).")
+
+        retrieval = {}
+        query_embedding = None
+        if labels:
+            # Embed every query once up front (cold), so both modes below compare search
+            # cost alone over the same, cached, query embeddings
+            embed_seconds = []
+            for label in labels:
+                start = time.perf_counter()
+                rag_utils.embed_query(label["query"])
+                embed_seconds.append(time.perf_counter() - start)
+            query_embedding = {"latency_ms": latency_summary(embed_seconds)}
+
+            collection = pdf_utils.get_chroma_collection()
+            modes = {
+                "vector": lambda query, top_k: rag_utils._vector_hits(collection, query, top_k),
+                "hybrid": lambda query, top_k: rag_utils.hybrid_search(query, top_k=top_k),
+            }
+            if args.rerank:
+                modes["rerank"] = lambda query, top_k: rag_utils.search_and_rerank(query, top_k=top_k, rerank=True)
+            for mode, search in modes.items():
+                print(Fore.YELLOW + f"[Bench] Running {len(labels)} queries ({mode})...")
+                retrieval[mode] = run_queries(search, labels, args.top_k, args.concurrency)
+        else:
+            print(Fore.YELLOW + "[Bench] No labeled queries; skipping retrieval runs.")
+    finally:
+        os.chdir(previous_cwd)
+        if fake_server is not None:
+            fake_server.stop()
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "results_version": RESULTS_VERSION,
+        "git_revision": _git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "ollama": "fake" if fake_server else ollama_host,
+        "fake_server": {"requests": fake_server.requests, "texts": fake_server.texts, "chats": fake_server.chats,
+                        "latency_ms": fake_server.latency_ms} if fake_server else None,
+        "top_k": args.top_k,
+        "corpus": corpus,
+        "ingest": ingest,
+        "query_embedding": query_embedding,
+        "retrieval": retrieval,
+    }
+
+def print_report(results):
+    top_k = results["top_k"]
+    if results["query_embedding"]:
+        latency = results["query_embedding"]["latency_ms"]
+        print(Fore.CYAN + f"  embed: p50 {latency['p50']:.1f} ms | p95 {latency['p95']:.1f} ms | p99 {latency['p99']:.1f} ms")
+    for mode, stats in results["retrieval"].items():
+        latency = stats["latency_ms"]
+        print(Fore.CYAN + f"{mode:>7}: p50 {latency['p50']:.1f} ms | p95 {latency['p95']:.1f} ms | "
+              f"p99 {latency['p99']:.1f} ms | {stats['qps']:.1f} QPS | "
+              f"recall@{top_k} {stats[f'recall@{top_k}']:.3f} | MRR {stats['mrr']:.3f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and retrieval of the RAG stack.")
+    parser.add_argument("--docs", type=int, default=20, help="Synthetic documents to generate")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per synthetic document")
+    parser.add_argument("--words-per-page", type=int, default=250, help="Filler words per synthetic page")
+    parser.add_argument("--queries", type=int, default=200, help="Labeled queries to run (sampled)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel queries in the throughput pass")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pdf-folder", help="Benchmark a real folder of PDFs instead of a synthetic corpus")
+    parser.add_argument("--labels", help="JSON-lines labeled queries for --pdf-folder")
+    parser.add_argument("--rerank", action="store_true", help="Also benchmark hybrid search + reranking")
+    parser.add_argument("--ollama-host", help="Use this Ollama server instead of the built-in fake one")
+    parser.add_argument("--dimensions", type=int, default=384, help="Fake embedding dimensions")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="Added latency per fake embed request")
+    parser.add_argument("--workdir", help="Directory for the benchmark's Chroma data (default: temporary)")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary working directory")
+    parser.add_argument("--output", help="Write machine-readable results (JSON) to this file")
+    args = parser.parse_args(argv)
+
+    init(autoreset=True)
+    results = run_benchmark(args)
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(Fore.GREEN + f"[Bench] Results written to {args.output}")
+    return results
+
+if __name__ == "__main__":
+    main()
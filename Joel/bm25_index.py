@@ -0,0 +1,217 @@
+# In bm25_index.py
+
+import heapq
+import math
+import os
+import pickle
+import re
+import threading
+from collections import Counter
+from colorama import Fore
+from config import BM25_K1, BM25_B
+
+# Words, numbers, and compound identifiers such as part numbers ("AB-1130.2") or clause IDs ("4.2.1")
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._/-][a-z0-9]+)*")
+COMPOUND_SPLIT = re.compile(r"[._/-]")
+
+# Query terms found in more than this share of chunks are skipped when rarer terms are
+# present: their postings are the most expensive to walk and their IDF is close to zero
+COMMON_TERM_RATIO = 0.5
+
+# Frequent words that add cost to every query but almost nothing to the ranking
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+def tokenize(text):
+    """Lowercased terms; compound identifiers are indexed whole and as their parts."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in COMPOUND_SPLIT.split(token) if part and part not in STOPWORDS)
+    return terms
+
+# ----------------------------------------------------
+# Inverted-index BM25 retriever, kept alongside the Chroma collection
+# ----------------------------------------------------
+class BM25Index:
+    """
+    In-memory inverted index over the chunk texts.
+    Queries only touch the postings of their own terms, so lookups stay in the
+    millisecond range on large collections. Safe to update from the ingest writer
+    thread while queries run.
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.ready = False
+        self.dirty = False
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._postings = {}      # term -> {doc slot: term frequency}
+        self._doc_ids = []       # doc slot -> chunk id (None once removed)
+        self._doc_terms = []     # doc slot -> distinct terms, needed for removal
+        self._doc_lengths = []
+        self._doc_sources = []
+        self._slot_by_id = {}
+        self._slots_by_source = {}
+        self._free_slots = []
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._slot_by_id)
+
+    def clear(self):
+        """Empties the index; it then mirrors an empty (freshly wiped) collection."""
+        with self._lock:
+            self._reset()
+            self.ready = True
+            self.dirty = True
+
+    def add(self, ids, documents, metadatas):
+        """Adds (or replaces) chunks. Ignored until the index has been built from the collection."""
+        with self._lock:
+            if not self.ready:
+                return
+            for chunk_id, document, metadata in zip(ids, documents, metadatas):
+                self._add_one(chunk_id, document, (metadata or {}).get("source"))
+            self.dirty = True
+
+    def _add_one(self, chunk_id, document, source):
+        if chunk_id in self._slot_by_id:
+            self._remove_slot(self._slot_by_id[chunk_id])
+        counts = Counter(tokenize(document or ""))
+        length = sum(counts.values())
+
+        if self._free_slots:
+            slot = self._free_slots.pop()
+            self._doc_ids[slot] = chunk_id
+            self._doc_terms[slot] = tuple(counts)
+            self._doc_lengths[slot] = length
+            self._doc_sources[slot] = source
+        else:
+            slot = len(self._doc_ids)
+            self._doc_ids.append(chunk_id)
+            self._doc_terms.append(tuple(counts))
+            self._doc_lengths.append(length)
+            self._doc_sources.append(source)
+
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[slot] = tf
+        self._slot_by_id[chunk_id] = slot
+        self._slots_by_source.setdefault(source, set()).add(slot)
+        self._total_length += length
+
+    def _remove_slot(self, slot):
+        for term in self._doc_terms[slot]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(slot, None)
+                if not postings:
+                    del self._postings[term]
+        source_slots = self._slots_by_source.get(self._doc_sources[slot])
+        if source_slots is not None:
+            source_slots.discard(slot)
+            if not source_slots:
+                del self._slots_by_source[self._doc_sources[slot]]
+        del self._slot_by_id[self._doc_ids[slot]]
+        self._total_length -= self._doc_lengths[slot]
+        self._doc_ids[slot] = None
+        self._doc_terms[slot] = ()
+        self._doc_lengths[slot] = 0
+        self._doc_sources[slot] = None
+        self._free_slots.append(slot)
+
+    def remove_sources(self, sources):
+        """Drops every chunk of the given source files."""
+        with self._lock:
+            for source in sources:
+                for slot in list(self._slots_by_source.get(source, ())):
+                    self._remove_slot(slot)
+                    self.dirty = True
+
+    def build_from_collection(self, collection, page_size=5000):
+        """(Re)builds the whole index from the documents stored in Chroma."""
+        with self._lock:
+            self._reset()
+            offset = 0
+            while True:
+                page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+                ids = page.get("ids") or []
+                if not ids:
+                    break
+                for chunk_id, document, metadata in zip(ids, page["documents"], page["metadatas"]):
+                    self._add_one(chunk_id, document, (metadata or {}).get("source"))
+                offset += len(ids)
+            self.ready = True
+            self.dirty = True
+        print(Fore.GREEN + f"[BM25] Keyword index built over {len(self)} chunks.")
+
+    def ensure_built(self, collection):
+        if not self.ready:
+            self.build_from_collection(collection)
+
+    # --- Persistence: building over a large collection takes far longer than unpickling ---
+    _STATE = ("_postings", "_doc_ids", "_doc_terms", "_doc_lengths", "_doc_sources",
+              "_slot_by_id", "_slots_by_source", "_free_slots", "_total_length")
+
+    def save(self, path, signature):
+        """Writes the index, tagged with a signature of the corpus state it reflects."""
+        with self._lock:
+            if not self.ready:
+                return
+            state = {name: getattr(self, name) for name in self._STATE}
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"signature": signature, "state": state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self.dirty = False
+
+    def load(self, path, signature):
+        """Loads a saved index if it was written for the same corpus state. Returns True on success."""
+        try:
+            with open(path, "rb") as f:
+                saved = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            return False
+        if saved.get("signature") != signature:
+            return False
+        with self._lock:
+            for name, value in saved["state"].items():
+                setattr(self, name, value)
+            self.ready = True
+            self.dirty = False
+        return True
+
+    def search(self, query, top_k=20):
+        """Returns up to top_k (chunk id, BM25 score) pairs, best first."""
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self._slot_by_id)
+            if not terms or n_docs == 0:
+                return []
+            avg_length = self._total_length / n_docs
+            k1, b = self.k1, self.b
+            scores = {}
+            matched = sorted((self._postings[term] for term in terms if term in self._postings), key=len)
+            for i, postings in enumerate(matched):
+                if i > 0 and len(postings) > n_docs * COMMON_TERM_RATIO:
+                    break
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for slot, tf in postings.items():
+                    norm = k1 * (1 - b + b * self._doc_lengths[slot] / avg_length)
+                    scores[slot] = scores.get(slot, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+            best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            return [(self._doc_ids[slot], score) for slot, score in best]
+
+BM25_INDEX = BM25Index()
+
+def get_bm25_index():
+    """Returns the shared keyword index that mirrors the Chroma collection."""
+    return BM25_INDEX
@@ -0,0 +1,302 @@
+# In chunking_utils.py
+
+import re
+from config import (
+    CHUNK_STRATEGY, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, CHUNK_STRATEGY_BY_COLLECTION
+)
+
+# Bump when the structured chunker's output changes, so existing indexes get rebuilt
+STRUCTURED_CHUNKER_VERSION = 3
+
+# Word-level tokens: a close, tokenizer-free stand-in for embedding-model tokens
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+# A page reads as one word per line when at least this share of its lines are a single word
+_ONE_WORD_LINE_SHARE = 0.9
+# Candidate sentence end: . ! ? and any closing quotes/brackets (kept with the sentence),
+# then the whitespace that separates it from the next one
+_SENTENCE_END = re.compile(r"[.!?]+[\"'\u201d\u2019)\]]*(\s+)")
+# Words whose trailing period does not end a sentence ("Fig. 2", "e.g. this", "Dr. Smith")
+_ABBREVIATIONS = {
+    "al", "approx", "ca", "cf", "ch", "co", "corp", "dept", "dr", "e.g", "eq", "eqs", "est", "etc",
+    "fig", "figs", "i.e", "inc", "jr", "ltd", "mr", "mrs", "ms", "no", "nos", "p", "pp", "prof",
+    "ref", "refs", "sec", "sr", "st", "tab", "vol", "vs",
+}
+# A list number or section number on its own ("1.", "2.3.", "IV.") is not a sentence
+_NUMERAL = re.compile(r"(\d+(\.\d+)*|[IVXLC]+)\.?")
+_TERMINAL = (".", "!", "?", ":", ".\"", ".'", ".)", "!\"", "?\"")
+_NUMBERED_HEADING = re.compile(r"^(\d+(\.\d+)*|[IVX]+|[A-Z])[.)]?\s+\S")
+
+def count_tokens(text):
+    return len(_TOKEN_PATTERN.findall(text))
+
+def split_text_into_chunks(text, chunk_size=1000, overlap=200):
+    """A simple fixed-size text splitter."""
+
+    # Split by double newlines for paragraph-like chunks
+    text_parts = [p.strip() for p in text.split('\n\n') if p.strip()]
+
+    # Simple chunking logic
+    chunks = []
+    current_chunk = ""
+    for part in text_parts:
+        if len(current_chunk) + len(part) + 2 < chunk_size:
+            current_chunk += part + "\n\n"
+        else:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+            current_chunk = part + "\n\n"
+
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+
+    return chunks
+
+# ----------------------------------------------------
+# Page text structure: headings, paragraphs, sentences
+# ----------------------------------------------------
+def is_heading(line):
+    """Short line without sentence punctuation that looks like a title or a numbered section."""
+    if not line or len(line) > 80 or line.endswith((".", ",", ";")):
+        return False
+    words = line.split()
+    if len(words) > 12:
+        return False
+    if _NUMBERED_HEADING.match(line) or line.isupper():
+        return True
+    capitalized = sum(1 for word in words if word[:1].isupper())
+    return len(words) <= 8 and capitalized >= max(1, len(words) - 1)
+
+def page_blocks(text):
+    """
+    Splits extracted page text into blocks of (is_heading, text). Wrapped lines are
+    rejoined (with de-hyphenation) so sentences that the PDF broke across lines stay whole.
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    non_empty = [line for line in lines if line]
+    single_words = sum(1 for line in non_empty if len(line.split()) == 1)
+    if len(non_empty) > 1 and single_words >= _ONE_WORD_LINE_SHARE * len(non_empty):
+        # Some PDFs extract as one word per line (often with blank lines in between);
+        # that layout carries no structure, so read it as running text. Tables, lists and
+        # "key: value" lines have several words on most lines and keep their blocks
+        return [(False, " ".join(text.split()))]
+
+    blocks, paragraph = [], []
+
+    def flush():
+        if paragraph:
+            blocks.append((False, " ".join(paragraph)))
+            paragraph.clear()
+
+    for line in lines:
+        if not line:
+            flush()
+        elif is_heading(line) and (not paragraph or paragraph[-1].endswith(_TERMINAL)):
+            flush()
+            blocks.append((True, line))
+        elif paragraph and paragraph[-1].endswith("-") and line[:1].islower():
+            paragraph[-1] = paragraph[-1][:-1] + line
+        else:
+            paragraph.append(line)
+    flush()
+    return blocks
+
+def _ends_sentence(sentence, terminator):
+    """Whether a candidate end really closes the sentence (not an abbreviation or list number)."""
+    if not terminator.startswith("."):
+        return True
+    words = sentence.split()
+    last_word = words[-1].rstrip(".\"'\u201d\u2019)]").lstrip("(\"'\u201c\u2018[")
+    if last_word.lower() in _ABBREVIATIONS or (len(last_word) == 1 and last_word.isupper()):
+        return False  # Abbreviation or initial ("J. Smith")
+    return not (len(words) == 1 and _NUMERAL.fullmatch(words[0]))
+
+def _sentence_ends(text):
+    """Yields (end of sentence, start of the next one) for each sentence boundary in text."""
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        end = match.start(1)
+        if _ends_sentence(text[start:end], text[match.start():end]):
+            yield end, match.end()
+            start = match.end()
+
+def split_sentences(text):
+    """
+    Sentences of text, each with its closing punctuation, quotes and brackets; only the
+    whitespace between sentences is dropped.
+    """
+    sentences, start = [], 0
+    for end, next_start in _sentence_ends(text):
+        sentences.append(text[start:end])
+        start = next_start
+    sentences.append(text[start:])
+    return [sentence for sentence in sentences if sentence]
+
+def ends_open(text):
+    """True when text stops mid-sentence (e.g. a page that continues on the next one)."""
+    text = text.rstrip()
+    return bool(text) and not text.endswith(_TERMINAL)
+
+def leading_fragment(text):
+    """Splits text into (the part before its first sentence end, the rest)."""
+    stripped = text.lstrip()
+    for end, next_start in _sentence_ends(stripped):
+        return stripped[:end], stripped[next_start:]
+    return stripped, ""
+
+# ----------------------------------------------------
+# Chunking strategies
+# ----------------------------------------------------
+class Chunker:
+    """
+    Turns the text of one page into chunks.
+    prev_text / next_text are the neighbouring pages' text (None at the document edges),
+    for strategies that keep sentences and overlap continuous across page breaks.
+    """
+
+    name = None
+
+    def params(self):
+        """Settings recorded in the index manifest; changing them forces a re-index."""
+        raise NotImplementedError
+
+    def split_page(self, text, prev_text=None, next_text=None):
+        raise NotImplementedError
+
+class ParagraphChunker(Chunker):
+    """The original splitter: paragraphs packed up to chunk_size characters, one page at a time."""
+
+    name = "paragraph"
+
+    def __init__(self, chunk_size=1000, overlap=200, **_):
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+
+    def params(self):
+        return {"splitter": self.name, "chunk_size": self.chunk_size, "overlap": self.overlap}
+
+    def split_page(self, text, prev_text=None, next_text=None):
+        return split_text_into_chunks(text, self.chunk_size, self.overlap)
+
+class StructuredChunker(Chunker):
+    """
+    Packs whole sentences into chunks of at most max_tokens, starting a new chunk at every
+    heading (the heading leads its section's chunk). Consecutive chunks share about
+    overlap_tokens of trailing sentences, including across page breaks, and a sentence that
+    runs over a page break is kept whole in the chunk of the page where it starts.
+    """
+
+    name = "structured"
+
+    def __init__(self, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS, **_):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    def params(self):
+        return {"splitter": self.name, "max_tokens": self.max_tokens,
+                "overlap_tokens": self.overlap_tokens, "version": STRUCTURED_CHUNKER_VERSION}
+
+    def _continuation(self, text, next_text):
+        """The start of next_text that finishes text's last sentence, or None if the page break is a real break."""
+        if not next_text or not ends_open(text):
+            return None
+        fragment, _ = leading_fragment(next_text)
+        # Text without sentence punctuation (tables, lists) is not one long sentence
+        return fragment if count_tokens(fragment) <= self.max_tokens // 2 else None
+
+    def _units(self, text, prev_text, next_text):
+        """The page as (is_heading, sentence) units, with page-break fragments moved to their sentence's page."""
+        continuation = self._continuation(text, next_text)
+        if prev_text and self._continuation(prev_text, text) is not None:
+            # Our opening fragment finishes the previous page's last sentence, which is chunked there
+            _, text = leading_fragment(text)
+        if continuation is not None:
+            text = text.rstrip() + " " + continuation
+
+        units = []
+        for heading, block in page_blocks(text):
+            if heading:
+                units.append((True, block))
+            else:
+                units.extend((False, sentence) for sentence in split_sentences(block))
+        return units
+
+    def _overlap_seed(self, prev_text, text):
+        """The previous page's closing sentences (about overlap_tokens), to open this page's first chunk."""
+        if not prev_text or not self.overlap_tokens:
+            return []
+        seed, tokens = [], 0
+        for heading, sentence in reversed(self._units(prev_text, None, text)):
+            if heading:
+                break
+            size = count_tokens(sentence)
+            if tokens + size > self.overlap_tokens:
+                break
+            seed.insert(0, (sentence, size))
+            tokens += size
+        return seed
+
+    def _pieces(self, sentence, size):
+        """Splits a sentence longer than max_tokens at word boundaries."""
+        if size <= self.max_tokens:
+            return [(sentence, size)]
+        pieces, words, tokens = [], [], 0
+        for word in sentence.split():
+            word_tokens = count_tokens(word)
+            if words and tokens + word_tokens > self.max_tokens:
+                pieces.append((" ".join(words), tokens))
+                words, tokens = [], 0
+            words.append(word)
+            tokens += word_tokens
+        if words:
+            pieces.append((" ".join(words), tokens))
+        return pieces
+
+    def split_page(self, text, prev_text=None, next_text=None):
+        chunks = []
+        current = self._overlap_seed(prev_text, text)  # (sentence, tokens) pairs
+        carried = len(current)                        # Leading entries that are only overlap
+        tokens = sum(size for _, size in current)
+
+        def emit():
+            nonlocal current, carried, tokens
+            if len(current) > carried:
+                chunks.append(" ".join(sentence for sentence, _ in current).replace("\n ", "\n"))
+            # Carry the last sentences over as the next chunk's overlap
+            tail, tail_tokens = [], 0
+            for sentence, size in reversed(current):
+                if tail_tokens + size > self.overlap_tokens:
+                    break
+                tail.insert(0, (sentence, size))
+                tail_tokens += size
+            current, carried, tokens = tail, len(tail), tail_tokens
+
+        for heading, unit in self._units(text, prev_text, next_text):
+            if heading:
+                # A section starts a fresh chunk, without overlap from the previous section
+                emit()
+                current, carried, tokens = [(unit + "\n", count_tokens(unit))], 0, count_tokens(unit)
+                continue
+            for piece, size in self._pieces(unit, count_tokens(unit)):
+                if tokens + size > self.max_tokens and len(current) > carried:
+                    emit()
+                while current and tokens + size > self.max_tokens:
+                    # Overlap never pushes a chunk over the limit
+                    tokens -= current.pop(0)[1]
+                    carried = max(0, carried - 1)
+                current.append((piece, size))
+                tokens += size
+        emit()
+        return chunks
+
+CHUNKERS = {chunker.name: chunker for chunker in (ParagraphChunker, StructuredChunker)}
+
+def chunk_params_for(collection_name):
+    """Chunking settings for a collection: the config defaults plus any per-collection overrides."""
+    settings = {"strategy": CHUNK_STRATEGY, "max_tokens": CHUNK_MAX_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS}
+    settings.update(CHUNK_STRATEGY_BY_COLLECTION.get(collection_name, {}))
+    return settings
+
+def get_chunker(strategy=CHUNK_STRATEGY, **settings):
+    if strategy not in CHUNKERS:
+        raise ValueError(f"Unknown chunking strategy '{strategy}'. Available: {', '.join(CHUNKERS)}")
+    return CHUNKERS[strategy](**settings)
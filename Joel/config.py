@@ -1,11 +1,118 @@
+import os
 from colorama import Fore
 
 MODEL_NAME = "gemma3:12b"
 # --- New Constants for VectorDB ---
 EMBEDDING_MODEL = "all-minilm" # A good choice for Ollama embeddings
 CHROMA_COLLECTION = "pdf_rag_chunks"
+CHROMA_PATH = "./chroma_db"
+# Records hash/mtime/size of every indexed PDF so startup only re-embeds what changed
+INDEX_MANIFEST_PATH = "./index_manifest.json"
+# Number of chunks sent per /api/embed request, and how many of those
+# requests may be outstanding against the Ollama server at once.
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_MAX_IN_FLIGHT = 2
+# On-disk embedding cache (SQLite), keyed by model + text hash, LRU-evicted past the cap
+EMBEDDING_CACHE_PATH = "./embedding_cache.sqlite3"
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
 # ---
 PDF_FOLDER = "data_pdfs"
+# --- Chunking (changing any of these re-indexes the affected collection) ---
+CHUNK_STRATEGY = "structured" # "structured" (token-based, sentence/heading aware) or "paragraph" (original splitter)
+CHUNK_MAX_TOKENS = 200 # Word-level tokens per chunk; all-minilm only embeds the first ~256 word pieces
+CHUNK_OVERLAP_TOKENS = 40 # Trailing sentences repeated at the start of the next chunk
+CHUNK_STRATEGY_BY_COLLECTION = {} # Per-collection overrides, e.g. {"pdf_rag_chunks": {"strategy": "paragraph"}}
+# ---
+# --- Hybrid retrieval (BM25 keyword + vector, fused with reciprocal-rank fusion) ---
+HYBRID_CANDIDATES = 20 # Candidates taken from each retriever before fusion
+RRF_K = 60 # Standard RRF damping constant
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_INDEX_PATH = "./bm25_index.pkl" # Saved keyword index, reused while the corpus is unchanged
+# ---
+# --- Reranking (small local model grades the fused candidates) ---
+RERANK_ENABLED = True
+RERANK_MODEL = "gemma3:1b" # Small and fast; only asked for relevance scores
+RERANK_CANDIDATES = 50 # Fused candidates fetched for reranking
+RERANK_TOP_N = 3 # Chunks passed to MODEL_NAME after reranking (the fused top_k is used if reranking drops out)
+RERANK_BATCH_SIZE = 10 # Passages graded per reranker call
+RERANK_MAX_IN_FLIGHT = 2 # Reranker calls running against Ollama at once
+RERANK_BUDGET_SECONDS = 2.0 # Per-query latency budget; over it, the fused order is used
+RERANK_PASSAGE_CHARS = 1500 # Characters of each passage shown to the reranker (a full CHUNK_MAX_TOKENS chunk fits)
+RERANK_CACHE_MAX_ENTRIES = 20_000 # Cached (query, chunk) scores
+# ---
+# --- Context assembly (what retrieval puts into the prompt) ---
+CONTEXT_TOKEN_BUDGET = 1500 # Estimated tokens of retrieved text per prompt, whatever is retrieved
+CONTEXT_SPARE_CHUNKS = 5 # Extra ranked chunks fetched to backfill dropped duplicates
+CONTEXT_DEDUP_THRESHOLD = 0.8 # Estimated Jaccard similarity above which a chunk counts as a duplicate
+MINHASH_PERMUTATIONS = 64
+# ---
+# --- Multi-PDF ingest pipeline ---
+INGEST_PROCESSES = max(1, (os.cpu_count() or 2) - 1) # Worker processes for parsing + chunking
+INGEST_QUEUE_SIZE = 8 # Parsed page windows allowed to wait between stages (backpressure)
+INGEST_WRITE_BATCH = 512 # Chunks per bulk collection.upsert call
+INGEST_WINDOW_PAGES = 25 # Pages parsed per task; also the granularity of resume checkpoints
+# ---
+
+# --- Semantic answer cache ---
+RESPONSE_CACHE_THRESHOLD = 0.95 # Minimum cosine similarity between query embeddings for a hit
+RESPONSE_CACHE_TTL = 60 * 60 # Seconds a cached answer stays valid
+RESPONSE_CACHE_MAX_ENTRIES = 500
+# ---
+
+# --- Chat history budget ---
+HISTORY_KEEP_TURNS = 6 # Most recent user/assistant exchanges kept verbatim
+HISTORY_TOKEN_BUDGET = 3000 # Estimated tokens allowed for the verbatim exchanges
+HISTORY_SUMMARY_MODEL = None # Model that writes the rolling summary (None = MODEL_NAME)
+# ---
+
+# --- Prompt layout and model residency ---
+# "stable": the system prompt never changes and each turn's retrieved context travels with
+# the latest user message, so Ollama can reuse its cached prompt prefix (the conversation so far).
+# "system": context is rewritten into the system prompt every turn (the original layout).
+PROMPT_LAYOUT = "stable"
+OLLAMA_KEEP_ALIVE = "30m" # How long Ollama keeps a model (and its prompt cache) loaded after a request
+# ---
+
+# --- Ollama client (shared by every module) ---
+OLLAMA_CONNECT_TIMEOUT = 3 # Seconds to open a connection to the server
+OLLAMA_READ_TIMEOUT = 120 # Longest wait for data, incl. between streamed tokens (covers loading a large model)
+OLLAMA_PROBE_TIMEOUT = 2 # Seconds a health probe may take
+OLLAMA_MAX_CONNECTIONS = 16 # Pooled keep-alive connections per client
+OLLAMA_RETRIES = 3 # Extra attempts after a transient failure (a generation is only re-sent if the server never got it)
+OLLAMA_RETRY_BASE_DELAY = 0.25 # Seconds; doubled every attempt, with full jitter
+OLLAMA_RETRY_MAX_DELAY = 4 # Cap on a single retry delay
+OLLAMA_BREAKER_THRESHOLD = 5 # Consecutive transport failures before calls start failing fast
+OLLAMA_BREAKER_RESET_SECONDS = 15 # How long to fail fast before letting one trial call through
+# ---
+
+# --- Ollama supervisor ---
+SUPERVISOR_MODELS = [MODEL_NAME, EMBEDDING_MODEL] + ([RERANK_MODEL] if RERANK_ENABLED else []) # Pulled if missing, loaded at startup and reloaded whenever Ollama unloads them
+SUPERVISOR_CHECK_INTERVAL = 15 # Seconds between background health probes (a dead server is restarted)
+SUPERVISOR_READY_TIMEOUT = 30 # Seconds to wait, with exponential backoff, for the server to answer
+# ---
+
+# --- Generation scheduling (shared by every chat session) ---
+GENERATION_MAX_CONCURRENT = 2 # Generations per model running at once; further requests queue in arrival order
+QUEUE_POLL_SECONDS = 0.5 # How often a waiting caller is told its queue position
+PREFETCH_TTL_SECONDS = 60 # A prefetched retrieval not used by its turn within this time is dropped
+PREFETCH_MAX_ENTRIES = 32 # Prefetched retrievals kept at once (oldest dropped first)
+# ---
+
+# --- Web lookups (Wikipedia, /search) ---
+WEB_CACHE_PATH = "./web_cache.sqlite3" # On-disk cache of web API responses and article summaries
+WEB_CACHE_MAX_ENTRIES = 5_000
+WEB_REQUEST_TIMEOUT = 8 # Seconds per HTTP request
+WIKI_ARTICLE_TTL = 6 * 60 * 60 # Seconds a fetched search result + article text is reused
+WIKI_SUMMARY_MODEL = None # Model that summarizes articles (None = MODEL_NAME)
+WIKI_SECTION_TOKENS = 1500 # Longer articles are summarized in parts of about this size, then combined
+WIKI_MAX_SECTIONS = 12 # Parts summarized per article (the tail of very long articles is skipped)
+WIKI_MAX_IN_FLIGHT = 2 # Part summaries generated in parallel
+WEB_SEARCH_TTL = 30 * 60 # Seconds a /search response is reused for the same (normalized) query
+WEB_SEARCH_MAX_RESULTS = 3
+WEB_CONTEXT_TTL = 30 * 60 # Seconds /search results stay retrievable as context in their chat session
+WEB_CONTEXT_CANDIDATES = 10 # Web passages considered per retrieval
+# ---
 
 FIXED_SYSTEM_INSTRUCTION = (
     "You are 'Joel', a helpful, professional, and highly capable AI assistant. "
@@ -0,0 +1,136 @@
+# In context_utils.py
+
+import re
+import zlib
+import random
+from chunking_utils import split_sentences
+from history_utils import estimate_tokens
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD, MINHASH_PERMUTATIONS
+
+# Universal hash family for MinHash: h(x) = (a * x + b) mod p, fixed seed so signatures are stable
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+                 for _ in range(MINHASH_PERMUTATIONS)]
+_CHUNK_INDEX = re.compile(r"_(\d+)$")
+
+# ----------------------------------------------------
+# Near-duplicate detection (MinHash over word shingles)
+# ----------------------------------------------------
+def shingles(text, size=3):
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def minhash(text):
+    """MinHash signature of a text; matching positions estimate the Jaccard similarity of two texts."""
+    hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text)]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+def estimated_similarity(signature_a, signature_b):
+    return sum(1 for a, b in zip(signature_a, signature_b) if a == b) / len(signature_a)
+
+def drop_near_duplicates(hits, threshold=CONTEXT_DEDUP_THRESHOLD):
+    """Keeps the first (most relevant) of every group of near-identical chunks, e.g. from re-uploaded PDFs."""
+    kept, signatures = [], []
+    for hit in hits:
+        signature = minhash(hit["document"])
+        if any(estimated_similarity(signature, other) >= threshold for other in signatures):
+            continue
+        kept.append(hit)
+        signatures.append(signature)
+    return kept
+
+# ----------------------------------------------------
+# Merging neighbouring chunks of the same page
+# ----------------------------------------------------
+def _chunk_position(hit):
+    """(source, page, index within page) from the page-local chunk id, or None."""
+    metadata = hit.get("metadata") or {}
+    match = _CHUNK_INDEX.search(hit["id"])
+    if match is None or "page" not in metadata:
+        return None
+    return metadata.get("source"), metadata["page"], int(match.group(1))
+
+def join_overlapping(first, second):
+    """Concatenates two consecutive chunks, dropping the sentences the second repeats from the first."""
+    sentences = split_sentences(second)
+    for count in range(len(sentences), 0, -1):
+        if first.endswith(" ".join(sentences[:count])):
+            return (first + " " + " ".join(sentences[count:])).strip()
+    return first + "\n" + second
+
+def merge_adjacent(hits):
+    """
+    Merges chunks that are consecutive on the same page into one block, placed at the rank
+    of its most relevant part, so the model reads the passage once and in order.
+    """
+    positions = {}
+    for rank, hit in enumerate(hits):
+        position = _chunk_position(hit)
+        if position is not None:
+            positions[position] = rank
+
+    merged, consumed = [], set()
+    for rank, hit in enumerate(hits):
+        if rank in consumed:
+            continue
+        position = _chunk_position(hit)
+        if position is None:
+            merged.append(hit)
+            continue
+        source, page, index = position
+        # Walk back to the first chunk of this consecutive run, then forward to its end
+        while (source, page, index - 1) in positions and positions[(source, page, index - 1)] not in consumed:
+            index -= 1
+        run = []
+        while (source, page, index) in positions and positions[(source, page, index)] not in consumed:
+            run.append(positions[(source, page, index)])
+            index += 1
+        consumed.update(run)
+
+        block = dict(hits[run[0]])
+        for part in run[1:]:
+            block["document"] = join_overlapping(block["document"], hits[part]["document"])
+        block["merged_ids"] = [hits[part]["id"] for part in run]
+        block["score"] = max(hits[part].get("score", 0.0) for part in run)
+        merged.append(block)
+    return merged
+
+# ----------------------------------------------------
+# Packing into a fixed token budget
+# ----------------------------------------------------
+def truncate_to_tokens(text, budget):
+    """Cuts text at a sentence boundary so it fits the token estimate."""
+    kept = []
+    for sentence in split_sentences(text):
+        if estimate_tokens(" ".join(kept + [sentence])) > budget:
+            break
+        kept.append(sentence)
+    return " ".join(kept)
+
+def assemble_context(hits, token_budget=CONTEXT_TOKEN_BUDGET, max_chunks=None):
+    """
+    Turns ranked hits into the context that goes into the prompt: near-duplicates removed,
+    neighbouring chunks of a page merged, then blocks taken in relevance order while they
+    fit token_budget (and max_chunks). The prompt size therefore no longer depends on what
+    happens to be retrieved.
+    """
+    blocks = merge_adjacent(drop_near_duplicates(hits))
+    packed, used = [], 0
+    for block in blocks:
+        if max_chunks is not None and len(packed) >= max_chunks:
+            break
+        tokens = estimate_tokens(block["document"])
+        if used + tokens <= token_budget:
+            packed.append(block)
+            used += tokens
+        elif not packed:
+            # Even the best block alone is too long: keep its leading sentences
+            text = truncate_to_tokens(block["document"], token_budget)
+            if text:
+                packed.append(dict(block, document=text))
+                used += estimate_tokens(text)
+        # Otherwise skip it: a smaller, less relevant block may still fit
+    return packed
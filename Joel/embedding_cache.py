@@ -0,0 +1,126 @@
+# In embedding_cache.py
+
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES
+
+# SQLite caps the number of bound parameters per statement
+_SQL_BATCH = 500
+
+# ----------------------------------------------------
+# On-disk embedding cache keyed by (model, text hash)
+# ----------------------------------------------------
+class EmbeddingCache:
+    """
+    Stores embeddings in SQLite as float32 blobs.
+    Entries are evicted least-recently-used first once max_entries is exceeded.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model, text):
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model, texts):
+        """Returns one embedding (or None on a miss) per text, in order."""
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+        now = time.time()
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), _SQL_BATCH):
+                batch = unique_keys[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+                if rows:
+                    hit_keys = [key for key, _ in rows]
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                        [now, *hit_keys],
+                    )
+            results = [found.get(key) for key in keys]
+            hits = sum(1 for result in results if result is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model, texts, embeddings):
+        """Stores embeddings for texts, then evicts the least recently used entries over the cap."""
+        now = time.time()
+        rows = {
+            self.make_key(model, text): (array("f", embedding).tobytes(), now)
+            for text, embedding in zip(texts, embeddings)
+        }
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                keys = list(rows)
+                existing = 0
+                for i in range(0, len(keys), _SQL_BATCH):
+                    batch = keys[i:i + _SQL_BATCH]
+                    existing += self._conn.execute(
+                        f"SELECT COUNT(*) FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                    ).fetchone()[0]
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(key, blob, used) for key, (blob, used) in rows.items()],
+                )
+                self._entries += len(rows) - existing
+                overflow = self._entries - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                        (overflow,),
+                    )
+                    self._entries -= overflow
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._entries,
+            "max_entries": self.max_entries,
+        }
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_embedding_cache():
+    """Returns the shared embedding cache, opening it on first use."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = EmbeddingCache()
+        return _CACHE
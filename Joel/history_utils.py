@@ -0,0 +1,151 @@
+# In history_utils.py
+
+import threading
+import ollama
+from colorama import Fore
+from config import MODEL_NAME, HISTORY_KEEP_TURNS, HISTORY_TOKEN_BUDGET, HISTORY_SUMMARY_MODEL, OLLAMA_KEEP_ALIVE
+
+SUMMARY_INSTRUCTION = (
+    "You maintain a running summary of a conversation between a user and the assistant 'Joel'. "
+    "Merge the new messages into the existing summary. Keep facts, names, numbers, decisions "
+    "and open questions; drop pleasantries. Reply with the updated summary only."
+)
+
+def estimate_tokens(text):
+    """Cheap token estimate (about 4 characters per token for English text)."""
+    return len(text) // 4 + 1
+
+def count_message_tokens(messages):
+    # A few tokens of per-message overhead for the role markers of the chat template
+    return sum(estimate_tokens(message["content"]) + 4 for message in messages)
+
+# ----------------------------------------------------
+# Token-budgeted chat history with a rolling summary
+# ----------------------------------------------------
+class ChatHistory:
+    """
+    Conversation state sent to the model on every turn.
+    The system prompt and the last `keep_turns` exchanges are kept verbatim; older
+    exchanges (or any that push the verbatim part over `token_budget`) are folded into
+    a running summary. Folding runs on a background thread, and the messages being
+    folded are still sent verbatim until their summary is ready, so a turn never
+    waits for summarization.
+    """
+
+    def __init__(self, client=None, keep_turns=HISTORY_KEEP_TURNS, token_budget=HISTORY_TOKEN_BUDGET,
+                 summary_model=HISTORY_SUMMARY_MODEL or MODEL_NAME, web_store=None):
+        self.client = client or ollama
+        # This conversation's /search results, retrievable as context (a web_context.SessionWebStore)
+        self.web_store = web_store
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.summary_model = summary_model
+        self._lock = threading.RLock()
+        self._system = None
+        self._summary = ""
+        self._folding = []      # Older messages currently being summarized
+        self._turns = []        # Recent messages, verbatim
+        self._generation = 0    # Bumped by clear(), so a late summary of old turns is discarded
+        self._summarizer = None
+
+    def __bool__(self):
+        return self._system is not None or bool(self._turns)
+
+    def __len__(self):
+        return len(self.messages())
+
+    # --- Building the conversation ---
+    def set_system(self, content):
+        with self._lock:
+            self._system = content
+
+    def add_user(self, content):
+        with self._lock:
+            self._turns.append({"role": "user", "content": content})
+
+    def add_assistant(self, content):
+        with self._lock:
+            self._turns.append({"role": "assistant", "content": content})
+            self._maybe_fold()
+
+    def discard_last_user(self):
+        """Drops the pending user message after a failed generation."""
+        with self._lock:
+            if self._turns and self._turns[-1]["role"] == "user":
+                self._turns.pop()
+
+    def clear(self):
+        with self._lock:
+            self._system = None
+            self._summary = ""
+            self._folding = []
+            self._turns = []
+            self._generation += 1
+        if self.web_store is not None:
+            self.web_store.clear()
+
+    def messages(self):
+        """The message list to send to the model."""
+        with self._lock:
+            messages = [{"role": "system", "content": self._system}] if self._system is not None else []
+            return messages + self.conversation()
+
+    def conversation(self):
+        """The conversation so far (summary of older turns, then recent turns), without the system prompt."""
+        with self._lock:
+            messages = []
+            if self._summary:
+                messages.append({"role": "system", "content": "Summary of the earlier conversation:\n" + self._summary})
+            return messages + self._folding + self._turns
+
+    def token_count(self):
+        return count_message_tokens(self.messages())
+
+    # --- Folding old turns into the summary ---
+    def _maybe_fold(self):
+        if self._summarizer is not None and self._summarizer.is_alive():
+            return # One fold at a time; the next turn will pick up whatever is left
+
+        # Exchanges start at user messages; keep the newest keep_turns of them verbatim
+        starts = [i for i, message in enumerate(self._turns) if message["role"] == "user"]
+        cut = starts[-self.keep_turns] if len(starts) > self.keep_turns else 0
+        # Fold further while the verbatim part is over budget (the last exchange always stays)
+        later_starts = [i for i in starts if i > cut]
+        while later_starts and count_message_tokens(self._turns[cut:]) > self.token_budget:
+            cut = later_starts.pop(0)
+        if cut == 0:
+            return
+
+        self._folding = self._turns[:cut]
+        self._turns = self._turns[cut:]
+        self._summarizer = threading.Thread(
+            target=self._summarize, args=(self._summary, list(self._folding), self._generation),
+            name="history-summarizer", daemon=True,
+        )
+        self._summarizer.start()
+
+    def _summarize(self, previous_summary, folding, generation):
+        transcript = "\n".join(f"{message['role'].upper()}: {message['content']}" for message in folding)
+        prompt = f"Existing summary:\n{previous_summary or '(none)'}\n\nNew messages:\n{transcript}"
+        try:
+            response = self.client.chat(
+                model=self.summary_model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_INSTRUCTION},
+                    {"role": "user", "content": prompt},
+                ],
+                keep_alive=OLLAMA_KEEP_ALIVE,
+            )
+            summary = response["message"]["content"].strip()
+        except Exception as e:
+            print(Fore.YELLOW + f"\n[History] Summarization failed, keeping older turns verbatim: {e}")
+            with self._lock:
+                if generation == self._generation:
+                    self._turns = self._folding + self._turns
+                    self._folding = []
+            return
+
+        with self._lock:
+            if generation == self._generation:
+                self._summary = summary
+                self._folding = []
@@ -0,0 +1,332 @@
+# In ingest_utils.py
+
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import pypdf
+from colorama import Fore
+from config import (
+    INGEST_PROCESSES, INGEST_QUEUE_SIZE, INGEST_WRITE_BATCH, INGEST_WINDOW_PAGES,
+    CHROMA_COLLECTION as CHROMA_NAME
+)
+from chunking_utils import get_chunker, chunk_params_for
+
+# Marks the end of the work flowing into a stage
+_DONE = object()
+
+# The collection's chunking strategy (see chunking_utils)
+CHUNKER = get_chunker(**chunk_params_for(CHROMA_NAME))
+# Chunking settings recorded in the index manifest; changing them forces a re-index
+CHUNK_PARAMS = {**CHUNKER.params(), "chunk_ids": "page"}
+
+# ----------------------------------------------------
+# Parsing and chunking (runs inside the worker processes)
+# ----------------------------------------------------
+def chunk_page(filename, page_num, text, prev_text=None, next_text=None):
+    """
+    Chunks the text of one page (page_num is 0-indexed).
+    prev_text / next_text are the neighbouring pages, so chunks can continue across page breaks.
+    Chunk IDs are page-local (filename + page + index), so any range of pages can be
+    written, or re-written after an interruption, without knowing what came before.
+    """
+    documents, metadatas, ids = [], [], []
+    stem = filename.replace('.pdf', '')
+    chunks = CHUNKER.split_page(text, prev_text, next_text)
+    for chunk in chunks:
+        if chunk.strip():
+            documents.append(chunk)
+            # Metadata reflects the page number (1-indexed)
+            metadatas.append({"source": filename, "page": page_num + 1})
+            ids.append(f"{stem}_p{page_num + 1}_{len(ids)}")
+    return documents, metadatas, ids
+
+def page_windows(start_page, total_pages, window_pages=INGEST_WINDOW_PAGES):
+    """Splits pages [start_page, total_pages) into windows. Always yields at least one (possibly empty) window."""
+    windows = [(s, min(s + window_pages, total_pages)) for s in range(start_page, total_pages, window_pages)]
+    return windows or [(total_pages, total_pages)]
+
+def count_pdf_pages(path):
+    with open(path, "rb") as f:
+        return len(pypdf.PdfReader(f).pages)
+
+def _chunk_window(reader, filename, start_page, end_page):
+    documents, metadatas, ids = [], [], []
+    # One page of context on each side of the window, for chunks that cross page breaks
+    first, last = max(start_page - 1, 0), min(end_page + 1, len(reader.pages))
+    texts = {page_num: reader.pages[page_num].extract_text() or "" for page_num in range(first, last)}
+    for page_num in range(start_page, end_page):
+        page_documents, page_metadatas, page_ids = chunk_page(
+            filename, page_num, texts[page_num], texts.get(page_num - 1), texts.get(page_num + 1))
+        documents.extend(page_documents)
+        metadatas.extend(page_metadatas)
+        ids.extend(page_ids)
+    return documents, metadatas, ids
+
+def extract_pdf_window(path, filename, start_page, end_page, total_pages):
+    """
+    Parses and chunks pages [start_page, end_page) of one PDF.
+    Returns (filename, start_page, end_page, total_pages, documents, metadatas, ids, error)
+    so it can be shipped back from a worker process.
+    """
+    try:
+        with open(path, "rb") as f:
+            reader = pypdf.PdfReader(f)
+            documents, metadatas, ids = _chunk_window(reader, filename, start_page, end_page)
+    except Exception as e:
+        return filename, start_page, end_page, total_pages, [], [], [], str(e)
+    return filename, start_page, end_page, total_pages, documents, metadatas, ids, None
+
+def iter_pdf_windows(path, filename, start_page=0, window_pages=INGEST_WINDOW_PAGES):
+    """
+    Generator over one PDF: yields the same tuples as extract_pdf_window, one page
+    window at a time, from a single open reader. Only one window's chunks are ever in memory.
+    """
+    try:
+        with open(path, "rb") as f:
+            reader = pypdf.PdfReader(f)
+            total_pages = len(reader.pages)
+            for window_start, window_end in page_windows(start_page, total_pages, window_pages):
+                documents, metadatas, ids = _chunk_window(reader, filename, window_start, window_end)
+                yield filename, window_start, window_end, total_pages, documents, metadatas, ids, None
+    except Exception as e:
+        yield filename, start_page, start_page, -1, [], [], [], str(e)
+
+# ----------------------------------------------------
+# Per-stage throughput counters
+# ----------------------------------------------------
+class StageCounter:
+    """Counts the page windows and chunks one pipeline stage has handled, and the time it spent busy."""
+
+    def __init__(self, name):
+        self.name = name
+        self.windows = 0
+        self.chunks = 0
+        self.busy_seconds = 0.0
+
+    def record(self, windows, chunks, seconds):
+        self.windows += windows
+        self.chunks += chunks
+        self.busy_seconds += seconds
+
+    def summary(self, wall_seconds):
+        busy = self.busy_seconds or 1e-9
+        return (f"{self.name:<6} {self.windows:>5} window(s) {self.chunks:>7} chunks | "
+                f"{self.chunks / busy:8.1f} chunks/s busy | "
+                f"{self.chunks / max(wall_seconds, 1e-9):8.1f} chunks/s wall | "
+                f"{100 * self.busy_seconds / max(wall_seconds, 1e-9):5.1f}% busy")
+
+# ----------------------------------------------------
+# Checkpoint tracking: which page prefix of each file is safely in Chroma
+# ----------------------------------------------------
+class _PageProgress:
+    """
+    Windows can finish out of order; a file's checkpoint only advances over the
+    contiguous run of committed pages starting at the page it was resumed from.
+    """
+
+    def __init__(self, on_progress):
+        self._on_progress = on_progress
+        self._next_page = {}
+        self._committed = {}
+        self.completed = set()
+
+    def start(self, filename, start_page):
+        self._next_page[filename] = start_page
+        self._committed[filename] = {}
+
+    def commit(self, filename, start_page, end_page, total_pages, chunk_count):
+        committed = self._committed[filename]
+        committed[start_page] = (end_page, chunk_count)
+        next_page = self._next_page[filename]
+        advanced_chunks = 0
+        while next_page in committed:
+            window_end, window_chunks = committed.pop(next_page)
+            advanced_chunks += window_chunks
+            if window_end == next_page:
+                # Empty window: only produced for files with no pages left to read
+                break
+            next_page = window_end
+        self._next_page[filename] = next_page
+        if next_page >= total_pages:
+            self.completed.add(filename)
+        if self._on_progress:
+            self._on_progress(filename, next_page, total_pages, advanced_chunks)
+
+# ----------------------------------------------------
+# Staged pipeline: parse (processes) -> embed (thread) -> write (thread)
+# ----------------------------------------------------
+def run_ingest_pipeline(pdf_jobs, collection, embed_fn, on_progress=None, on_written=None,
+                        processes=INGEST_PROCESSES,
+                        queue_size=INGEST_QUEUE_SIZE, write_batch=INGEST_WRITE_BATCH,
+                        window_pages=INGEST_WINDOW_PAGES):
+    """
+    Ingests PDFs as a stream of page windows.
+    pdf_jobs is a list of (path, filename, start_page). Parsing and chunking run in a
+    process pool (or in-process, window by window, for a single file), embedding runs in
+    its own thread, and a single writer upserts into the collection in slices of exactly
+    write_batch chunks. Bounded queues between the stages provide backpressure, so memory
+    stays bounded by the queue sizes whatever the document sizes are.
+    on_progress(filename, next_page, total_pages, new_chunks) is called from the writer
+    whenever a file's committed page prefix grows; next_page is the resume point.
+    on_written(ids, documents, metadatas) is called after every successful upsert.
+    Returns a dict of per-file chunk counts, completed files, errors and the stage counters.
+    """
+    embed_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    counters = {name: StageCounter(name) for name in ("parse", "embed", "write")}
+    progress = _PageProgress(on_progress)
+    chunks_per_file = {}
+    errors = []
+    failed = set()
+    start = time.perf_counter()
+
+    def fail(filename, error):
+        errors.append((filename, error))
+        failed.add(filename)
+
+    def embed_stage():
+        while True:
+            item = embed_queue.get()
+            if item is _DONE:
+                write_queue.put(_DONE)
+                return
+            window, documents, metadatas, ids = item
+            embeddings = []
+            if ids:
+                t0 = time.perf_counter()
+                try:
+                    embeddings = embed_fn(documents)
+                except Exception as e:
+                    fail(window[0], f"embedding failed: {e}")
+                    continue
+                counters["embed"].record(1, len(ids), time.perf_counter() - t0)
+            write_queue.put((window, documents, metadatas, ids, embeddings))
+
+    def write_stage():
+        pending = {"documents": [], "metadatas": [], "ids": [], "embeddings": []}
+        # (window, first offset, end offset) of every window not yet committed; offsets are
+        # relative to the start of pending, so a window is fully written once end <= 0
+        pending_windows = collections.deque()
+
+        def commit_ready():
+            while pending_windows and pending_windows[0][2] <= 0:
+                (filename, start_page, end_page, total_pages), first, end = pending_windows.popleft()
+                if filename not in failed:
+                    progress.commit(filename, start_page, end_page, total_pages, end - first)
+
+        def flush(size):
+            t0 = time.perf_counter()
+            batch = {key: values[:size] for key, values in pending.items()}
+            try:
+                # Upsert, so pages re-read after a resume simply overwrite themselves
+                collection.upsert(**batch)
+                counters["write"].record(0, len(batch["ids"]), time.perf_counter() - t0)
+                if on_written:
+                    on_written(batch["ids"], batch["documents"], batch["metadatas"])
+                for metadata in batch["metadatas"]:
+                    source = metadata["source"]
+                    chunks_per_file[source] = chunks_per_file.get(source, 0) + 1
+            except Exception as e:
+                for filename in sorted({metadata["source"] for metadata in batch["metadatas"]}):
+                    fail(filename, f"write to Chroma failed: {e}")
+            for values in pending.values():
+                del values[:size]
+            for i, (window, first, end) in enumerate(pending_windows):
+                pending_windows[i] = (window, first - size, end - size)
+            commit_ready()
+
+        while True:
+            item = write_queue.get()
+            if item is _DONE:
+                while pending["ids"]:
+                    flush(write_batch)
+                commit_ready()
+                return
+            window, documents, metadatas, ids, embeddings = item
+            offset = len(pending["ids"])
+            pending["documents"].extend(documents)
+            pending["metadatas"].extend(metadatas)
+            pending["ids"].extend(ids)
+            pending["embeddings"].extend(embeddings)
+            pending_windows.append((window, offset, offset + len(ids)))
+            counters["write"].record(1, 0, 0.0)
+            while len(pending["ids"]) >= write_batch:
+                flush(write_batch)
+            commit_ready()
+
+    embed_thread = threading.Thread(target=embed_stage, name="ingest-embed", daemon=True)
+    write_thread = threading.Thread(target=write_stage, name="ingest-write", daemon=True)
+    embed_thread.start()
+    write_thread.start()
+
+    def hand_off(result, seconds):
+        filename, start_page, end_page, total_pages, documents, metadatas, ids, error = result
+        if error:
+            fail(filename, error)
+            return
+        if filename in failed:
+            return
+        counters["parse"].record(1, len(ids), seconds)
+        # Blocks while the embed queue is full: this is the backpressure point
+        embed_queue.put(((filename, start_page, end_page, total_pages), documents, metadatas, ids))
+
+    try:
+        for _, filename, start_page in pdf_jobs:
+            progress.start(filename, start_page)
+
+        if processes <= 1 or len(pdf_jobs) <= 1:
+            # Generator path: one page window of one file in memory at a time
+            for path, filename, start_page in pdf_jobs:
+                t0 = time.perf_counter()
+                for result in iter_pdf_windows(path, filename, start_page, window_pages):
+                    hand_off(result, time.perf_counter() - t0)
+                    t0 = time.perf_counter()
+        else:
+            def window_tasks():
+                for path, filename, start_page in pdf_jobs:
+                    try:
+                        total_pages = count_pdf_pages(path)
+                    except Exception as e:
+                        fail(filename, str(e))
+                        continue
+                    for window_start, window_end in page_windows(start_page, total_pages, window_pages):
+                        yield path, filename, window_start, window_end, total_pages
+
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                tasks = window_tasks()
+                in_flight = {}
+                # Never keep more parsed-but-unconsumed windows around than the pool plus the queue can hold
+                max_in_flight = processes + queue_size
+                while True:
+                    while len(in_flight) < max_in_flight:
+                        task = next(tasks, None)
+                        if task is None:
+                            break
+                        in_flight[pool.submit(extract_pdf_window, *task)] = (task[1], time.perf_counter())
+                    if not in_flight:
+                        break
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        filename, submitted = in_flight.pop(future)
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            fail(filename, str(e))
+                            continue
+                        hand_off(result, time.perf_counter() - submitted)
+    finally:
+        embed_queue.put(_DONE)
+        embed_thread.join()
+        write_thread.join()
+
+    wall_seconds = time.perf_counter() - start
+    for filename, error in errors:
+        print(Fore.RED + f"Error loading {filename}: {error}")
+    print(Fore.WHITE + f"[Ingest] Pipeline finished in {wall_seconds:.2f}s")
+    for counter in counters.values():
+        print(Fore.WHITE + "[Ingest] " + counter.summary(wall_seconds))
+
+    return {"chunks_per_file": chunks_per_file, "completed": progress.completed - failed,
+            "errors": errors, "counters": counters, "seconds": wall_seconds}
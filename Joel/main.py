@@ -1,24 +1,44 @@
 import sys
+from startup_utils import StartupTasks
 from colorama import init
 init(autoreset=True)
-import chromadb
 
 from config import MODEL_NAME
-# --- CRITICAL FIX: Updated import for web_search_lookup ---
-# The wikipedia_lookup is no longer needed in this file
-from ollama_utils import ensure_ollama_running, web_search_lookup
-from pdf_utils import handle_upload, load_pdfs_into_context
-from chat_utils import stream_response
 from input_utils import get_multiline_input
+# chromadb, ollama and pypdf (via pdf_utils, ollama_utils and chat_utils) are imported by
+# the background startup below, so the prompt appears before they finish loading.
 # from wikipedia_lookup import wikipedia_lookup   # <-- REMOVED THIS IMPORT
 
-# These functions can cause the program to hang if the server/db fails
-ensure_ollama_running()
-load_pdfs_into_context()
+STARTUP = StartupTasks()
+
+def _import_runtime():
+    STARTUP.import_modules("chromadb", "ollama", "pypdf", "pdf_utils", "rag_utils", "async_chat",
+                           "chat_utils", "ollama_utils")
+
+def _check_ollama():
+    from ollama_utils import ensure_ollama_running
+    ensure_ollama_running()
+    # Load the chat model (and cache the system prompt) while the PDFs sync
+    from async_chat import warm_chat_model
+    warm_chat_model()
+
+def _load_index():
+    from pdf_utils import load_pdfs_into_context
+    # Incremental sync: only new or changed PDFs are embedded
+    load_pdfs_into_context(clear_existing=False)
+
+def _print_report_when_done():
+    for name in ("ollama", "index"):  # Both run at the same time; either may finish last
+        try:
+            STARTUP.wait(name)
+        except RuntimeError:
+            pass # Already reported by the startup thread; the report shows which stage failed
+    print("\n" + STARTUP.report())
 
 def run_chat():
     print("🤖 Joel AI Assistant Initializing...")
 
+    STARTUP.mark("prompt shown")
     while True:
         start = input("Start Chat (type 'hey joel'): ").strip().lower()
         if start == "hey joel":
@@ -40,28 +60,66 @@ def run_chat():
             print("Goodbye 👋")
             break
 
-        # Upload PDF
-        if user_input.lower() == "/upload":
-            handle_upload()
+        # Startup timings (background stages and imports)
+        if user_input.lower() == "/startup":
+            print(STARTUP.report() + "\n")
             continue
 
-        # Real-time Web Search Command (Fixed /look function)
-        if user_input.lower().startswith("/search "):
-            query = user_input[8:].strip()
-            if not query:
-                # Updated hint to reflect the new command's capability
-                print("❌ Please provide a query: /search latest rcb win")
+        try:
+            # Ollama server and model health (kept up to date by the supervisor)
+            if user_input.lower() == "/health":
+                STARTUP.wait("imports", "⏳ Still starting up...")
+                from ollama_utils import get_supervisor
+                print(get_supervisor().report() + "\n")
                 continue
 
-            # This calls the new function in ollama_utils.py
-            results = web_search_lookup(query)
-            print(results + "\n")
-            continue
+            # Upload PDF
+            if user_input.lower() == "/upload":
+                STARTUP.wait("index", "⏳ Still loading your documents...")
+                from pdf_utils import handle_upload
+                handle_upload()
+                continue
+
+            # Real-time Web Search Command (Fixed /look function)
+            if user_input.lower().startswith("/search "):
+                query = user_input[8:].strip()
+                if not query:
+                    # Updated hint to reflect the new command's capability
+                    print("❌ Please provide a query: /search latest rcb win")
+                    continue
+
+                # Web search needs the Ollama server, but not the document index
+                STARTUP.wait("ollama", "⏳ Waiting for the Ollama server...")
+                from ollama_utils import web_search_lookup
+                from pdf_utils import CHAT_HISTORY
+                # Results also become context for follow-up questions
+                results = web_search_lookup(query, web_store=CHAT_HISTORY.web_store)
+                print(results + "\n")
+                continue
 
-        # Regular conversation
-        if user_input.strip():
-            stream_response(user_input, MODEL_NAME)
+            # Regular conversation
+            if user_input.strip():
+                STARTUP.wait("index", "⏳ Still loading your documents...")
+                from chat_utils import stream_response
+                stream_response(user_input, MODEL_NAME)
+                if "first answer" not in STARTUP.marks:
+                    STARTUP.mark("first answer")
+        except RuntimeError as e:
+            print(f"❌ {e}\n")
 
 
 if __name__ == "__main__":
-    run_chat()
\ No newline at end of file
+    # Startup work runs in the background, each stage as soon as the stages it needs are
+    # done (the index loads while Ollama starts); each chat command waits only for the
+    # stage it needs. It stays under the main guard because the ingest
+    # pipeline's worker processes re-import this module on platforms that spawn.
+    STARTUP.add("imports", _import_runtime)
+    STARTUP.add("ollama", _check_ollama, needs=("imports",))
+    # Loading the index does not wait for the server check: unchanged PDFs load without Ollama
+    STARTUP.add("index", _load_index, needs=("imports",))
+    STARTUP.start()
+    if "--startup-report" in sys.argv:
+        # Printed once everything has loaded; /startup shows it at any time
+        import threading
+        threading.Thread(target=_print_report_when_done, daemon=True).start()
+    run_chat()
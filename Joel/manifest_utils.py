@@ -0,0 +1,101 @@
+# In manifest_utils.py
+
+import hashlib
+import json
+import os
+from config import INDEX_MANIFEST_PATH
+
+MANIFEST_VERSION = 1
+
+# ----------------------------------------------------
+# Manifest of indexed PDFs (stored next to chroma_db)
+# ----------------------------------------------------
+def empty_manifest(index_params):
+    # in_progress holds resume checkpoints of files whose ingest has not finished
+    return {"version": MANIFEST_VERSION, "index_params": index_params, "files": {}, "in_progress": {}}
+
+def load_manifest(index_params, path=INDEX_MANIFEST_PATH):
+    """
+    Loads the manifest of indexed files.
+    Returns an empty manifest if the file is missing, unreadable, or was written
+    with different chunking/embedding parameters (everything must be re-indexed then).
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return empty_manifest(index_params)
+
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("index_params") != index_params:
+        return empty_manifest(index_params)
+    manifest.setdefault("files", {})
+    manifest.setdefault("in_progress", {})
+    return manifest
+
+def save_manifest(manifest, path=INDEX_MANIFEST_PATH):
+    """Writes the manifest atomically so a crash never leaves a half-written file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def hash_file(path, block_size=1024 * 1024):
+    """SHA-256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_record(path, file_hash=None, chunk_count=0, page_count=None):
+    stat = os.stat(path)
+    return {
+        "hash": file_hash or hash_file(path),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "chunks": chunk_count,
+        "pages": page_count,
+    }
+
+def corpus_signature(manifest):
+    """Short fingerprint of the indexed corpus; changes whenever any file's chunks change."""
+    state = {
+        "index_params": manifest["index_params"],
+        "files": {name: [record["hash"], record.get("chunks", 0)] for name, record in manifest["files"].items()},
+        "in_progress": manifest.get("in_progress", {}),
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()
+
+def plan_sync(manifest, pdf_jobs):
+    """
+    Compares the PDFs on disk with the manifest.
+    pdf_jobs is a list of (path, filename). Returns (changed, removed, unchanged):
+    changed is the subset of pdf_jobs that is new or modified, removed lists the
+    filenames in the manifest that are gone from disk. Files whose size and mtime
+    still match are trusted without hashing; otherwise the hash decides.
+    """
+    files = manifest["files"]
+    changed, unchanged = [], []
+    on_disk = set()
+
+    for path, filename in pdf_jobs:
+        on_disk.add(filename)
+        record = files.get(filename)
+        if record is None:
+            changed.append((path, filename))
+            continue
+
+        stat = os.stat(path)
+        if stat.st_size == record.get("size") and stat.st_mtime == record.get("mtime"):
+            unchanged.append(filename)
+            continue
+
+        # Touched but possibly identical (e.g. copied over itself): let the content decide
+        if stat.st_size == record.get("size") and hash_file(path) == record.get("hash"):
+            record["mtime"] = stat.st_mtime
+            unchanged.append(filename)
+        else:
+            changed.append((path, filename))
+
+    removed = [filename for filename in files if filename not in on_disk]
+    return changed, removed, unchanged
@@ -0,0 +1,316 @@
+# In ollama_client.py
+
+import asyncio
+import random
+import threading
+import time
+import httpx
+import ollama
+from colorama import Fore
+from config import (
+    OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT, OLLAMA_MAX_CONNECTIONS, OLLAMA_RETRIES,
+    OLLAMA_RETRY_BASE_DELAY, OLLAMA_RETRY_MAX_DELAY, OLLAMA_BREAKER_THRESHOLD,
+    OLLAMA_BREAKER_RESET_SECONDS, OLLAMA_PROBE_TIMEOUT
+)
+
+class OllamaUnavailableError(ConnectionError):
+    """Raised without contacting the server while the circuit breaker is open."""
+
+# The request never reached the server: any call can be sent again
+_UNSENT_ERRORS = (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# The connection failed after the request went out: only cheap, idempotent calls are re-sent
+_INTERRUPTED_ERRORS = (httpx.ReadTimeout, httpx.WriteTimeout, httpx.ReadError, httpx.WriteError,
+                       httpx.RemoteProtocolError)
+# The server turned the request away before doing any work (Ollama answers 503 when its queue is full)
+_BUSY_STATUSES = (429, 503)
+
+def classify_failure(error):
+    """
+    "busy", "unsent" or "interrupted" for failures worth retrying, None for everything else
+    (unknown model, bad request, ...), which would fail the same way again.
+    """
+    if isinstance(error, OllamaUnavailableError):
+        return None
+    if isinstance(error, ollama.ResponseError):
+        if error.status_code in _BUSY_STATUSES:
+            return "busy"
+        return "interrupted" if error.status_code in (502, 504) else None
+    if isinstance(error, _UNSENT_ERRORS):
+        return "unsent"
+    if isinstance(error, _INTERRUPTED_ERRORS):
+        return "interrupted"
+    return None
+
+# ----------------------------------------------------
+# Circuit breaker (one per server, shared by its sync and async clients)
+# ----------------------------------------------------
+class CircuitBreaker:
+    """
+    After `threshold` consecutive transport failures the circuit opens and calls fail at once
+    with OllamaUnavailableError instead of each waiting out its own timeouts. After
+    reset_seconds one trial call is let through: success closes the circuit, failure re-opens it.
+    """
+
+    def __init__(self, threshold=OLLAMA_BREAKER_THRESHOLD, reset_seconds=OLLAMA_BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"  # closed | open | half-open
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            if self.state == "open":
+                retry_in = self.opened_at + self.reset_seconds - time.monotonic()
+                if retry_in <= 0:
+                    # This caller makes the trial call
+                    self.state, self.opened_at = "half-open", time.monotonic()
+                    return
+                raise OllamaUnavailableError(
+                    f"Ollama is unavailable after {self.failures} failed requests; trying again in {retry_in:.0f}s.")
+            if time.monotonic() - self.opened_at > self.reset_seconds:
+                # The trial call never reported back (e.g. it was cancelled): let another one try
+                self.opened_at = time.monotonic()
+                return
+            raise OllamaUnavailableError("Ollama is unavailable; checking whether it is back.")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(Fore.GREEN + "[Ollama] Server reachable again; circuit closed.")
+            self.state, self.failures, self.opened_at = "closed", 0, None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or (self.state == "closed" and self.failures >= self.threshold):
+                if self.state == "closed":
+                    print(Fore.RED + f"[Ollama] {self.failures} requests failed in a row; "
+                                     f"failing fast for {self.reset_seconds}s.")
+                self.state, self.opened_at = "open", time.monotonic()
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+_BREAKERS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+def breaker_for(host):
+    """The circuit breaker of a server, shared by every client that talks to it."""
+    with _BREAKERS_LOCK:
+        if host not in _BREAKERS:
+            _BREAKERS[host] = CircuitBreaker()
+        return _BREAKERS[host]
+
+# ----------------------------------------------------
+# Pooled clients with retries
+# ----------------------------------------------------
+class _PooledClientBase:
+    """Settings shared by the sync and async clients."""
+
+    client_class = None
+
+    def __init__(self, host, connect_timeout=OLLAMA_CONNECT_TIMEOUT, read_timeout=OLLAMA_READ_TIMEOUT,
+                 max_connections=OLLAMA_MAX_CONNECTIONS, retries=OLLAMA_RETRIES, breaker=None):
+        self.host = host
+        self.retries = retries
+        self.breaker = breaker or breaker_for(host)
+        # One keep-alive connection pool per client; read_timeout bounds every wait for
+        # data, including the gap between streamed tokens, so a stalled server cannot hang a UI
+        self._client = self.client_class(
+            host=host,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                                keepalive_expiry=60),
+        )
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "fast_failures": 0}
+
+    def _should_retry(self, error, idempotent, attempt):
+        """Records the failure with the breaker and decides whether to send the request again."""
+        kind = classify_failure(error)
+        if isinstance(error, OllamaUnavailableError):
+            self.stats["fast_failures"] += 1
+            return False
+        if kind is None or kind == "busy":
+            # The server answered, so it is up
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        # A generation that reached the server is never re-sent: it may already have run for seconds
+        retry = kind in ("busy", "unsent") or (kind == "interrupted" and idempotent)
+        if not retry or attempt >= self.retries:
+            self.stats["failures"] += 1
+            return False
+        self.stats["retries"] += 1
+        return True
+
+    @staticmethod
+    def _delay(attempt):
+        # Exponential backoff with full jitter, so retrying callers do not arrive together
+        return random.uniform(0, min(OLLAMA_RETRY_MAX_DELAY, OLLAMA_RETRY_BASE_DELAY * 2 ** attempt))
+
+class PooledOllamaClient(_PooledClientBase):
+    """
+    Drop-in replacement for ollama.Client (chat, generate, embed, list, ps, show, pull) used by
+    every module: pooled keep-alive connections, bounded timeouts, retries with jitter for
+    transient failures, and a circuit breaker that fails fast while the server is down.
+    """
+
+    client_class = ollama.Client
+
+    def __init__(self, host, **settings):
+        super().__init__(host, **settings)
+        # Health probes get their own short timeout and skip the breaker (see probe)
+        self._probe_client = ollama.Client(host=host, timeout=httpx.Timeout(OLLAMA_PROBE_TIMEOUT))
+
+    def _call(self, method, idempotent, *args, **kwargs):
+        self.stats["calls"] += 1
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+                result = getattr(self._client, method)(*args, **kwargs)
+            except Exception as e:
+                if not self._should_retry(e, idempotent, attempt):
+                    raise
+                time.sleep(self._delay(attempt))
+                attempt += 1
+            else:
+                self.breaker.record_success()
+                return result
+
+    def _stream(self, method, idempotent, *args, **kwargs):
+        """Streams a response; retried only while nothing has arrived yet."""
+        self.stats["calls"] += 1
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+                parts = getattr(self._client, method)(*args, stream=True, **kwargs)
+                first = next(parts, None)
+            except Exception as e:
+                if not self._should_retry(e, idempotent, attempt):
+                    raise
+                time.sleep(self._delay(attempt))
+                attempt += 1
+            else:
+                break
+        self.breaker.record_success()
+        if first is None:
+            return
+        yield first
+        try:
+            yield from parts
+        except Exception as e:
+            if classify_failure(e) is not None:
+                self.breaker.record_failure()
+            raise
+
+    def chat(self, *args, stream=False, **kwargs):
+        if stream:
+            return self._stream("chat", False, *args, **kwargs)
+        return self._call("chat", False, *args, **kwargs)
+
+    def generate(self, *args, stream=False, **kwargs):
+        if stream:
+            return self._stream("generate", False, *args, **kwargs)
+        return self._call("generate", False, *args, **kwargs)
+
+    def embed(self, *args, **kwargs):
+        return self._call("embed", True, *args, **kwargs)
+
+    def list(self):
+        return self._call("list", True)
+
+    def ps(self):
+        return self._call("ps", True)
+
+    def show(self, model):
+        return self._call("show", True, model)
+
+    def pull(self, model, **kwargs):
+        """
+        Downloads a model and returns the final status. Progress is streamed, so the read
+        timeout bounds the wait for each progress event instead of the whole download
+        (a non-streamed pull sends nothing back until it is complete).
+        """
+        status = None
+        for status in self._stream("pull", True, model, **kwargs):
+            pass
+        return status
+
+    def probe(self):
+        """
+        One health check against /api/ps, bypassing the breaker (so it can tell when the server
+        is back). Returns the round trip in ms; raises on failure. Success closes the circuit.
+        """
+        t0 = time.perf_counter()
+        self._probe_client.ps()
+        self.breaker.record_success()
+        return (time.perf_counter() - t0) * 1000
+
+class AsyncPooledOllamaClient(_PooledClientBase):
+    """The asyncio counterpart of PooledOllamaClient (chat, generate, embed), for the chat engine."""
+
+    client_class = ollama.AsyncClient
+
+    async def _call(self, method, idempotent, *args, **kwargs):
+        self.stats["calls"] += 1
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+                result = await getattr(self._client, method)(*args, **kwargs)
+            except Exception as e:
+                if not self._should_retry(e, idempotent, attempt):
+                    raise
+                await asyncio.sleep(self._delay(attempt))
+                attempt += 1
+            else:
+                self.breaker.record_success()
+                return result
+
+    async def _stream(self, method, idempotent, *args, **kwargs):
+        """Streams a response; retried only while nothing has arrived yet."""
+        self.stats["calls"] += 1
+        attempt = 0
+        while True:
+            try:
+                self.breaker.before_call()
+                parts = await getattr(self._client, method)(*args, stream=True, **kwargs)
+                first = await anext(parts, None)
+            except Exception as e:
+                if not self._should_retry(e, idempotent, attempt):
+                    raise
+                await asyncio.sleep(self._delay(attempt))
+                attempt += 1
+            else:
+                break
+        self.breaker.record_success()
+        if first is None:
+            return
+        yield first
+        try:
+            async for part in parts:
+                yield part
+        except Exception as e:
+            if classify_failure(e) is not None:
+                self.breaker.record_failure()
+            raise
+
+    async def chat(self, *args, stream=False, **kwargs):
+        if stream:
+            return self._stream("chat", False, *args, **kwargs)
+        return await self._call("chat", False, *args, **kwargs)
+
+    async def generate(self, *args, stream=False, **kwargs):
+        if stream:
+            return self._stream("generate", False, *args, **kwargs)
+        return await self._call("generate", False, *args, **kwargs)
+
+    async def embed(self, *args, **kwargs):
+        return await self._call("embed", True, *args, **kwargs)
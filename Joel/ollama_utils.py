@@ -1,93 +1,321 @@
 # In ollama_utils.py
 
 import subprocess
+import threading
 import time
-import requests
+from urllib.parse import urlparse
 import ollama
 from colorama import Fore
 # Import MODEL_NAME and COLOR_ variables for the new web_search_lookup function
-from config import EMBEDDING_MODEL, MODEL_NAME, COLOR_WARN, COLOR_INFO 
-from pdf_utils import OLLAMA_HOST 
+from config import (
+    EMBEDDING_MODEL, MODEL_NAME, COLOR_WARN, COLOR_INFO, OLLAMA_KEEP_ALIVE,
+    SUPERVISOR_MODELS, SUPERVISOR_CHECK_INTERVAL, SUPERVISOR_READY_TIMEOUT, WEB_SEARCH_TTL, WEB_SEARCH_MAX_RESULTS
+)
+from pdf_utils import OLLAMA_HOST, OLLAMA_CLIENT
+from web_cache import get_web_cache
 
-def ensure_ollama_running():
-    
-    # Use the explicit host defined in pdf_utils for consistency
-    ollama_url = f"{OLLAMA_HOST}/api/tags" # Should be http://127.0.0.1:11434/api/tags
-    
-    try:
-        # Check 1: Is it already running?
-        requests.get(ollama_url, timeout=1)
-        # If successful, we skip the rest.
-        print(Fore.GREEN + "✅ Ollama server is already running.")
-    except:
-        # Check 2: If not running, start it
-        print(Fore.YELLOW + "⚡ Starting Ollama server in background...")
-        # Start Ollama with the host variable set explicitly, matching the Python client
-        # Note: This works best if you set OLLAMA_HOST environment variable before running main.py
-        # For Popen, we keep it simple, relying on the client fix.
-        subprocess.Popen(["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        # Wait loop for the server to start (INCREASED RETRIES)
-        for i in range(60): # Increased from 40 tries to 60 (30 seconds total)
+def _model_names(models):
+    """Model names as Ollama reports them, plus the bare name for ':latest' tags."""
+    names = set()
+    for model in models:
+        names.add(model.model)
+        if model.model.endswith(":latest"):
+            names.add(model.model[:-len(":latest")])
+    return names
+
+# ----------------------------------------------------
+# Ollama server supervisor: readiness, model residency, health
+# ----------------------------------------------------
+class OllamaSupervisor:
+    """
+    Looks after the Ollama server for the whole session. start() waits for the server
+    (launching `ollama serve` if nothing answers) with exponential backoff, pulls missing
+    models and loads them. A background thread then probes the server every check_interval
+    seconds, restarts it if it stops answering, and reloads any model Ollama has unloaded,
+    so the first question after an idle spell does not pay for a model load.
+    health() is the state shown by the CLI's /health command and the GUI sidebar.
+    """
+
+    def __init__(self, host=OLLAMA_HOST, client=OLLAMA_CLIENT, models=SUPERVISOR_MODELS,
+                 check_interval=SUPERVISOR_CHECK_INTERVAL, ready_timeout=SUPERVISOR_READY_TIMEOUT):
+        self.host = host
+        self.client = client
+        self.models = list(dict.fromkeys(models))
+        self.check_interval = check_interval
+        self.ready_timeout = ready_timeout
+        # Only a server on this machine can be (re)started from here
+        self.manages_server = urlparse(host).hostname in ("127.0.0.1", "localhost", "::1")
+        self.process = None  # The `ollama serve` we launched, if any
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._watcher = None
+        self._state = {
+            "status": "starting",  # starting | healthy | degraded | down | restarting
+            "latency_ms": None,    # Round trip of the last successful probe
+            "last_check": None,    # time.time() of the last probe
+            "restarts": 0,
+            "last_error": None,
+            "models": {model: "unknown" for model in self.models},
+        }
+
+    def _update(self, **changes):
+        with self._lock:
+            self._state.update(changes)
+
+    def _set_model(self, model, status):
+        with self._lock:
+            self._state["models"][model] = status
+
+    def health(self):
+        """A snapshot of the server and model state."""
+        with self._lock:
+            state = dict(self._state, models=dict(self._state["models"]), host=self.host)
+        state["circuit"] = self.client.breaker.snapshot()["state"]
+        return state
+
+    # --- Server ---
+
+    def probe(self):
+        """One health check: the round trip in ms, or None if the server did not answer."""
+        try:
+            latency_ms = self.client.probe()
+        except Exception as e:
+            self._update(last_check=time.time(), last_error=str(e))
+            return None
+        self._update(last_check=time.time(), latency_ms=latency_ms)
+        return latency_ms
+
+    def wait_until_ready(self, timeout):
+        """Probes with exponential backoff (50 ms doubling up to 2 s) until the server answers or timeout passes."""
+        deadline = time.perf_counter() + timeout
+        delay = 0.05
+        while True:
+            if self.probe() is not None:
+                return True
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 2.0)
+
+    def _launch(self):
+        if not self.manages_server:
+            raise RuntimeError(f"Ollama at {self.host} is not answering (remote servers are not restarted).")
+        if self.process is not None and self.process.poll() is None:
+            # Ours, but hung: replace it
+            self.process.terminate()
             try:
-                requests.get(ollama_url, timeout=2) # Increased timeout to 2s
-                print(Fore.GREEN + "✅ Ollama server is ready.")
-                break # Success! Exit the loop
-            except:
-                time.sleep(0.5)
-        else:
-            # If the loop finished without breaking (i.e., failed to connect 60 times)
-            raise RuntimeError("❌ Failed to start Ollama server. Check Task Manager for rogue processes or firewall.")
-    
-    # The check for the model (which you already seem to have succeeding)
-    # --- Ensure Embedding Model is available ---
-    print(Fore.YELLOW + f"⬇️ Checking embedding model '{EMBEDDING_MODEL}' status...")
-    try:
-        # Use subprocess to check if it's there, pull only if necessary
-        subprocess.run(["ollama", "list", EMBEDDING_MODEL], check=True, capture_output=True)
-        print(Fore.GREEN + f"✅ Embedding model '{EMBEDDING_MODEL}' is ready.")
-    except Exception:
-        # If 'ollama list' fails (model not found), pull it.
-        print(Fore.YELLOW + f"⬇️ Pulling embedding model '{EMBEDDING_MODEL}'...")
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
         try:
-            subprocess.run(["ollama", "pull", EMBEDDING_MODEL], check=True)
-            print(Fore.GREEN + f"✅ Embedding model '{EMBEDDING_MODEL}' successfully pulled.")
+            self.process = subprocess.Popen(["ollama", "serve"], stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            raise RuntimeError("The 'ollama' command was not found. Is Ollama installed and on PATH?")
+
+    # --- Models ---
+
+    def _load(self, model):
+        """Loads a model into memory without generating anything."""
+        self._set_model(model, "loading")
+        try:
+            if model == EMBEDDING_MODEL:
+                self.client.embed(model=model, input="warm up", keep_alive=OLLAMA_KEEP_ALIVE)
+            else:
+                # A chat request without messages only loads the model
+                self.client.chat(model=model, messages=[], keep_alive=OLLAMA_KEEP_ALIVE)
         except Exception as e:
-            print(Fore.RED + f"❌ Failed to pull embedding model: {e}")
-            
+            self._set_model(model, "error")
+            self._update(last_error=f"{model}: {e}")
+            print(Fore.RED + f"[Ollama] Could not load '{model}': {e}")
+            return False
+        self._set_model(model, "loaded")
+        return True
+
+    def ensure_models(self):
+        """Pulls missing models, then loads every model that is not already in memory."""
+        installed = _model_names(self.client.list().models)
+        for model in self.models:
+            if model not in installed:
+                print(Fore.YELLOW + f"⬇️ Pulling model '{model}'...")
+                self._set_model(model, "pulling")
+                try:
+                    self.client.pull(model)
+                    print(Fore.GREEN + f"✅ Model '{model}' successfully pulled.")
+                except Exception as e:
+                    self._set_model(model, "missing")
+                    self._update(last_error=f"{model}: {e}")
+                    print(Fore.RED + f"❌ Failed to pull model '{model}': {e}")
+        self.keep_warm()
+
+    def keep_warm(self):
+        """Reloads models that Ollama has unloaded (idle keep_alive expiry, memory pressure, restart)."""
+        loaded = _model_names(self.client.ps().models)
+        healthy = True
+        for model in self.models:
+            status = self.health()["models"][model]
+            if status in ("missing", "pulling"):
+                healthy = False
+            elif model in loaded:
+                self._set_model(model, "loaded")
+            else:
+                healthy = self._load(model) and healthy
+        self._update(status="healthy" if healthy else "degraded")
+
+    # --- Lifecycle ---
+
+    def start(self):
+        """Makes sure the server is up and the models are loaded, then keeps watching. Safe to call repeatedly."""
+        with self._start_lock:
+            if self._watcher is not None:
+                return
+            if self.probe() is not None:
+                print(Fore.GREEN + "✅ Ollama server is already running.")
+            else:
+                print(Fore.YELLOW + "⚡ Starting Ollama server in background...")
+                self._launch()
+                if not self.wait_until_ready(self.ready_timeout):
+                    self._update(status="down")
+                    raise RuntimeError("❌ Failed to start Ollama server. Check Task Manager for rogue processes or firewall.")
+                print(Fore.GREEN + "✅ Ollama server is ready.")
+            self.ensure_models()
+            self._watcher = threading.Thread(target=self._watch, name="ollama-supervisor", daemon=True)
+            self._watcher.start()
+
+    def _recover(self):
+        # A busy server can miss one probe; give it a few seconds before restarting it
+        if self.wait_until_ready(min(5, self.ready_timeout)):
+            return
+        self._update(status="restarting")
+        print(COLOR_WARN + "\n[Ollama] Server stopped answering; restarting it...")
+        self._launch()
+        if not self.wait_until_ready(self.ready_timeout):
+            raise RuntimeError("server did not come back")
+        with self._lock:
+            self._state["restarts"] += 1
+        print(Fore.GREEN + "[Ollama] Server restarted; reloading models.")
+
+    def _mark_down(self):
+        with self._lock:
+            self._state["status"] = "down"
+            # Whatever was loaded went down with the server
+            for model, status in self._state["models"].items():
+                if status == "loaded":
+                    self._state["models"][model] = "unknown"
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                if self.probe() is None:
+                    self._mark_down()
+                    self._recover()
+                self.keep_warm()
+            except Exception as e:
+                self._mark_down()
+                self._update(last_error=str(e))
+                print(Fore.RED + f"\n[Ollama] Health check failed: {e}")
+
+    def report(self):
+        """Health as printable lines, for the CLI."""
+        health = self.health()
+        latency = f"{health['latency_ms']:.0f} ms" if health["latency_ms"] is not None else "n/a"
+        checked = (f"{time.time() - health['last_check']:.0f}s ago" if health["last_check"] else "never")
+        lines = [
+            Fore.CYAN + "--- Ollama health ---",
+            f"  server    {health['status']} at {health['host']} (latency {latency}, checked {checked})",
+            f"  restarts  {health['restarts']}, client circuit {health['circuit']}",
+        ]
+        for model, status in health["models"].items():
+            lines.append(f"  model     {model:<24} {status}")
+        if health["last_error"] and health["status"] != "healthy":
+            lines.append(f"  last error: {health['last_error']}")
+        return "\n".join(lines)
+
+_SUPERVISOR = None
+_SUPERVISOR_LOCK = threading.Lock()
+
+def get_supervisor():
+    """Returns the shared supervisor (created on first use)."""
+    global _SUPERVISOR
+    with _SUPERVISOR_LOCK:
+        if _SUPERVISOR is None:
+            _SUPERVISOR = OllamaSupervisor()
+        return _SUPERVISOR
+
+def ensure_ollama_running():
+    """Starts (or finds) the Ollama server, prepares the models and keeps both watched."""
+    get_supervisor().start()
+
 # Rerun main.py after updating ollama_utils.py
 
 
-# In ollama_utils.py
+# ----------------------------------------------------
+# Web search (/search): cached responses, results kept as session context
+# ----------------------------------------------------
+def normalize_query(query):
+    """Case, spacing and trailing punctuation do not make a different search."""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+def ollama_web_search(query, max_results=WEB_SEARCH_MAX_RESULTS):
+    """
+    The live search backend: Ollama's hosted web search API (needs OLLAMA_API_KEY).
+    Returns {"summary", "results": [{"title", "url", "content"}]}; a stand-in backend
+    (e.g. a local stub in tests) only has to return the same shape.
+    """
+    response = ollama.web_search(query=query, max_results=max_results)
+    return {
+        "summary": response.get("summary"),
+        "results": [
+            {"title": r.get("title"), "url": r.get("url"), "content": r.get("content") or ""}
+            for r in response.get("results", [])
+        ],
+    }
 
-# ... (other code)
+def cached_web_search(query, search=ollama_web_search, max_results=WEB_SEARCH_MAX_RESULTS):
+    """The search response for query, reused for WEB_SEARCH_TTL seconds. Returns (response, from_cache)."""
+    cache = get_web_cache()
+    key = cache.make_key("web-search", normalize_query(query), max_results)
+    response = cache.get(key, max_age=WEB_SEARCH_TTL)
+    if response is not None:
+        return response, True
+    response = search(query, max_results)
+    cache.put(key, response)
+    return response, False
 
-def web_search_lookup(query: str) -> str:
+def web_search_lookup(query: str, web_store=None, search=ollama_web_search) -> str:
     """
     Performs a real-time web search using the Ollama Web Search API.
+    Responses are cached per normalized query; with a web_store (the chat session's), the
+    results are also kept as context that follow-up questions retrieve.
     """
     # Use COLOR_WARN for initial message
     print(COLOR_WARN + f"[Web Search] Searching the internet for '{query}'...")
     try:
-        # --- FIX IS HERE: Remove the 'model' argument ---
-        response = ollama.web_search(
-            query=query
-            # The original code had: model=MODEL_NAME  <-- DELETE THIS LINE
-        )
-        
-        # The rest of the function remains the same...
-        summary = response.get("summary", "No summary available.")
+        response, from_cache = cached_web_search(query, search)
+        if from_cache:
+            print(COLOR_WARN + f"[Web Search] Using cached results for '{query}'.")
+
+        summary = response.get("summary") or "No summary available."
         results = response.get("results", [])
         
         # Format sources with title and URL
-        formatted_results = [f"- {r.get('title', 'Untitled')} ({r.get('url', 'No URL')})" for r in results]
+        formatted_results = [f"- {r.get('title') or 'Untitled'} ({r.get('url') or 'No URL'})" for r in results]
+        sources = "\n".join(formatted_results)
 
         output = (
             f"✅ **Web Search Results for '{query}'**\n\n"
             f"**Summary:**\n{summary}\n\n"
             f"**Sources Found:**\n"
-            f"{'\\n'.join(formatted_results)}\n"
+            f"{sources}\n"
         )
+        if web_store is not None and results:
+            try:
+                added = web_store.add_results(query, results)
+                print(COLOR_WARN + f"[Web Search] Kept {added} passages as context for follow-up questions.")
+            except Exception as e:
+                print(COLOR_WARN + f"[Web Search] Could not keep the results as context: {e}")
         # Use COLOR_INFO for the final output
         return COLOR_INFO + output
 
@@ -2,151 +2,293 @@
 
 import os
 import shutil
-import pypdf
+import threading
+import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from colorama import Fore
 import chromadb
 # Import types for the Embedding Function
 from chromadb.api.types import Documents, EmbeddingFunction, Embeddings 
-import ollama 
-from config import PDF_FOLDER, CHROMA_COLLECTION as CHROMA_NAME, EMBEDDING_MODEL
+from ollama_client import PooledOllamaClient
+from config import (
+    PDF_FOLDER, CHROMA_COLLECTION as CHROMA_NAME, CHROMA_PATH, EMBEDDING_MODEL,
+    EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_IN_FLIGHT, BM25_INDEX_PATH, OLLAMA_KEEP_ALIVE
+)
+from ingest_utils import run_ingest_pipeline, count_pdf_pages, CHUNK_PARAMS
+from embedding_cache import get_embedding_cache
+from bm25_index import get_bm25_index
+from history_utils import ChatHistory
+from web_context import SessionWebStore
+from response_cache import get_response_cache
+from manifest_utils import (
+    load_manifest, save_manifest, plan_sync, file_record, hash_file, empty_manifest, corpus_signature
+)
+
+# Anything that changes how chunks are produced or embedded invalidates the whole index
+INDEX_PARAMS = {"embedding_model": EMBEDDING_MODEL, **CHUNK_PARAMS}
 
 # =================================================================
 # CRITICAL FIX 1: Explicitly define the Ollama Client and Host
 # =================================================================
-OLLAMA_HOST = 'http://127.0.0.1:11434'
-OLLAMA_CLIENT = ollama.Client(host=OLLAMA_HOST) 
+# JOEL_OLLAMA_HOST points the app (or benchmark.py) at another server
+OLLAMA_HOST = os.environ.get("JOEL_OLLAMA_HOST", 'http://127.0.0.1:11434')
+# Pooled, retrying client with a circuit breaker; every Ollama call in the app goes through it
+OLLAMA_CLIENT = PooledOllamaClient(host=OLLAMA_HOST)
 # =================================================================
 
-CHAT_HISTORY = []
 # =================================================================
 # CRITICAL FIX 2: Switched to PersistentClient
 # If you are running this locally, this will store your vector data in the 
 # './chroma_db' folder and the data will survive restarts.
 # =================================================================
-CHROMA_CLIENT = chromadb.PersistentClient(path="./chroma_db") 
+# Opened on first use (see get_chroma_client), so importing this module stays cheap
+CHROMA_CLIENT = None
 CHROMA_COLLECTION = None # Placeholder for the collection object
+# Serializes everything that changes the index (initial load, uploads), so concurrent
+# sessions never write the collection, manifest or keyword index at the same time.
+# Queries don't take it: the Chroma client and BM25 index are safe to read concurrently.
+INDEX_LOCK = threading.RLock()
+# Snapshot of the indexed documents (source -> pages, chunks, size, hash), republished
+# after every index change so listing documents never touches Chroma or the PDFs
+DOCUMENT_CATALOG = {}
+# Bumped on every change to the indexed content; anything retrieved under an older
+# generation (cached answers, prefetched retrievals) may be stale
+INDEX_GENERATION = 0
 
 # ----------------------------------------------------
 # Custom Chroma Embedding Function using Ollama
 # ----------------------------------------------------
 class OllamaEmbeddingFunction(EmbeddingFunction):
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 max_in_flight: int = EMBEDDING_MAX_IN_FLIGHT, use_cache: bool = True):
         self._model_name = model_name
         self.ollama_client = OLLAMA_CLIENT # Use the global explicit client
+        self.batch_size = max(1, batch_size)
+        self.max_in_flight = max(1, max_in_flight)
+        # Shared by every call on this instance, so concurrent callers still
+        # never have more than max_in_flight requests open against Ollama.
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        self.cache = get_embedding_cache() if use_cache else None
+        self.last_chunks_per_second = 0.0
+
+    def _embed_batch(self, batch):
+        # One /api/embed request carries the whole batch
+        response = self.ollama_client.embed(model=self._model_name, input=batch, keep_alive=OLLAMA_KEEP_ALIVE)
+        return response["embeddings"]
+
+    def _embed_uncached(self, texts):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            results = [self._embed_batch(batches[0])]
+        else:
+            # map() keeps the batches in order, so embeddings line up with texts
+            results = list(self._executor.map(self._embed_batch, batches))
+        return [embedding for batch in results for embedding in batch]
 
     def __call__(self, texts: Documents) -> Embeddings:
-        embeddings = []
-        for text in texts:
+        texts = list(texts)
+        if not texts:
+            return []
+
+        start = time.perf_counter()
+        # Step 1: Serve what we can from the on-disk cache
+        if self.cache is not None:
+            embeddings = self.cache.get_many(self._model_name, texts)
+        else:
+            embeddings = [None] * len(texts)
+        # Each distinct missing text is sent to Ollama once
+        missing = list(dict.fromkeys(text for text, emb in zip(texts, embeddings) if emb is None))
+
+        # Step 2: Embed the misses in batches and remember them
+        if missing:
             try:
-                # Use the explicit client object for the embedding request
-                response = self.ollama_client.embeddings(model=self._model_name, prompt=text) 
-                embeddings.append(response["embedding"])
+                fresh = dict(zip(missing, self._embed_uncached(missing)))
             except Exception as e:
                 print(Fore.RED + f"Error generating Ollama embedding: {e}")
-                raise e 
+                raise e
+            if self.cache is not None:
+                self.cache.put_many(self._model_name, missing, [fresh[text] for text in missing])
+            embeddings = [emb if emb is not None else fresh[text] for text, emb in zip(texts, embeddings)]
+
+        elapsed = time.perf_counter() - start
+        self.last_chunks_per_second = len(texts) / elapsed if elapsed > 0 else 0.0
+        if len(texts) > self.batch_size:
+            cache_note = ""
+            if self.cache is not None:
+                cache_note = f", {len(texts) - len(missing)} from cache (hit rate {self.cache.stats()['hit_rate']:.0%})"
+            print(Fore.WHITE + f"[Embed] {len(texts)} chunks in {elapsed:.2f}s "
+                  f"({self.last_chunks_per_second:.1f} chunks/s, batch size {self.batch_size}, "
+                  f"{self.max_in_flight} in flight{cache_note})")
         return embeddings
 
+# One shared instance, so every caller goes through the same bounded request pool
+EMBEDDING_FUNCTION = OllamaEmbeddingFunction(model_name=EMBEDDING_MODEL)
+
+# Token-budgeted conversation state (older turns are folded into a running summary), with
+# the conversation's own web search results. This one is the CLI's; each Streamlit session
+# creates its own with new_chat_history().
+CHAT_HISTORY = ChatHistory(client=OLLAMA_CLIENT, web_store=SessionWebStore(EMBEDDING_FUNCTION))
+
 # ----------------------------------------------------
 # Getter function to safely retrieve the collection
 # ----------------------------------------------------
+def get_chroma_client():
+    """Returns the persistent Chroma client, opening it on first use."""
+    global CHROMA_CLIENT
+    with INDEX_LOCK:
+        if CHROMA_CLIENT is None:
+            CHROMA_CLIENT = chromadb.PersistentClient(path=CHROMA_PATH)
+        return CHROMA_CLIENT
+
 def get_chroma_collection():
     """Returns the initialized Chroma collection object."""
     return CHROMA_COLLECTION
+
+def get_document_catalog():
+    """Returns {source: {"pages", "chunks", "size", "hash"}} for every fully indexed PDF."""
+    return DOCUMENT_CATALOG
+
+def _publish_catalog(manifest):
+    global DOCUMENT_CATALOG
+    # Replaced as a whole, so readers on other threads always see a consistent snapshot
+    DOCUMENT_CATALOG = {
+        filename: {key: record.get(key) for key in ("pages", "chunks", "size", "hash")}
+        for filename, record in sorted(manifest["files"].items())
+    }
+
+def index_generation():
+    return INDEX_GENERATION
+
+def _index_changed():
+    """Called after every change to the indexed content."""
+    global INDEX_GENERATION
+    INDEX_GENERATION += 1
+    get_response_cache().invalidate()
+
+def new_chat_history():
+    """Creates an independent conversation, e.g. one per Streamlit session."""
+    return ChatHistory(client=OLLAMA_CLIENT, web_store=SessionWebStore(EMBEDDING_FUNCTION))
+
+def _holds_index_lock(func):
+    """Runs func under INDEX_LOCK."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with INDEX_LOCK:
+            return func(*args, **kwargs)
+    return wrapper
 # ----------------------------------------------------
+
+def _delete_sources(filenames):
+    """Removes every chunk belonging to the given source files from the collection."""
+    if not filenames:
+        return
+    try:
+        CHROMA_COLLECTION.delete(where={"source": {"$in": list(filenames)}})
+        get_bm25_index().remove_sources(filenames)
+        _index_changed()
+    except Exception as e:
+        print(Fore.RED + f"Error deleting chunks for {', '.join(filenames)}: {e}")
     
-def split_text_into_chunks(text, chunk_size=1000, overlap=200):
-    """A simple fixed-size text splitter."""
-    
-    # Split by double newlines for paragraph-like chunks
-    text_parts = [p.strip() for p in text.split('\n\n') if p.strip()]
-    
-    # Simple chunking logic
-    chunks = []
-    current_chunk = ""
-    for part in text_parts:
-        if len(current_chunk) + len(part) + 2 < chunk_size:
-            current_chunk += part + "\n\n"
+def _save_keyword_index(manifest):
+    """Persists the BM25 index if it changed, tagged with the corpus state it now reflects."""
+    bm25_index = get_bm25_index()
+    if bm25_index.ready and bm25_index.dirty:
+        try:
+            bm25_index.save(BM25_INDEX_PATH, corpus_signature(manifest))
+        except Exception as e:
+            print(Fore.RED + f"Error saving keyword index: {e}")
+
+# ----------------------------------------------------
+# Streams PDFs into Chroma with resumable checkpoints
+# ----------------------------------------------------
+def _ingest_pdfs(pdf_jobs, manifest, embed_fn, **pipeline_options):
+    """
+    Runs the ingest pipeline over (path, filename) jobs and keeps the manifest current.
+    Progress is checkpointed in manifest["in_progress"] after every committed batch, so an
+    interrupted ingest of an unchanged file resumes from the last committed page.
+    Returns the number of chunks written.
+    """
+    in_progress = manifest["in_progress"]
+    paths = {}
+    pipeline_jobs = []
+    fresh = []
+
+    for path, filename in pdf_jobs:
+        paths[filename] = path
+        file_hash = hash_file(path)
+        checkpoint = in_progress.get(filename)
+        if checkpoint and checkpoint["hash"] == file_hash:
+            print(Fore.YELLOW + f"Resuming '{filename}' from page {checkpoint['next_page'] + 1}...")
         else:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = part + "\n\n"
-            
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-    
-    return chunks
+            checkpoint = in_progress[filename] = {"hash": file_hash, "next_page": 0, "chunks": 0}
+            fresh.append(filename)
+        # Not indexed until the whole file is committed
+        manifest["files"].pop(filename, None)
+        pipeline_jobs.append((path, filename, checkpoint["next_page"]))
+
+    # A fresh ingest must not leave the previous version's chunks behind
+    _delete_sources(fresh)
+    save_manifest(manifest)
+    _publish_catalog(manifest)
+
+    def on_progress(filename, next_page, total_pages, new_chunks):
+        checkpoint = in_progress[filename]
+        checkpoint["next_page"] = next_page
+        checkpoint["chunks"] += new_chunks
+        if next_page >= total_pages:
+            del in_progress[filename]
+            record = file_record(paths[filename], file_hash=checkpoint["hash"],
+                                 chunk_count=checkpoint["chunks"], page_count=total_pages)
+            manifest["files"][filename] = record
+            _publish_catalog(manifest)
+        save_manifest(manifest)
+
+    def on_written(ids, documents, metadatas):
+        # The keyword index follows every batch that lands in Chroma, and cached
+        # answers may no longer reflect the documents
+        get_bm25_index().add(ids, documents, metadatas)
+        _index_changed()
+
+    result = run_ingest_pipeline(pipeline_jobs, CHROMA_COLLECTION, embed_fn, on_progress=on_progress,
+                                 on_written=on_written, **pipeline_options)
+    return sum(result["chunks_per_file"].values())
 
 # ----------------------------------------------------
 # NEW FUNCTION: Adds only a single PDF's content (FIXED)
 # ----------------------------------------------------
+@_holds_index_lock
 def _add_single_pdf_to_context(path, filename, doc_id_start):
-    """Handles PDF parsing, chunking, and addition for a single file."""
-    
-    documents_to_add = []
-    metadatas_to_add = []
-    ids_to_add = []
-    
-    # CRITICAL FIX 3: Start ID counter from 0 for a given file name, 
-    # and use the filename + index to generate a truly unique ID.
-    chunk_index = 0
-    
-    try:
-        with open(path, "rb") as f:
-            reader = pypdf.PdfReader(f)
-            
-            # CRITICAL FIX 4: Loop through pages and chunk the text page-by-page
-            for page_num, page in enumerate(reader.pages):
-                text_content = page.extract_text() or ""
-                
-                # Chunk the text of this single page
-                chunks = split_text_into_chunks(text_content) 
-                
-                for chunk in chunks:
-                    if chunk.strip():
-                        documents_to_add.append(chunk)
-                        # Metadata now correctly reflects the page number (1-indexed)
-                        metadatas_to_add.append({"source": filename, "page": page_num + 1}) 
-                        # Unique ID for the chunk
-                        ids_to_add.append(f"{filename.replace('.pdf', '')}_{chunk_index}") 
-                        chunk_index += 1
-            
-    except Exception as e:
-        print(Fore.RED + f"Error loading {filename}: {e}")
-        return 0, 0 # Return 0 chunks added
+    """
+    Handles PDF parsing, chunking, and addition for a single file.
+    Pages are streamed through chunking and embedding and written in fixed-size batches,
+    so memory stays bounded whatever the document size.
+    """
+    print(Fore.YELLOW + f"Embedding and adding '{filename}' to Chroma...")
+    manifest = load_manifest(INDEX_PARAMS)
+    chunks_added = _ingest_pdfs([(path, filename)], manifest, EMBEDDING_FUNCTION, processes=1)
+    _save_keyword_index(manifest)
 
-    # Step 3: Embed and Store in Chroma
-    if documents_to_add:
-        print(Fore.YELLOW + f"Embedding and adding {len(documents_to_add)} chunks from {filename} to Chroma...")
-        
-        try:
-            CHROMA_COLLECTION.add(
-                documents=documents_to_add,
-                metadatas=metadatas_to_add,
-                ids=ids_to_add
-            )
-            print(Fore.GREEN + f"Successfully stored {len(documents_to_add)} chunks.")
-            return len(documents_to_add), chunk_index
-        except Exception as e:
-            # Catch duplicate ID errors that might occur on re-indexing
-            if "already exists" in str(e):
-                print(Fore.YELLOW + f"Warning: Chunks for {filename} already exist. Skipping re-add.")
-                return len(documents_to_add), chunk_index # Treat as added to avoid error
-            print(Fore.RED + f"Error adding documents to Chroma: {e}")
-            return 0, 0
-    
-    return 0, 0
+    if filename in manifest["files"]:
+        print(Fore.GREEN + f"Successfully stored {chunks_added} chunks.")
+    else:
+        print(Fore.RED + f"Indexing of '{filename}' did not finish; it will resume on the next load.")
+    return chunks_added, chunks_added
 
 # ----------------------------------------------------
 # UPDATED FUNCTION: Handles collection initialization and clear logic
 # ----------------------------------------------------
-def load_pdfs_into_context(pdf_folder=PDF_FOLDER, clear_existing=True):
+@_holds_index_lock
+def load_pdfs_into_context(pdf_folder=PDF_FOLDER, clear_existing=False):
     """
-    Loads all PDFs in the folder into the Chroma context.
-    If clear_existing is True, it clears the collection first (default for main.py startup).
+    Brings the Chroma context in sync with the PDFs in the folder.
+    Only new or changed PDFs are embedded, and chunks of deleted PDFs are removed,
+    using the index manifest stored next to chroma_db.
+    If clear_existing is True, the collection is wiped and every PDF is re-embedded.
     """
     global CHROMA_COLLECTION
     
-    ollama_ef = OllamaEmbeddingFunction(model_name=EMBEDDING_MODEL)
+    ollama_ef = EMBEDDING_FUNCTION
 
     # Step 1: Handle Collection Initialization and Clearing
     print(Fore.YELLOW + "Initializing ChromaDB...")
@@ -155,43 +297,86 @@ def load_pdfs_into_context(pdf_folder=PDF_FOLDER, clear_existing=True):
         print(Fore.YELLOW + f"Clearing existing Chroma context (Wipe & Re-create collection '{CHROMA_NAME}')...")
         try:
             # FIX: Robust wipe by deleting the collection via the client.
-            CHROMA_CLIENT.delete_collection(name=CHROMA_NAME)
+            get_chroma_client().delete_collection(name=CHROMA_NAME)
         except Exception as e:
              # Ignore the error if the collection didn't exist
             if "not found" not in str(e) and "does not exist" not in str(e) and "already deleted" not in str(e):
                 print(Fore.RED + f"Error during collection delete: {e}")
             
+        get_bm25_index().clear()
+        _index_changed()
         # Re-create the collection
-        CHROMA_COLLECTION = CHROMA_CLIENT.get_or_create_collection(
+        CHROMA_COLLECTION = get_chroma_client().get_or_create_collection(
             name=CHROMA_NAME,
             embedding_function=ollama_ef 
         )
         print(Fore.GREEN + f"ChromaDB collection '{CHROMA_NAME}' re-created and ready.")
         
     elif CHROMA_COLLECTION is None: # Standard initialization if not clearing
-        CHROMA_COLLECTION = CHROMA_CLIENT.get_or_create_collection(
+        CHROMA_COLLECTION = get_chroma_client().get_or_create_collection(
             name=CHROMA_NAME,
             embedding_function=ollama_ef
         )
         print(Fore.GREEN + f"ChromaDB collection '{CHROMA_NAME}' ready.")
 
 
-    # Step 2: Read PDFs and chunk text
+    # Step 2: Work out which PDFs actually need (re-)embedding
     if not os.path.isdir(pdf_folder):
         os.makedirs(pdf_folder)
 
+    manifest = load_manifest(INDEX_PARAMS)
+    if clear_existing or (manifest["files"] and CHROMA_COLLECTION.count() == 0):
+        # Wiped (or lost) collection: the manifest no longer describes it
+        manifest = empty_manifest(INDEX_PARAMS)
+
+    # Reuse the saved keyword index if it matches the corpus as it was; the sync
+    # below then keeps it up to date incrementally
+    bm25_index = get_bm25_index()
+    if not bm25_index.ready and bm25_index.load(BM25_INDEX_PATH, corpus_signature(manifest)):
+        print(Fore.GREEN + f"[BM25] Loaded keyword index ({len(bm25_index)} chunks).")
+
     print(Fore.YELLOW + f"Loading PDFs from '{pdf_folder}'...")
-    pdf_count = 0
-    total_chunks = 0
-    
-    for filename in os.listdir(pdf_folder):
-        if filename.lower().endswith(".pdf"):
-            pdf_count += 1
-            path = os.path.join(pdf_folder, filename)
-            
-            # Pass 0 as the starting ID, it will be ignored by the fixed function
-            chunks_added, _ = _add_single_pdf_to_context(path, filename, 0) 
-            total_chunks += chunks_added
+    pdf_jobs = [
+        (os.path.join(pdf_folder, filename), filename)
+        for filename in sorted(os.listdir(pdf_folder))
+        if filename.lower().endswith(".pdf")
+    ]
+    pdf_count = len(pdf_jobs)
+    changed, removed, unchanged = plan_sync(manifest, pdf_jobs)
+
+    # Step 3: Drop chunks of removed files (including half-ingested ones)
+    on_disk = {filename for _, filename in pdf_jobs}
+    abandoned = [filename for filename in manifest["in_progress"] if filename not in on_disk]
+    _delete_sources(removed + abandoned)
+    for filename in removed:
+        del manifest["files"][filename]
+        print(Fore.YELLOW + f"Removed '{filename}' from the index (file deleted).")
+    for filename in abandoned:
+        del manifest["in_progress"][filename]
+    # Records from before page counts were tracked
+    for filename in unchanged:
+        record = manifest["files"][filename]
+        if record.get("pages") is None:
+            try:
+                record["pages"] = count_pdf_pages(os.path.join(pdf_folder, filename))
+            except Exception as e:
+                print(Fore.RED + f"Could not count pages of '{filename}': {e}")
+    _publish_catalog(manifest)
+
+    # Step 4: Parse in a process pool, embed in batches and write in fixed-size upserts.
+    # Stale chunks of changed files are replaced; interrupted files resume where they stopped.
+    if changed:
+        print(Fore.YELLOW + f"Indexing {len(changed)} new or changed PDF(s); {len(unchanged)} unchanged.")
+        _ingest_pdfs(changed, manifest, ollama_ef)
+    else:
+        print(Fore.GREEN + f"All {len(unchanged)} PDF(s) are already indexed.")
+
+    save_manifest(manifest)
+    total_chunks = sum(record.get("chunks", 0) for record in manifest["files"].values())
+
+    # Step 5: Keyword index for hybrid retrieval (built once, then updated incrementally)
+    bm25_index.ensure_built(CHROMA_COLLECTION)
+    _save_keyword_index(manifest)
 
     print(Fore.GREEN + f"Successfully processed {pdf_count} PDF(s). Total chunks stored: {total_chunks}")
     return "Vector context loaded."
@@ -200,7 +385,6 @@ def load_pdfs_into_context(pdf_folder=PDF_FOLDER, clear_existing=True):
 # Incremental Upload Function (FIXED FOR NEW ID LOGIC)
 # ----------------------------------------------------
 def handle_upload():
-    global CHAT_HISTORY
     # Ensure CHROMA_COLLECTION is initialized before trying to use it
     if CHROMA_COLLECTION is None:
         load_pdfs_into_context(clear_existing=False) # Ensure collection is created if not already
@@ -231,7 +415,7 @@ def handle_upload():
         # ----------------------------------------------------
         
         print(Fore.YELLOW + "RAG context refreshed.")
-        CHAT_HISTORY = []
+        CHAT_HISTORY.clear()
         print(Fore.YELLOW + "Chat history cleared.")
     except Exception as e:
         print(Fore.RED + f"Copy or indexing error: {e}")
\ No newline at end of file
@@ -1,60 +1,154 @@
 # In rag_utils.py (with added diagnostic prints)
 
-import ollama 
+import time
+import ollama
 # CRITICAL FIX 3: Import the getter function and the client/host from pdf_utils
-from pdf_utils import get_chroma_collection, OLLAMA_CLIENT, OLLAMA_HOST
-from config import EMBEDDING_MODEL, COLOR_WARN 
+from pdf_utils import get_chroma_collection, OLLAMA_HOST, EMBEDDING_FUNCTION
+from bm25_index import get_bm25_index
+from rerank_utils import get_reranker
+from context_utils import assemble_context
+from config import (
+    EMBEDDING_MODEL, COLOR_WARN, HYBRID_CANDIDATES, RRF_K, RERANK_ENABLED, RERANK_CANDIDATES, RERANK_TOP_N,
+    CONTEXT_SPARE_CHUNKS, WEB_CONTEXT_CANDIDATES
+)
 
-def retrieve_relevant_chunks(query, top_k=5):
+def embed_query(query):
+    """Embedding of a user query."""
+    # CRITICAL FIX 5: Embed with the shared OllamaEmbeddingFunction (explicit OLLAMA_CLIENT).
+    # Same /api/embed endpoint and on-disk cache as ingestion, so query and chunk
+    # vectors match and repeated questions skip Ollama.
+    return EMBEDDING_FUNCTION([query])[0]
+
+def _vector_hits(collection, query, n_results):
+    """Dense search: returns hits (dicts with id, document, metadata, distance) in rank order."""
+    query_embedding = embed_query(query)
+
+    results = collection.query(
+        query_embeddings=[query_embedding],
+        n_results=n_results,
+        include=['documents', 'metadatas', 'distances']
+    )
+
+    hits = []
+    if results and results.get('documents') and results['documents'][0]:
+        for chunk_id, doc, metadata, distance in zip(
+            results['ids'][0],
+            results['documents'][0],
+            results['metadatas'][0],
+            results['distances'][0]
+        ):
+            hits.append({"id": chunk_id, "document": doc, "metadata": metadata or {}, "distance": distance})
+    return hits
+
+def web_hits(web_store, query, n_results=WEB_CONTEXT_CANDIDATES):
+    """Dense search over a session's recent web search results ([] if it has none)."""
+    collection = web_store.live_collection() if web_store is not None else None
+    if collection is None:
+        return []
+    try:
+        return _vector_hits(collection, query, min(n_results, collection.count()))
+    except Exception as e:
+        print(COLOR_WARN + f"[RAG] Web results search failed, using documents only: {e}")
+        return []
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuses several ranked lists of chunk ids. Returns (chunk id, fused score) pairs, best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def hybrid_search(query, top_k=5, candidates=HYBRID_CANDIDATES, extra_hits=()):
     """
-    Performs a Vector Search using an Ollama embedding model and ChromaDB.
+    Runs BM25 keyword search and vector search, and fuses them with reciprocal-rank fusion.
+    extra_hits (e.g. the session's web results) join the fusion as one more ranking.
+    Returns up to top_k hits (dicts with id, document, metadata, score), best first.
     """
-    
+    collection = get_chroma_collection()
+    has_documents = collection is not None and collection.count() > 0
+
+    t0 = time.perf_counter()
+    keyword_ranking = [chunk_id for chunk_id, _ in get_bm25_index().search(query, candidates)] if has_documents else []
+    keyword_ms = (time.perf_counter() - t0) * 1000
+
+    vector_hits = _vector_hits(collection, query, candidates) if has_documents else []
+    by_id = {hit["id"]: hit for hit in vector_hits}
+    rankings = [[hit["id"] for hit in vector_hits], keyword_ranking]
+    if extra_hits:
+        by_id.update((hit["id"], hit) for hit in extra_hits)
+        rankings.append([hit["id"] for hit in extra_hits])
+
+    fused = reciprocal_rank_fusion(rankings)[:top_k]
+
+    # Exact-term matches the vector search missed still need their text
+    missing = [chunk_id for chunk_id, _ in fused if chunk_id not in by_id]
+    if missing:
+        fetched = collection.get(ids=missing, include=['documents', 'metadatas'])
+        for chunk_id, doc, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas']):
+            by_id[chunk_id] = {"id": chunk_id, "document": doc, "metadata": metadata or {}}
+
+    web_note = f" and {len(extra_hits)} web" if extra_hits else ""
+    print(COLOR_WARN + f"[RAG] Fused {len(vector_hits)} vector, {len(keyword_ranking)} keyword{web_note} "
+          f"candidates (BM25 {keyword_ms:.1f} ms).")
+    return [dict(by_id[chunk_id], score=score) for chunk_id, score in fused if chunk_id in by_id]
+
+def format_context(hits):
+    """Formats retrieved hits the way the system prompt expects them."""
+    return "\n\n".join(
+        f"--- Source: {hit['metadata'].get('source', 'Unknown')} (Score: {hit['score']:.4f}) ---\n"
+        f"{hit['document']}"
+        for hit in hits
+    )
+
+def search_and_rerank(query, top_k=5, rerank=RERANK_ENABLED, extra_hits=()):
+    """
+    Hybrid search, then (optionally) reranking of an over-fetched candidate set.
+    Returns the top_k best hits; reranked hits carry a "rerank_score". The fused order is
+    used when reranking is off or drops out (over its latency budget, or the model failed).
+    """
+    if not rerank:
+        return hybrid_search(query, top_k=top_k, extra_hits=extra_hits)
+    candidates = hybrid_search(query, top_k=RERANK_CANDIDATES, candidates=max(HYBRID_CANDIDATES, RERANK_CANDIDATES),
+                               extra_hits=extra_hits)
+    reranked = get_reranker().rerank(query, candidates, top_n=top_k)
+    if reranked is None:
+        print(COLOR_WARN + "[RAG] Reranker dropped out; using the fused order.")
+        return candidates[:top_k]
+    return reranked
+
+def retrieve_relevant_chunks(query, top_k=5, web_store=None):
+    """
+    Performs a hybrid search (BM25 keywords + Ollama embeddings in ChromaDB), then reranks
+    and packs the best chunks into the context token budget. With a web_store, the
+    session's recent /search results compete for the context alongside the PDF chunks.
+    """
+
     # CRITICAL FIX 4: Get the initialized collection object
-    CHROMA_COLLECTION = get_chroma_collection() 
-    
-    if CHROMA_COLLECTION is None or CHROMA_COLLECTION.count() == 0:
+    CHROMA_COLLECTION = get_chroma_collection()
+    recent_web_hits = web_hits(web_store, query)
+
+    if (CHROMA_COLLECTION is None or CHROMA_COLLECTION.count() == 0) and not recent_web_hits:
         print(COLOR_WARN + "[RAG] No documents in ChromaDB collection.") # Diagnostic print
         return "No vector context available in ChromaDB."
 
     try:
-        # Step 1: Get the query embedding from Ollama
-        print(COLOR_WARN + f"[RAG] Generating embedding for query with {EMBEDDING_MODEL}...")
-        
-        # CRITICAL FIX 5: Use the explicit OLLAMA_CLIENT
-        query_embedding_res = OLLAMA_CLIENT.embeddings(
-            model=EMBEDDING_MODEL,
-            prompt=query
-        )
-        query_embedding = query_embedding_res["embedding"]
-        
-        # Step 2: Query ChromaDB using the embedding
-        print(COLOR_WARN + f"[RAG] Querying ChromaDB for top {top_k} matches...")
-        
-        results = CHROMA_COLLECTION.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k,
-            include=['documents', 'metadatas', 'distances']
-        )
-        
+        # Step 1: Embed the query, search both indexes, fuse the rankings and rerank
+        print(COLOR_WARN + f"[RAG] Hybrid search for top {top_k} matches (embeddings: {EMBEDDING_MODEL})...")
+        # A few spares, so chunks dropped as duplicates are backfilled
+        hits = search_and_rerank(query, top_k=top_k + CONTEXT_SPARE_CHUNKS, extra_hits=recent_web_hits)
+
+        # Step 2: Deduplicate, merge neighbours and pack into the token budget.
+        # Reranked results are precise enough that only the best few are worth sending.
+        max_chunks = RERANK_TOP_N if hits and "rerank_score" in hits[0] else top_k
+        hits = assemble_context(hits, max_chunks=max_chunks)
+
         # Step 3: Format the retrieved context
-        context_chunks = []
-        if results and results.get('documents') and results['documents'][0]:
-            for doc, metadata, distance in zip(
-                results['documents'][0], 
-                results['metadatas'][0],
-                results['distances'][0]
-            ):
-                context_chunks.append(
-                    f"--- Source: {metadata.get('source', 'Unknown')} (Score: {distance:.4f}) ---\n"
-                    f"{doc}"
-                )
-
-        context = "\n\n".join(context_chunks)
-        
+        context = format_context(hits)
+
         # --- DIAGNOSTIC LOGGING ---
         if context.strip():
-            print(COLOR_WARN + f"[RAG] Successfully retrieved {len(context_chunks)} chunks.")
+            print(COLOR_WARN + f"[RAG] Successfully retrieved {len(hits)} chunks.")
             return context
         else:
             print(COLOR_WARN + "[RAG] No relevant chunks found in ChromaDB.")
@@ -0,0 +1,170 @@
+# In rerank_utils.py
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from colorama import Fore
+from pdf_utils import OLLAMA_CLIENT
+from config import (
+    COLOR_WARN, RERANK_MODEL, RERANK_BATCH_SIZE, RERANK_MAX_IN_FLIGHT, RERANK_BUDGET_SECONDS,
+    RERANK_PASSAGE_CHARS, RERANK_CACHE_MAX_ENTRIES, OLLAMA_KEEP_ALIVE
+)
+
+RERANK_INSTRUCTION = (
+    "You grade search results. For each numbered passage, rate how well it helps answer the query, "
+    "from 0 (irrelevant) to 10 (directly answers it). Reply with JSON only, in the form "
+    '{"scores": [s1, s2, ...]}, with exactly one score per passage, in passage order.'
+)
+
+def _passage_key(model, query, hit):
+    digest = hashlib.sha1(hit["document"].encode("utf-8")).hexdigest()
+    return (model, " ".join(query.lower().split()), hit["id"], digest)
+
+def build_rerank_prompt(query, documents):
+    passages = "\n".join(
+        f"[{number}] " + " ".join(document[:RERANK_PASSAGE_CHARS].split())
+        for number, document in enumerate(documents, start=1)
+    )
+    return f"Query: {query}\n\nPassages:\n{passages}"
+
+def parse_scores(content, expected):
+    """Reads the grader's JSON reply; returns expected floats, or None if the reply is unusable."""
+    try:
+        scores = json.loads(content)["scores"]
+        scores = [float(score) for score in scores[:expected]]
+    except (ValueError, KeyError, TypeError):
+        return None
+    return scores if len(scores) == expected else None
+
+# ----------------------------------------------------
+# LLM reranker with a per-query latency budget
+# ----------------------------------------------------
+class LLMReranker:
+    """
+    Scores query/passage relevance with a small local model through Ollama.
+    Passages are graded in batches (one chat call per batch, several calls in flight), and
+    every score is cached per (model, query, chunk), so a repeated or re-asked query only
+    grades what it has not seen. If grading does not finish within `budget_seconds`, the
+    caller gets None and keeps the fused order; batches not started yet are cancelled, and
+    the ones already running finish in the background and fill the cache for next time.
+    """
+
+    def __init__(self, client=OLLAMA_CLIENT, model=RERANK_MODEL, batch_size=RERANK_BATCH_SIZE,
+                 max_in_flight=RERANK_MAX_IN_FLIGHT, budget_seconds=RERANK_BUDGET_SECONDS,
+                 max_cache_entries=RERANK_CACHE_MAX_ENTRIES):
+        self.client = client
+        self.model = model
+        self.batch_size = batch_size
+        self.budget_seconds = budget_seconds
+        self.max_cache_entries = max_cache_entries
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="rerank")
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()  # score() runs on every session's retrieval thread
+        self.stats = {"queries": 0, "reranked": 0, "over_budget": 0, "failed": 0,
+                      "cached_scores": 0, "graded_scores": 0}
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def _cached(self, key):
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _store(self, keys, scores):
+        with self._lock:
+            for key, score in zip(keys, scores):
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cache_entries:
+                self._cache.popitem(last=False)
+
+    def _grade_batch(self, query, keys, documents):
+        response = self.client.chat(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": RERANK_INSTRUCTION},
+                {"role": "user", "content": build_rerank_prompt(query, documents)},
+            ],
+            format="json",
+            options={"temperature": 0},
+            keep_alive=OLLAMA_KEEP_ALIVE,
+        )
+        scores = parse_scores(response["message"]["content"], len(documents))
+        if scores is None:
+            raise ValueError(f"unusable reranker reply: {response['message']['content'][:80]!r}")
+        self._store(keys, scores)
+        return scores
+
+    def score(self, query, hits):
+        """Returns one relevance score per hit, or None when grading failed or ran over budget."""
+        deadline = time.perf_counter() + self.budget_seconds
+        self._count("queries")
+        keys = [_passage_key(self.model, query, hit) for hit in hits]
+        scores = [self._cached(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        self._count("cached_scores", len(hits) - len(missing))
+
+        futures = {}
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            future = self.executor.submit(self._grade_batch, query, [keys[i] for i in batch],
+                                          [hits[i]["document"] for i in batch])
+            futures[future] = batch
+
+        if futures:
+            done, not_done = wait(futures, timeout=max(0.0, deadline - time.perf_counter()))
+            if not_done:
+                self._count("over_budget")
+                # Drop queued batches, so grading for stale queries cannot pile up behind the
+                # next ones (or keep Ollama busy instead of the chat model)
+                for future in not_done:
+                    future.cancel()
+                return None
+            for future in done:
+                try:
+                    batch_scores = future.result()
+                except Exception as e:
+                    self._count("failed")
+                    print(COLOR_WARN + f"[Rerank] Grading failed, keeping fused order: {e}")
+                    return None
+                for i, score in zip(futures[future], batch_scores):
+                    scores[i] = score
+            self._count("graded_scores", len(missing))
+
+        self._count("reranked")
+        return scores
+
+    def rerank(self, query, hits, top_n):
+        """
+        Orders hits by reranker score (fused order breaks ties) and returns the best top_n,
+        each with its "rerank_score". Returns None if the reranker dropped out.
+        """
+        if not hits:
+            return hits
+        t0 = time.perf_counter()
+        scores = self.score(query, hits)
+        if scores is None:
+            return None
+        ranked = sorted(zip(scores, range(len(hits)), hits), key=lambda item: (-item[0], item[1]))
+        print(COLOR_WARN + f"[Rerank] Graded {len(hits)} candidates in {(time.perf_counter() - t0) * 1000:.0f} ms.")
+        return [dict(hit, rerank_score=score) for score, _, hit in ranked[:top_n]]
+
+_RERANKER = None
+_RERANKER_LOCK = threading.Lock()
+
+def get_reranker():
+    """Returns the shared reranker (created on first use)."""
+    global _RERANKER
+    with _RERANKER_LOCK:
+        if _RERANKER is None:
+            _RERANKER = LLMReranker()
+            print(Fore.YELLOW + f"[Rerank] Using '{_RERANKER.model}' with a {_RERANKER.budget_seconds:.1f}s budget.")
+        return _RERANKER
@@ -0,0 +1,116 @@
+# In response_cache.py
+
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import OrderedDict
+from config import RESPONSE_CACHE_THRESHOLD, RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES
+
+# Replay granularity: one word plus its trailing whitespace, like a model token stream
+_REPLAY_PIECE = re.compile(r"\S+\s*|\s+")
+
+def context_fingerprint(context, conversation=()):
+    """
+    Identifies what an answer was generated from: the retrieved context and the conversation
+    before the question (messages as {"role", "content"}), so a follow-up such as "tell me more"
+    is only answered from the cache within the same conversation.
+    """
+    digest = hashlib.sha256(context.encode("utf-8"))
+    for message in conversation:
+        digest.update(b"\0" + message["role"].encode("utf-8") + b"\0" + message["content"].encode("utf-8"))
+    return digest.hexdigest()
+
+def _normalize(vector):
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+def replay_stream(answer):
+    """Yields a cached answer in token-sized pieces, so callers can treat it like a live stream."""
+    for match in _REPLAY_PIECE.finditer(answer):
+        yield match.group(0)
+
+# ----------------------------------------------------
+# Semantic answer cache
+# ----------------------------------------------------
+class ResponseCache:
+    """
+    Caches final answers keyed by (query embedding, context fingerprint).
+    A lookup hits when a stored answer was produced from the exact same context and
+    conversation for a query whose embedding is at least `threshold` cosine-similar.
+    Entries expire after `ttl` seconds; the oldest are dropped beyond `max_entries`.
+    Safe to share between threads.
+    """
+
+    def __init__(self, threshold=RESPONSE_CACHE_THRESHOLD, ttl=RESPONSE_CACHE_TTL,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # entry id -> (context fingerprint, unit query vector, answer, created)
+        self._by_context = {}           # context fingerprint -> set of entry ids
+        self._next_id = 0
+
+    def _drop(self, entry_id):
+        fingerprint = self._entries.pop(entry_id)[0]
+        ids = self._by_context.get(fingerprint)
+        if ids is not None:
+            ids.discard(entry_id)
+            if not ids:
+                del self._by_context[fingerprint]
+
+    def lookup(self, query_embedding, fingerprint):
+        """Returns the cached answer for a similar query over the same context, or None."""
+        query = _normalize(query_embedding)
+        now = time.time()
+        with self._lock:
+            best_id, best_similarity = None, self.threshold
+            for entry_id in list(self._by_context.get(fingerprint, ())):
+                _, vector, _, created = self._entries[entry_id]
+                if now - created > self.ttl:
+                    self._drop(entry_id)
+                    continue
+                similarity = sum(a * b for a, b in zip(query, vector))
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][2]
+
+    def store(self, query_embedding, fingerprint, answer):
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (fingerprint, _normalize(query_embedding), answer, time.time())
+            self._by_context.setdefault(fingerprint, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self):
+        """Forgets every answer; called whenever the indexed PDFs change."""
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+RESPONSE_CACHE = ResponseCache()
+
+def get_response_cache():
+    """Returns the shared answer cache."""
+    return RESPONSE_CACHE
@@ -0,0 +1,125 @@
+# In startup_utils.py
+
+import importlib
+import threading
+import time
+from colorama import Fore
+
+# Process start, as close as we can get it (this module is imported first by main.py)
+PROCESS_START = time.perf_counter()
+
+# ----------------------------------------------------
+# Background startup: named stages, each started as soon as the stages it needs are done
+# ----------------------------------------------------
+class StartupTasks:
+    """
+    Runs startup stages (imports, server checks, index loading, ...) on background threads
+    while the user is already at the prompt. Each stage waits only for the stages it needs,
+    so independent stages run at the same time. Callers block only on the stage they need
+    with wait(). A stage is skipped when a stage it needs failed;
+    wait() on a failed stage runs it again (after the stages it needs), so a server that
+    comes back later is picked up, and re-raises the error if it still fails.
+    """
+
+    def __init__(self):
+        self.stages = []      # (name, func) in run order
+        self.timings = {}     # stage name -> seconds
+        self.import_timings = []  # (module, seconds) in import order
+        self.marks = {}       # named moments, seconds since process start
+        self._funcs = {}
+        self._needs = {}      # stage name -> names of the stages it builds on
+        self._done = {}
+        self._errors = {}
+        self._retry_lock = threading.RLock()
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+    def add(self, name, func, needs=()):
+        self.stages.append((name, func))
+        self._funcs[name] = func
+        self._needs[name] = tuple(needs)
+        self._done[name] = threading.Event()
+
+    def mark(self, name):
+        self.marks[name] = time.perf_counter() - PROCESS_START
+
+    def import_modules(self, *module_names):
+        """Imports modules one after another, timing each (shared dependencies count once)."""
+        for module_name in module_names:
+            t0 = time.perf_counter()
+            importlib.import_module(module_name)
+            self.import_timings.append((module_name, time.perf_counter() - t0))
+
+    def _run_stage(self, name):
+        """Runs one stage, unless a stage it needs has failed."""
+        t0 = time.perf_counter()
+        failed_need = next((need for need in self._needs[name] if need in self._errors), None)
+        if failed_need is not None:
+            self._errors[name] = self._errors[failed_need]
+        else:
+            try:
+                self._funcs[name]()
+                self._errors.pop(name, None)
+            except Exception as e:
+                self._errors[name] = e
+                print(Fore.RED + f"\n[Startup] '{name}' failed: {e}")
+        self.timings[name] = time.perf_counter() - t0
+
+    def _run(self, name):
+        for need in self._needs[name]:
+            self._done[need].wait()
+        self._run_stage(name)
+        self._done[name].set()
+        with self._pending_lock:
+            self._pending -= 1
+            finished = self._pending == 0
+        if finished:
+            self.mark("startup finished")
+
+    def _retry(self, name):
+        with self._retry_lock:
+            if name not in self._errors:
+                return  # Another caller's retry already fixed it
+            for need in self._needs[name]:
+                self._retry(need)
+                if need in self._errors:
+                    return  # Still failing; its error stands for this stage too
+            print(Fore.YELLOW + f"[Startup] Retrying '{name}'...")
+            self._run_stage(name)
+
+    def start(self):
+        self._pending = len(self.stages)
+        for name, _ in self.stages:
+            threading.Thread(target=self._run, args=(name,), name=f"startup-{name}", daemon=True).start()
+
+    def is_done(self, name):
+        return self._done[name].is_set()
+
+    def wait(self, name, message=None):
+        """
+        Blocks until stage `name` has run; prints message first if it has to wait.
+        A failed stage is tried again before its error is raised.
+        """
+        if not self._done[name].is_set():
+            if message:
+                print(Fore.YELLOW + message)
+            self._done[name].wait()
+        if name in self._errors:
+            self._retry(name)
+        if name in self._errors:
+            raise RuntimeError(f"startup step '{name}' failed: {self._errors[name]}")
+
+    def report(self):
+        """Startup timings: milestones, background stages and the slowest imports."""
+        lines = [Fore.CYAN + "--- Startup report ---"]
+        for name, seconds in sorted(self.marks.items(), key=lambda item: item[1]):
+            lines.append(f"  {name:<28} {seconds * 1000:9.0f} ms after start")
+        for name, _ in self.stages:
+            if name in self.timings:
+                status = "failed" if name in self._errors else "ok"
+                lines.append(f"  stage {name:<22} {self.timings[name] * 1000:9.0f} ms  {status}")
+            else:
+                lines.append(f"  stage {name:<22} {'running':>9}")
+        for module_name, seconds in sorted(self.import_timings, key=lambda item: item[1], reverse=True):
+            lines.append(f"  import {module_name:<21} {seconds * 1000:9.0f} ms")
+        return "\n".join(lines)
@@ -6,11 +6,11 @@ import re
 from io import BytesIO
 
 # --- Import from local project files ---
-from config import MODEL_NAME, FIXED_SYSTEM_INSTRUCTION
-# Note: We must import the OLLAMA_CLIENT from pdf_utils to ensure consistency
-from pdf_utils import load_pdfs_into_context, CHAT_HISTORY, OLLAMA_CLIENT, PDF_FOLDER, get_chroma_collection
-from rag_utils import retrieve_relevant_chunks
-from ollama_utils import ensure_ollama_running, web_search_lookup 
+from config import MODEL_NAME
+# Note: Chat turns go through the shared async chat engine (same client setup as the CLI)
+from pdf_utils import load_pdfs_into_context, PDF_FOLDER, get_document_catalog, new_chat_history
+from async_chat import stream_chat, prefetch as prefetch_retrieval, warm_chat_model, STOPPED_MARKER
+from ollama_utils import ensure_ollama_running, get_supervisor, web_search_lookup 
 # --- End Imports ---
 
 # -----------------
@@ -91,6 +91,9 @@ if "stop_generation" not in st.session_state:
     st.session_state.stop_generation = False 
 if "current_prompt" not in st.session_state:
     st.session_state.current_prompt = None
+# What the model sees for this browser session only (the collection and client are shared)
+if "model_history" not in st.session_state:
+    st.session_state.model_history = new_chat_history()
 
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = [] 
@@ -105,6 +108,8 @@ def initialize_environment():
     """Run environment checks and RAG context loading once."""
     try:
         ensure_ollama_running() 
+        # Load the chat model (and cache the system prompt) while the PDFs sync
+        warm_chat_model(MODEL_NAME)
         # Load context. This call also initializes the CHROMA_COLLECTION object globally.
         load_pdfs_into_context(clear_existing=False) 
         return True
@@ -131,7 +136,7 @@ def handle_stop_click():
 def _add_pdf_to_rag(file_name: str, file_bytes: bytes):
     """Saves the uploaded file and triggers RAG re-indexing."""
     # Import necessary functions from pdf_utils locally
-    from pdf_utils import _add_single_pdf_to_context, PDF_FOLDER, CHAT_HISTORY 
+    from pdf_utils import _add_single_pdf_to_context, PDF_FOLDER
     
     try:
         pdf_folder = PDF_FOLDER 
@@ -145,63 +150,49 @@ def _add_pdf_to_rag(file_name: str, file_bytes: bytes):
         # 2. Index the new file
         _add_single_pdf_to_context(dest_path, file_name, 0)
         
-        # 3. Update Streamlit and Global History
+        # 3. Update Streamlit and Session History
         st.session_state.chat_history.append({"role": "assistant", 
                                               "content": f"✅ PDF **'{file_name}'** uploaded and RAG context updated."})
-        CHAT_HISTORY.clear() # Clear the global model history
+        st.session_state.model_history.clear() # Clear this session's model history
         
     except Exception as e:
         st.session_state.chat_history.append({"role": "assistant", 
                                               "content": f"❌ PDF Upload Error for **'{file_name}'**: {e}"})
         st.error(f"Error processing PDF: {e}")
 
-def stream_response_generator(user_query):
-    # ... (stream_response_generator remains the same as the previous version) ...
+def stream_response_generator(user_query, status_placeholder):
     """
-    Generator that handles RAG, Ollama chat, and checks for the stop signal.
+    Generator that streams the async chat engine's reply and checks for the stop signal.
+    While the request waits for a free generation slot, its queue position is shown.
     """
-    global CHAT_HISTORY
-
-    # 1. RAG Context Retrieval (blocking)
-    rag_context = retrieve_relevant_chunks(user_query)
-    system_instruction = FIXED_SYSTEM_INSTRUCTION + "\n\n" + rag_context
-
-    # Update Global History
-    if not CHAT_HISTORY:
-        CHAT_HISTORY.append({"role": "system", "content": system_instruction})
-    else:
-        CHAT_HISTORY[0]["content"] = system_instruction
-        
-    CHAT_HISTORY.append({"role": "user", "content": user_query})
+    def show_queue_position(position):
+        if position:
+            status_placeholder.caption(f"⏳ Joel is busy with other questions. You are number {position} in the queue...")
+        else:
+            status_placeholder.empty()
 
-    # 2. Stream from Ollama
-    assistant_reply = ""
+    # RAG retrieval, answer-cache lookup and generation run on the shared engine,
+    # with this session's own conversation history
+    response = stream_chat(user_query, history=st.session_state.model_history,
+                           model_name=MODEL_NAME, on_queue=show_queue_position)
     try:
-        stream = OLLAMA_CLIENT.chat(model=MODEL_NAME, messages=CHAT_HISTORY, stream=True)
-        
-        for chunk in stream:
+        for i, text in enumerate(response):
+            if i == 0:
+                status_placeholder.empty()
             if st.session_state.stop_generation:
-                break 
-                
-            text = chunk["message"]["content"]
-            assistant_reply += text
+                # Closing the stream stops generation; the engine records the truncated reply
+                response.close()
+                st.session_state.stop_generation = False
+                yield STOPPED_MARKER
+                return
             yield text
-            
-        # 3. Final Update to global CHAT_HISTORY
-        if assistant_reply.strip() and not st.session_state.stop_generation:
-            CHAT_HISTORY.append({"role": "assistant", "content": assistant_reply})
-            
-        elif st.session_state.stop_generation:
-            truncated_reply = assistant_reply + "\n\n**[Response stopped by user]**"
-            CHAT_HISTORY.append({"role": "assistant", "content": truncated_reply})
-            st.session_state.stop_generation = False 
-            yield "\n\n**[Response stopped by user]**"
-            
+
     except Exception as e:
-        if CHAT_HISTORY and CHAT_HISTORY[-1]["role"] == "user":
-            CHAT_HISTORY.pop()
         error_msg = f"**An error occurred:** {e}. Please check your Ollama server and model '{MODEL_NAME}'."
         yield error_msg
+    finally:
+        # Also stops generation when Streamlit abandons this run (e.g. the stop button rerun)
+        response.close()
 
 
 def handle_input_submit():
@@ -213,6 +204,9 @@ def handle_input_submit():
         prompt = st.session_state.chat_input_widget
         st.session_state.current_prompt = prompt
         st.session_state.is_generating = True
+        if not prompt.lower().startswith("/search "):
+            # Retrieval starts now and overlaps with the rerun below
+            prefetch_retrieval(prompt, st.session_state.model_history.web_store)
         st.session_state.stop_generation = False
         st.session_state.chat_input_widget = ""
         st.rerun() 
@@ -236,43 +230,69 @@ with st.sidebar:
                 _add_pdf_to_rag(uploaded_file.name, uploaded_file.read())
             st.rerun()
 
+    st.markdown("---")
+    st.header("Ollama Status")
+    # Kept current by the supervisor's background probes; refreshed on every rerun
+    health = get_supervisor().health()
+    status_icon = {"healthy": "🟢", "degraded": "🟡", "starting": "🟡", "restarting": "🟠"}.get(health["status"], "🔴")
+    latency = f"{health['latency_ms']:.0f} ms" if health["latency_ms"] is not None else "n/a"
+    st.caption(f"{status_icon} Server {health['status']} · latency {latency} · restarts {health['restarts']} · circuit {health['circuit']}")
+    for model_name, model_status in health["models"].items():
+        st.caption(f"{'✅' if model_status == 'loaded' else '⏳'} {model_name}: {model_status}")
+    if health["status"] in ("down", "degraded") and health["last_error"]:
+        st.caption(f"⚠️ {health['last_error']}")
+
     st.markdown("---")
     st.header("Available RAG Documents")
     
     try:
-        # Get the ChromaDB collection object
-        collection = get_chroma_collection()
+        # The catalog is maintained by the indexer, so listing documents costs nothing
+        # on reruns: no Chroma scan and no PDF reads
+        catalog = get_document_catalog()
         
-        if collection and collection.count() > 0:
-            # Retrieve unique document sources (file names) from metadata
-            # This is a bit complex in Chroma without direct 'DISTINCT' queries, 
-            # so we fetch all metadatas and find unique sources.
-            all_metadatas = collection.get(include=['metadatas'])['metadatas']
-            unique_sources = set(m.get('source') for m in all_metadatas if m and m.get('source'))
-            
-            if unique_sources:
-                st.info(f"Found {len(unique_sources)} indexed documents:")
-                for source_name in sorted(list(unique_sources)):
-                    pdf_path = os.path.join(PDF_FOLDER, source_name)
-                    
-                    if os.path.exists(pdf_path):
-                        # Read the file bytes
+        if catalog:
+            st.info(f"Found {len(catalog)} indexed documents:")
+            st.dataframe(
+                [
+                    {
+                        "Document": source_name,
+                        "Pages": entry["pages"],
+                        "Chunks": entry["chunks"],
+                        "Size (MB)": round((entry["size"] or 0) / (1024 * 1024), 2),
+                    }
+                    for source_name, entry in catalog.items()
+                ],
+                hide_index=True,
+                use_container_width=True
+            )
+
+            selected_source = st.selectbox("Download a document:", list(catalog), index=None,
+                                           placeholder="Choose a PDF...")
+            # download_button holds its whole payload in memory, so a PDF is only read once the
+            # user asks for it, and the session keeps at most the selected one
+            prepared = st.session_state.get("prepared_download")
+            if prepared and prepared[0] != selected_source:
+                del st.session_state.prepared_download
+                prepared = None
+            if selected_source:
+                pdf_path = os.path.join(PDF_FOLDER, selected_source)
+                if prepared:
+                    # Use download_button as the Streamlit-native way to prompt view/download
+                    st.download_button(
+                        label=f"📄 {selected_source}",
+                        data=prepared[1],
+                        file_name=selected_source,
+                        mime='application/pdf',
+                        key=f"download_{selected_source}",
+                        use_container_width=True
+                    )
+                elif os.path.exists(pdf_path):
+                    if st.button(f"Prepare {selected_source} for download", use_container_width=True):
                         with open(pdf_path, "rb") as f:
-                            pdf_bytes = f.read()
-                        
-                        # Use download_button as the Streamlit-native way to prompt view/download
-                        st.download_button(
-                            label=f"📄 {source_name}",
-                            data=pdf_bytes,
-                            file_name=source_name,
-                            mime='application/pdf',
-                            key=f"download_{source_name}",
-                            use_container_width=True
-                        )
-                    else:
-                        st.caption(f"⚠️ {source_name} (File not found)")
-            else:
-                st.caption("No unique sources found in the database.")
+                            st.session_state.prepared_download = (selected_source, f.read())
+                        st.rerun()
+                else:
+                    st.caption(f"⚠️ {selected_source} (File not found)")
         else:
             st.caption("The RAG database is currently empty.")
             
@@ -338,7 +358,8 @@ if st.session_state.current_prompt:
         
         with st.chat_message("assistant", avatar="🤖"):
             with st.spinner(f"Searching the web for '{query}'..."):
-                results_text_raw = web_search_lookup(query)
+                # Results also become context for this session's follow-up questions
+                results_text_raw = web_search_lookup(query, web_store=st.session_state.model_history.web_store)
                 results_text = re.sub(r'\x1b\[[0-9;]*m', '', results_text_raw).replace('\n', '\n\n')
                 st.markdown(results_text)
                 
@@ -346,7 +367,8 @@ if st.session_state.current_prompt:
             
     else:
         with st.chat_message("assistant", avatar="🤖"):
-            response_generator = stream_response_generator(prompt_to_process)
+            status_placeholder = st.empty()
+            response_generator = stream_response_generator(prompt_to_process, status_placeholder)
             full_assistant_response = st.write_stream(response_generator)
             st.session_state.chat_history.append({"role": "assistant", "content": full_assistant_response})
 
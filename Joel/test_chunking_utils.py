@@ -0,0 +1,42 @@
+# In test_chunking_utils.py
+#
+#   python -m pytest test_chunking_utils.py     (or: python -m unittest test_chunking_utils)
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from chunking_utils import split_sentences, leading_fragment
+
+class SplitSentencesTest(unittest.TestCase):
+
+    def test_keeps_closing_quotes_and_brackets(self):
+        text = 'He said "stop." Then he left (see Fig. 1.) Next one.'
+        self.assertEqual(split_sentences(text),
+                         ['He said "stop."', 'Then he left (see Fig. 1.)', 'Next one.'])
+
+    def test_abbreviations_initials_and_list_numbers_do_not_end_sentences(self):
+        text = "1. Setup is quick, e.g. one command. Dr. J. Smith wrote it in 1990. Really? Yes!"
+        self.assertEqual(split_sentences(text), [
+            "1. Setup is quick, e.g. one command.",
+            "Dr. J. Smith wrote it in 1990.",
+            "Really?",
+            "Yes!",
+        ])
+
+    def test_joining_sentences_returns_the_original_text(self):
+        texts = [
+            'He said "stop." Then he left (see Fig. 1.) Next one.',
+            "Wait... what? It was [see ref. 3.] fine. 'Quoted.' The end",
+            "No sentence end at all",
+        ]
+        for text in texts:
+            self.assertEqual(" ".join(split_sentences(text)), text)
+
+    def test_leading_fragment_keeps_its_closer(self):
+        self.assertEqual(leading_fragment("of the sentence.) Next one. Third."),
+                         ("of the sentence.)", "Next one. Third."))
+
+if __name__ == "__main__":
+    unittest.main()
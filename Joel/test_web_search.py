@@ -0,0 +1,79 @@
+# In test_web_search.py
+#
+# /search caching and per-session web context, run offline: embeddings come from
+# benchmark.py's fake Ollama server and the search backend is a local stub.
+#
+#   python -m pytest test_web_search.py     (or: python -m unittest test_web_search)
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark import FakeOllamaServer
+
+_SERVER = None
+_WORKDIR = None
+_PREVIOUS_CWD = None
+
+def setUpModule():
+    global _SERVER, _WORKDIR, _PREVIOUS_CWD
+    _SERVER = FakeOllamaServer().start()
+    # The RAG modules read the host at import time and keep their data in relative paths
+    os.environ["JOEL_OLLAMA_HOST"] = _SERVER.host
+    _WORKDIR = tempfile.mkdtemp(prefix="joel_test_")
+    _PREVIOUS_CWD = os.getcwd()
+    os.chdir(_WORKDIR)
+
+def tearDownModule():
+    os.chdir(_PREVIOUS_CWD)
+    _SERVER.stop()
+    shutil.rmtree(_WORKDIR, ignore_errors=True)
+
+class StubSearch:
+    """Stands in for the live search endpoint and counts the requests it gets."""
+
+    def __init__(self, results):
+        self.results = results
+        self.queries = []
+
+    def __call__(self, query, max_results):
+        self.queries.append(query)
+        return {"summary": f"About {query}.", "results": self.results[:max_results]}
+
+class WebSearchLookupTest(unittest.TestCase):
+
+    def test_cached_search_and_session_context(self):
+        import ollama_utils
+        import pdf_utils
+        import rag_utils
+
+        stub = StubSearch([
+            {"title": "Zorblax widget", "url": "https://example.com/zorblax",
+             "content": "The zorblax widget calibrates flux capacitors in under four seconds."},
+            {"title": "Widget history", "url": "https://example.com/history",
+             "content": "Zorblax widgets were first built by the Quintor guild in 1894."},
+        ])
+        web_store = pdf_utils.new_chat_history().web_store
+
+        first = ollama_utils.web_search_lookup("Zorblax widget?", web_store=web_store, search=stub)
+        self.assertIn("https://example.com/zorblax", first)
+        self.assertEqual(stub.queries, ["Zorblax widget?"])
+
+        # Normalizes to the same search: answered from the cache, the backend is not called
+        second = ollama_utils.web_search_lookup("zorblax   widget", web_store=web_store, search=stub)
+        self.assertIn("https://example.com/zorblax", second)
+        self.assertEqual(stub.queries, ["Zorblax widget?"])
+
+        # The stored results are retrieved as context for a follow-up question
+        context = rag_utils.retrieve_relevant_chunks("How fast does the zorblax widget calibrate?",
+                                                     web_store=web_store)
+        self.assertIn("calibrates flux capacitors", context)
+
+        web_store.clear()
+        self.assertIsNone(web_store.live_collection())
+
+if __name__ == "__main__":
+    unittest.main()
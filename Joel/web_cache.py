@@ -0,0 +1,97 @@
+# In web_cache.py
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from config import WEB_CACHE_PATH, WEB_CACHE_MAX_ENTRIES
+
+# ----------------------------------------------------
+# On-disk cache of web lookups (API responses, fetched pages, summaries)
+# ----------------------------------------------------
+class WebCache:
+    """
+    Stores JSON-serializable values in SQLite with the time they were stored.
+    Freshness is decided by the reader: get(..., max_age=seconds) ignores older entries,
+    max_age=None accepts any age (for values that never go stale, like the summary of a
+    specific page revision). Least recently used entries are evicted past max_entries.
+    Safe to share between threads.
+    """
+
+    def __init__(self, path=WEB_CACHE_PATH, max_entries=WEB_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def make_key(*parts):
+        return hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+    def get(self, key, max_age=None):
+        """Returns the stored value, or None if it is missing or older than max_age seconds."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, stored_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or (max_age is not None and now - row[1] > max_age):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                existed = self._conn.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, stored_at, last_used) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), now, now),
+                )
+                if existed is None:
+                    self._entries += 1
+                overflow = self._entries - self.max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used LIMIT ?)",
+                        (overflow,),
+                    )
+                    self._entries -= overflow
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._entries,
+            "max_entries": self.max_entries,
+        }
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_web_cache():
+    """Returns the shared web cache, opening it on first use."""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            _CACHE = WebCache()
+        return _CACHE
@@ -0,0 +1,93 @@
+# In web_context.py
+
+import hashlib
+import threading
+import time
+import uuid
+import weakref
+import chromadb
+from ingest_utils import CHUNKER
+from config import WEB_CONTEXT_TTL
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+def get_ephemeral_client():
+    """In-memory Chroma client for short-lived collections (nothing is written to disk)."""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = chromadb.EphemeralClient()
+        return _CLIENT
+
+def _drop_collection(name):
+    try:
+        get_ephemeral_client().delete_collection(name=name)
+    except Exception:
+        pass # Never created, or already gone
+
+# ----------------------------------------------------
+# Per-session web search results, searchable like the PDF index
+# ----------------------------------------------------
+class SessionWebStore:
+    """
+    The web search results of one chat session, chunked and embedded into an in-memory
+    vector collection, so follow-up questions retrieve them through retrieve_relevant_chunks
+    without searching again. Results expire after ttl seconds; the collection is dropped
+    with the store (e.g. when a Streamlit session ends) or by clear().
+    """
+
+    def __init__(self, embedding_function, ttl=WEB_CONTEXT_TTL):
+        self.embedding_function = embedding_function
+        self.ttl = ttl
+        self.name = f"web_session_{uuid.uuid4().hex}"
+        self._collection = None
+        self._lock = threading.Lock()
+        weakref.finalize(self, _drop_collection, self.name)
+
+    def _get_collection(self):
+        if self._collection is None:
+            self._collection = get_ephemeral_client().get_or_create_collection(
+                name=self.name,
+                embedding_function=self.embedding_function
+            )
+        return self._collection
+
+    def add_results(self, query, results):
+        """Adds search results ({"title", "url", "content"}); returns the number of passages stored."""
+        ids, documents, metadatas = [], [], []
+        now = time.time()
+        for result in results:
+            text = (result.get("content") or "").strip()
+            if not text:
+                continue
+            source = result.get("url") or result.get("title") or "web"
+            # Page-style chunk ids, so neighbouring passages of one page merge in the context
+            prefix = "web_" + hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+            for i, chunk in enumerate(CHUNKER.split_page(text)):
+                ids.append(f"{prefix}_p1_{i}")
+                documents.append(chunk)
+                metadatas.append({"source": source, "title": result.get("title") or "", "page": 1,
+                                  "query": query, "added_at": now})
+        if not ids:
+            return 0
+        with self._lock:
+            collection = self._get_collection()
+            # A page seen again replaces its earlier passages
+            collection.delete(where={"source": {"$in": sorted({m["source"] for m in metadatas})}})
+            collection.upsert(ids=ids, documents=documents, metadatas=metadatas)
+        return len(ids)
+
+    def live_collection(self):
+        """The collection with expired results removed, or None if no results are left."""
+        with self._lock:
+            if self._collection is None:
+                return None
+            self._collection.delete(where={"added_at": {"$lt": time.time() - self.ttl}})
+            return self._collection if self._collection.count() else None
+
+    def clear(self):
+        with self._lock:
+            if self._collection is not None:
+                _drop_collection(self.name)
+                self._collection = None
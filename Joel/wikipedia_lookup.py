@@ -1,69 +1,185 @@
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
 import requests
-import ollama
+from colorama import Fore
+from pdf_utils import OLLAMA_CLIENT
+from history_utils import estimate_tokens
+from chunking_utils import split_sentences
+from web_cache import get_web_cache
+from config import (
+    MODEL_NAME, OLLAMA_KEEP_ALIVE, WEB_REQUEST_TIMEOUT, WIKI_ARTICLE_TTL, WIKI_SUMMARY_MODEL,
+    WIKI_SECTION_TOKENS, WIKI_MAX_SECTIONS, WIKI_MAX_IN_FLIGHT
+)
 
-def wikipedia_lookup(topic: str) -> str:
+WIKI_API_URL = "https://en.wikipedia.org/w/api.php"
+# Plain-text extracts mark sections with "== Title ==" lines (deeper levels use more "=")
+_SECTION_HEADING = re.compile(r"^(={2,})\s*(.+?)\s*\1\s*$", re.MULTILINE)
+# Reference lists and link collections: nothing to summarize
+_SKIPPED_SECTIONS = {"see also", "references", "external links", "notes", "further reading",
+                     "bibliography", "sources", "citations", "footnotes"}
+
+SYSTEM_INSTRUCTION = "You summarize text cleanly and accurately."
+SECTION_INSTRUCTION = (
+    "Summarize this part of a Wikipedia article in 2-6 concise bullet points. "
+    "Keep names, dates and numbers. Reply with the bullet points only."
+)
+COMBINE_INSTRUCTION = (
+    "Below are bullet-point summaries of consecutive parts of one Wikipedia article. "
+    "Combine them into one clean bullet-point summary of the whole article, in a sensible order, "
+    "without repeating points."
+)
+
+# Pooled connections to the Wikipedia API (Wikipedia asks clients to identify themselves)
+_SESSION = requests.Session()
+_SESSION.headers.update({"User-Agent": "JoelAssistant/1.0 (local RAG assistant)"})
+_SUMMARY_EXECUTOR = ThreadPoolExecutor(max_workers=WIKI_MAX_IN_FLIGHT, thread_name_prefix="wiki-summary")
+
+# ----------------------------------------------------
+# Fetching (one cached API request per topic)
+# ----------------------------------------------------
+def fetch_article(topic):
     """
-    Searches Wikipedia → fetches full article → summarizes using LLM.
+    The best-matching article for topic as {"title", "revid", "content"}, or None if nothing matches.
+    Search and extract are a single request (generator=search), cached for WIKI_ARTICLE_TTL.
     """
+    cache = get_web_cache()
+    key = cache.make_key("wikipedia-article", " ".join(topic.lower().split()))
+    article = cache.get(key, max_age=WIKI_ARTICLE_TTL)
+    if article is None:
+        params = {
+            "action": "query",
+            "generator": "search",
+            "gsrsearch": topic,
+            "gsrlimit": 1,  # best match
+            "prop": "extracts|revisions",
+            "explaintext": True,
+            "rvprop": "ids",
+            "redirects": 1,
+            "format": "json",
+        }
+        response = _SESSION.get(WIKI_API_URL, params=params, timeout=WEB_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        pages = response.json().get("query", {}).get("pages", {})
+        article = {}  # Cached too, so a topic without results is not searched again right away
+        if pages:
+            page = next(iter(pages.values()))
+            article = {
+                "title": page.get("title", topic),
+                "revid": (page.get("revisions") or [{}])[0].get("revid"),
+                "content": page.get("extract", ""),
+            }
+        cache.put(key, article)
+    return article or None
 
-    # Step 1 — Search for closest page
-    search_url = "https://en.wikipedia.org/w/api.php"
-    search_params = {
-        "action": "query",
-        "list": "search",
-        "srsearch": topic,
-        "format": "json"
-    }
+# ----------------------------------------------------
+# Map-reduce summarization
+# ----------------------------------------------------
+def split_sections(content):
+    """[(heading, text)] in article order, without empty and reference sections."""
+    sections, heading, start = [], "Introduction", 0
+    for match in _SECTION_HEADING.finditer(content):
+        sections.append((heading, content[start:match.start()].strip()))
+        heading, start = match.group(2), match.end()
+    sections.append((heading, content[start:].strip()))
+    return [(heading, text) for heading, text in sections
+            if text and heading.lower() not in _SKIPPED_SECTIONS]
 
-    try:
-        search_res = requests.get(search_url, params=search_params).json()
-        hits = search_res.get("query", {}).get("search", [])
-        if not hits:
-            return f"❌ No Wikipedia results for '{topic}'."
+def _split_long(text, token_budget):
+    """Splits text longer than token_budget at line breaks, or at sentence ends within a long line."""
+    if estimate_tokens(text) <= token_budget:
+        return [text]
+    units = []
+    for line in text.split("\n"):
+        units.extend(split_sentences(line) if estimate_tokens(line) > token_budget else [line])
+    pieces, current = [], ""
+    for unit in units:
+        if current and estimate_tokens(current + "\n" + unit) > token_budget:
+            pieces.append(current)
+            current = unit
+        else:
+            current = f"{current}\n{unit}" if current else unit
+    if current:
+        pieces.append(current)
+    # A single sentence over the budget is cut (estimate_tokens counts about 4 characters per token)
+    return [piece[:token_budget * 4] for piece in pieces]
 
-        page_title = hits[0]["title"]  # best match
-    except Exception as e:
-        return f"❌ Wikipedia search failed: {e}"
+def pack_sections(sections, token_budget=WIKI_SECTION_TOKENS):
+    """Groups consecutive sections into parts of at most about token_budget tokens."""
+    parts, current, used = [], [], 0
+    for heading, text in sections:
+        for piece in _split_long(f"{heading}\n{text}", token_budget):
+            size = estimate_tokens(piece)
+            if current and used + size > token_budget:
+                parts.append("\n\n".join(current))
+                current, used = [], 0
+            current.append(piece)
+            used += size
+    if current:
+        parts.append("\n\n".join(current))
+    return parts
 
-    # Step 2 — Get full extract of the matched page
-    extract_params = {
-        "action": "query",
-        "prop": "extracts",
-        "explaintext": True,
-        "titles": page_title,
-        "format": "json",
-        "redirects": 1
-    }
+def _summarize(instruction, text, model):
+    response = OLLAMA_CLIENT.chat(
+        model=model,
+        messages=[
+            {"role": "system", "content": SYSTEM_INSTRUCTION},
+            {"role": "user", "content": f"{instruction}\n\n{text}"}
+        ],
+        keep_alive=OLLAMA_KEEP_ALIVE,
+    )
+    return response["message"]["content"].strip()
 
-    try:
-        extract_res = requests.get(search_url, params=extract_params).json()
-        pages = extract_res.get("query", {}).get("pages", {})
-        page = next(iter(pages.values()))
-        content = page.get("extract", "")
+def summarize_article(article, model=None):
+    """
+    Bullet-point summary of an article, memoized per revision: a page is only summarized
+    again after it has been edited. An article that fits in WIKI_SECTION_TOKENS takes one
+    call; a longer one is split into groups of sections that are summarized in parallel,
+    then combined into one summary.
+    """
+    model = model or WIKI_SUMMARY_MODEL or MODEL_NAME
+    title, content = article["title"], article["content"]
+    revision = article["revid"] or hashlib.sha1(content.encode("utf-8")).hexdigest()
+    cache = get_web_cache()
+    key = cache.make_key("wikipedia-summary", model, title, revision)
+    summary = cache.get(key)  # A revision never changes, so neither does its summary
+    if summary is not None:
+        return summary
 
-        if not content.strip():
-            return f"❌ Could not extract Wikipedia article for '{topic}'."
+    parts = pack_sections(split_sections(content))
+    if len(parts) <= 1:
+        summary = _summarize("Summarize the following Wikipedia article in clean bullet points.",
+                             f"Topic: {title}\n\nArticle:\n{''.join(parts) or content}", model)
+    else:
+        if len(parts) > WIKI_MAX_SECTIONS:
+            print(Fore.YELLOW + f"[Wikipedia] Long article: summarizing its first {WIKI_MAX_SECTIONS} of {len(parts)} parts.")
+            parts = parts[:WIKI_MAX_SECTIONS]
+        print(Fore.YELLOW + f"[Wikipedia] Summarizing '{title}' in {len(parts)} parts...")
+        partials = list(_SUMMARY_EXECUTOR.map(
+            lambda part: _summarize(SECTION_INSTRUCTION, f"Topic: {title}\n\n{part}", model), parts))
+        summary = _summarize(COMBINE_INSTRUCTION, f"Topic: {title}\n\n" + "\n\n".join(partials), model)
+    cache.put(key, summary)
+    return summary
 
-    except Exception as e:
-        return f"❌ Failed to extract article: {e}"
+def wikipedia_lookup(topic: str) -> str:
+    """
+    Searches Wikipedia → fetches full article → summarizes using LLM.
+    """
 
-    # Step 3 — Summarize using LLM
-    prompt = (
-        f"Summarize the following Wikipedia article in clean bullet points.\n"
-        f"Topic: {page_title}\n\n"
-        f"Article:\n{content}"
-    )
+    # Step 1 — Find the closest page and its full extract (one request, cached)
+    try:
+        article = fetch_article(topic)
+    except Exception as e:
+        return f"❌ Wikipedia search failed: {e}"
+    if article is None:
+        return f"❌ No Wikipedia results for '{topic}'."
+    if not article["content"].strip():
+        return f"❌ Could not extract Wikipedia article for '{topic}'."
 
+    # Step 2 — Summarize using LLM (section by section for long articles, memoized per revision)
     try:
-        response = ollama.chat(
-            model="gemma3:12b",
-            messages=[
-                {"role": "system", "content": "You summarize text cleanly and accurately."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        summary = response["message"]["content"]
+        summary = summarize_article(article)
     except Exception as e:
         return f"❌ LLM summarization failed: {e}"
 
-    return f"📘 **Summary of {page_title}:**\n\n{summary}"
+    return f"📘 **Summary of {article['title']}:**\n\n{summary}"
@@ -1,8 +1,18 @@
 import ollama
 import sys
 import os
+import codecs
+import heapq
+import math
+import queue
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeout
+from html.parser import HTMLParser
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 from duckduckgo_search import DDGS
 import pypdf
 import pyttsx3
@@ -17,14 +27,36 @@ FIXED_SYSTEM_INSTRUCTION = (
 
 MODEL_NAME = "llama3.1:latest"
 
-# Initialize TTS engine
-tts = pyttsx3.init()
+# Web search: result pages are scraped in parallel, and the whole search gets one deadline
+WEB_DEADLINE_SECONDS = 8     # Search + scraping; pages not done by then are left out
+WEB_QUORUM = 2               # The answer starts once this many pages are in; slower ones are left out
+SCRAPE_TIMEOUT = 5           # Connect/read timeout per page
+SCRAPE_WORKERS = 8           # Pages fetched at once (also the HTTP connection pool size)
+SCRAPE_WORD_LIMIT = 200      # Words of paragraph text kept per page
+SCRAPE_MAX_BYTES = 2_000_000 # Stop downloading a page after this much HTML
+PAGE_CACHE_TTL = 15 * 60     # Seconds a scraped page is reused
+
+# Voice: answers are spoken sentence by sentence while they are still being generated
+MAX_SEGMENT_CHARS = 220      # Speak long runs without sentence punctuation in pieces of about this size
 
 # --- RAG Core Utilities ---
+TOKEN_PATTERN = re.compile(r"\w+")
+POSTINGS_SCAN_LIMIT = 2000  # Most lines a single query term can score (its best-weighted ones)
+# Too common to tell lines apart; skipping them also keeps the longest postings out of queries
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how in is it its of on or that the this "
+    "to was were what when where which who why will with".split()
+)
+
+
+def tokenize(text):
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
 def load_pdfs_into_context(pdf_folder="data_pdfs"):
-    context = ""
+    pages = []
     if not os.path.isdir(pdf_folder):
-        return context
+        return ""
 
     for filename in os.listdir(pdf_folder):
         if filename.lower().endswith(".pdf"):
@@ -33,123 +65,448 @@ def load_pdfs_into_context(pdf_folder="data_pdfs"):
                 with open(path, "rb") as file:
                     reader = pypdf.PdfReader(file)
                     for page in reader.pages:
-                        context += page.extract_text() + "\n"
+                        pages.append(page.extract_text() or "")
             except Exception as e:
                 print(f"Error loading {filename}: {e}")
-    return context
+    # Joined once at the end: repeated += copies the whole string every page
+    return "\n".join(pages)
+
+
+class KeywordIndex:
+    """
+    TF-IDF inverted index over the lines of the loaded documents, built once at load time.
+    Each term maps to the lines containing it with a precomputed, length-normalized weight,
+    so a query only walks the postings of its own terms and takes the best lines from a heap.
+    """
+
+    def __init__(self, text):
+        self.chunks = [line for line in text.split("\n") if line.strip()]
+        counts = defaultdict(list)  # term -> [(line id, term frequency)]
+        for chunk_id, chunk in enumerate(self.chunks):
+            for term, frequency in Counter(tokenize(chunk)).items():
+                counts[term].append((chunk_id, frequency))
+
+        line_count = len(self.chunks)
+        norms = [0.0] * line_count
+        weights = {}
+        for term, entries in counts.items():
+            idf = math.log((1 + line_count) / (1 + len(entries))) + 1
+            weights[term] = [(chunk_id, (1 + math.log(frequency)) * idf) for chunk_id, frequency in entries]
+            for chunk_id, weight in weights[term]:
+                norms[chunk_id] += weight * weight
+        # Cosine normalization, so a long line does not win just by containing more words.
+        # Postings are kept highest weight first (impact order), see search().
+        norms = [math.sqrt(norm) or 1.0 for norm in norms]
+        self.postings = {
+            term: sorted(((weight / norms[chunk_id], chunk_id) for chunk_id, weight in entries), reverse=True)
+            for term, entries in weights.items()
+        }
+
+    def search(self, query, top_k=3):
+        """
+        Best top_k lines by TF-IDF cosine score. A term's postings are read best first and at
+        most POSTINGS_SCAN_LIMIT of them, so a term found on most lines (whose low weights
+        rarely decide the top few) cannot make a query slow on a large corpus.
+        """
+        scores = {}
+        for term in set(tokenize(query)):
+            for weight, chunk_id in self.postings.get(term, ())[:POSTINGS_SCAN_LIMIT]:
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + weight
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [self.chunks[chunk_id] for chunk_id, _ in best]
+
 
 DOCUMENT_CONTEXT = load_pdfs_into_context()
+KEYWORD_INDEX = KeywordIndex(DOCUMENT_CONTEXT)
 
 
 # --- RAG retrieval ---
 def retrieve_relevant_chunks(user_query: str, top_k=3):
-    if not DOCUMENT_CONTEXT.strip():
+    if not KEYWORD_INDEX.chunks:
         return ""
 
-    query_words = set(user_query.lower().split())
-    chunks = DOCUMENT_CONTEXT.split("\n")
-
-    ranked = []
-    for chunk in chunks:
-        score = sum(1 for word in query_words if word in chunk.lower())
-        if score > 0:
-            ranked.append((score, chunk))
-
-    ranked.sort(reverse=True, key=lambda x: x[0])
-    return "\n".join(chunk for score, chunk in ranked[:top_k])
+    return "\n".join(KEYWORD_INDEX.search(user_query, top_k))
 
 
 # --- LLM Response ---
-def generate_response(user_query, use_web=False, web_content=None):
+def build_prompt(user_query, use_web=False, web_content=None):
     rag_response = retrieve_relevant_chunks(user_query)
     system_instruction = FIXED_SYSTEM_INSTRUCTION
     if use_web and web_content:
         system_instruction += "\n\nUse the following web information:\n" + web_content
 
-    prompt = (
+    return (
         f"{system_instruction}\n\n"
         f"Relevant Context:\n{rag_response}\n\n"
         f"User Query: {user_query}\n\n"
         f"Final Answer:"
     )
 
+
+def generate_response_stream(user_query, use_web=False, web_content=None, stats=None):
+    """
+    Yields the answer in pieces as the model produces them. A dict passed as stats is filled
+    with time_to_first_token (seconds after the request was sent), tokens and tokens_per_second.
+    """
+    prompt = build_prompt(user_query, use_web, web_content)
+    stats = {} if stats is None else stats
+    start = time.perf_counter()
+    pieces = 0
     try:
-        response = ollama.generate(
-            model=MODEL_NAME,
-            prompt=prompt
-        )
-        return response["response"]
+        for chunk in ollama.generate(model=MODEL_NAME, prompt=prompt, stream=True):
+            text = chunk["response"]
+            if text:
+                if pieces == 0:
+                    stats["time_to_first_token"] = time.perf_counter() - start
+                pieces += 1
+                yield text
+            if chunk.get("done"):
+                # Ollama's own count and timing of the generated tokens (durations are in ns)
+                stats["tokens"] = chunk.get("eval_count") or pieces
+                if chunk.get("eval_duration"):
+                    stats["tokens_per_second"] = stats["tokens"] / (chunk["eval_duration"] / 1e9)
     except Exception as e:
-        return f"Error generating response: {e}"
+        yield f"Error generating response: {e}"
+        return
 
+    if "tokens_per_second" not in stats and "time_to_first_token" in stats:
+        # Older servers leave out the timings: estimate from one token per streamed piece
+        elapsed = time.perf_counter() - start - stats["time_to_first_token"]
+        stats.setdefault("tokens", pieces)
+        if elapsed > 0:
+            stats["tokens_per_second"] = (pieces - 1) / elapsed
+
+
+def generate_response(user_query, use_web=False, web_content=None):
+    """The whole answer as one string (for callers that cannot use the stream)."""
+    return "".join(generate_response_stream(user_query, use_web, web_content))
 
-# --- Web Search + Scraping ---
-def search_web(query: str, result_count=3):
-    results_text = ""
-    try:
-        print(f"🔍 Searching the web for: {query}")
-        with DDGS() as ddgs:
-            results = ddgs.text(query, max_results=result_count)
 
-        for r in results:
-            url = r.get("href")
-            if not url:
-                continue
+def format_stats(stats):
+    parts = []
+    if "time_to_first_token" in stats:
+        parts.append(f"first token {stats['time_to_first_token']:.2f}s")
+    if "tokens" in stats:
+        parts.append(f"{stats['tokens']} tokens")
+    if "tokens_per_second" in stats:
+        parts.append(f"{stats['tokens_per_second']:.1f} tok/s")
+    return " · ".join(parts)
 
-            page_content = scrape_page(url)
+
+# --- Web Search + Scraping ---
+# One pooled session, so repeated searches reuse connections (and TLS sessions) to the same sites
+HTTP = requests.Session()
+HTTP.headers["User-Agent"] = "Mozilla/5.0"
+HTTP.mount("http://", HTTPAdapter(pool_connections=SCRAPE_WORKERS, pool_maxsize=SCRAPE_WORKERS))
+HTTP.mount("https://", HTTPAdapter(pool_connections=SCRAPE_WORKERS, pool_maxsize=SCRAPE_WORKERS))
+SCRAPE_POOL = ThreadPoolExecutor(max_workers=SCRAPE_WORKERS)
+
+PAGE_CACHE = {}  # url -> (fetched at, text)
+PAGE_CACHE_LOCK = threading.Lock()
+
+# Tags that end an open <p> (HTML closes paragraphs implicitly before block elements)
+BLOCK_TAGS = {"div", "section", "article", "aside", "table", "ul", "ol", "dl", "pre", "form",
+              "header", "footer", "nav", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "body"}
+
+
+class ParagraphText(HTMLParser):
+    """
+    Collects the text of <p> elements while the HTML streams in, without building a
+    document tree, and reports done once it has word_limit words.
+    """
+
+    def __init__(self, word_limit=SCRAPE_WORD_LIMIT):
+        super().__init__(convert_charrefs=True)
+        self.word_limit = word_limit
+        self.pieces = []
+        self.word_count = 0
+        self.in_paragraph = False
+        self.skip_depth = 0  # Inside <script>/<style>
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self.skip_depth += 1
+        elif tag == "p" or tag in BLOCK_TAGS:
+            self._end_paragraph()
+            self.in_paragraph = tag == "p"
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == "p" or tag in BLOCK_TAGS:
+            self._end_paragraph()
+
+    def _end_paragraph(self):
+        if self.in_paragraph:
+            self.pieces.append(" ")
+            self.in_paragraph = False
+
+    def handle_data(self, data):
+        if self.in_paragraph and not self.skip_depth:
+            self.pieces.append(data)
+            self.word_count += len(data.split())
+
+    @property
+    def done(self):
+        return self.word_count >= self.word_limit
+
+    def text(self):
+        return " ".join("".join(self.pieces).split()[:self.word_limit])
+
+
+def search_web_results(query: str, result_count=3, deadline_seconds=WEB_DEADLINE_SECONDS):
+    """
+    Yields (url, page text) for the top results as each page finishes scraping, fastest
+    first. All pages are fetched at once; whatever is not done by the deadline is skipped.
+    """
+    deadline = time.monotonic() + deadline_seconds
+    with DDGS(timeout=SCRAPE_TIMEOUT) as ddgs:
+        results = ddgs.text(query, max_results=result_count)
+
+    urls = list(dict.fromkeys(r.get("href") for r in results if r.get("href")))
+    futures = {SCRAPE_POOL.submit(scrape_page, url, deadline): url for url in urls}
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+            pending.discard(future)
+            page_content = future.result()
             if page_content:
-                results_text += f"Source: {url}\n{page_content}\n\n"
+                yield futures[future], page_content
+    except FuturesTimeout:
+        print(f"⏱️ Skipped {len(pending)} slow page(s) after {deadline_seconds}s.")
+    finally:
+        # Pages still downloading stop at the deadline on their own
+        for future in pending:
+            future.cancel()
+
+
+def search_web(query: str, result_count=3, quorum=WEB_QUORUM):
+    """
+    Web content for the prompt from the first `quorum` pages to finish, so the slowest
+    result never holds up the answer. Pages already downloading still finish in the
+    background and are cached, ready for the next search that needs them.
+    """
+    results_text = []
+    try:
+        print(f"🔍 Searching the web for: {query}")
+        start = time.monotonic()
+        # Sources are added in the order they arrive, so slow sites never hold up fast ones
+        for url, page_content in search_web_results(query, result_count):
+            print(f"   ↳ {url} ({time.monotonic() - start:.1f}s)")
+            results_text.append(f"Source: {url}\n{page_content}\n\n")
+            if len(results_text) >= quorum:
+                break
 
     except Exception as e:
-        results_text += f"Web search failed: {e}\n"
+        results_text.append(f"Web search failed: {e}\n")
 
-    return results_text
+    return "".join(results_text)
 
 
-def scrape_page(url: str):
+def scrape_page(url: str, deadline=None):
+    now = time.monotonic()
+    with PAGE_CACHE_LOCK:
+        cached = PAGE_CACHE.get(url)
+    if cached and now - cached[0] < PAGE_CACHE_TTL:
+        return cached[1]
+
+    timeout = SCRAPE_TIMEOUT if deadline is None else max(0.5, min(SCRAPE_TIMEOUT, deadline - now))
     try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        res = requests.get(url, headers=headers, timeout=6)
-        soup = BeautifulSoup(res.text, "html.parser")
-
-        # Extract text from <p>
-        text = " ".join([p.get_text() for p in soup.find_all("p")])
-        return " ".join(text.split()[:200])  # limit to first 200 words
-    except:
+        parser = ParagraphText()
+        with HTTP.get(url, timeout=timeout, stream=True) as res:
+            # requests assumes Latin-1 when the server names no charset; most pages are UTF-8
+            declared = "charset" in res.headers.get("Content-Type", "").lower()
+            decoder = codecs.getincrementaldecoder(res.encoding if declared else "utf-8")(errors="replace")
+            received = 0
+            # Parse while downloading, and stop as soon as there is enough text
+            for block in res.iter_content(chunk_size=16384):
+                parser.feed(decoder.decode(block))
+                received += len(block)
+                if parser.done or received >= SCRAPE_MAX_BYTES:
+                    break
+                if deadline is not None and time.monotonic() > deadline:
+                    break
+        text = parser.text()  # limit to first SCRAPE_WORD_LIMIT words
+    except Exception:
+        return None
+
+    if not text:
         return None
+    with PAGE_CACHE_LOCK:
+        PAGE_CACHE[url] = (time.monotonic(), text)
+    return text
 
 
 # --- TTS Output ---
-def speak_text(text: str):
-    tts.say(text)
-    tts.runAndWait()
+# A segment ends after sentence punctuation followed by whitespace, or at a line break
+SEGMENT_END = re.compile(r"(?<=[.!?:;])\s+|\n+")
+
+
+class SentenceBuffer:
+    """Collects streamed text and hands back each sentence as soon as it is complete."""
+
+    def __init__(self):
+        self.pending = ""
+
+    def feed(self, text):
+        self.pending += text
+        parts = SEGMENT_END.split(self.pending)
+        self.pending = parts.pop()
+        segments = [part.strip() for part in parts if part.strip()]
+        while len(self.pending) > MAX_SEGMENT_CHARS:
+            cut = self.pending.rfind(" ", 0, MAX_SEGMENT_CHARS)
+            cut = cut if cut > 0 else MAX_SEGMENT_CHARS
+            segments.append(self.pending[:cut].strip())
+            self.pending = self.pending[cut:].lstrip()
+        return segments
+
+    def flush(self):
+        text, self.pending = self.pending.strip(), ""
+        return [text] if text else []
+
+
+class SpeechWorker:
+    """
+    Speaks queued segments on a background thread that owns the pyttsx3 engine, so the chat
+    loop never waits for audio. interrupt() drops everything still queued and stops the
+    segment being spoken.
+    """
+
+    def __init__(self):
+        self.segments = queue.Queue()
+        self.engine = None
+        self.first_audio_at = None  # time.monotonic() when the current answer started playing
+        self._answer = 0            # Bumped by interrupt(); segments of older answers are skipped
+        self._error = None
+        self._ready = threading.Event()
+        threading.Thread(target=self._run, name="tts", daemon=True).start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        try:
+            self.engine = pyttsx3.init()
+        except Exception as e:
+            self._error = e
+        self._ready.set()
+        if self._error is not None:
+            return
+        while True:
+            answer, text = self.segments.get()
+            if answer != self._answer:
+                continue  # Interrupted while waiting
+            if self.first_audio_at is None:
+                self.first_audio_at = time.monotonic()
+            try:
+                self.engine.say(text)
+                self.engine.runAndWait()
+            except Exception as e:
+                print(f"\n🔇 Speech failed: {e}")
+
+    @property
+    def answer_id(self):
+        """Identifies the current answer; segments queued under an older id are never spoken."""
+        return self._answer
+
+    def say(self, text, answer_id=None):
+        self.segments.put((self._answer if answer_id is None else answer_id, text))
+
+    def interrupt(self):
+        self._answer += 1
+        self.first_audio_at = None
+        try:
+            self.engine.stop()
+        except Exception:
+            pass  # Nothing playing, or the driver cannot stop from another thread
+
+
+def stream_answer(request, worker=None, cancelled=None):
+    """
+    Prints the answer as it is generated, followed by its generation metrics. With a speech
+    worker, each finished sentence is also handed over to be spoken. Setting the cancelled
+    event stops the generation (and this answer's speech) at the next token.
+    """
+    sentences = SentenceBuffer()
+    stats = {}
+    start = time.monotonic()
+    answer_id = worker.answer_id if worker else None
+    print("\nJoel: ", end="", flush=True)
+    pieces = generate_response_stream(**request, stats=stats)
+    try:
+        for piece in pieces:
+            if cancelled is not None and cancelled.is_set():
+                return
+            print(piece, end="", flush=True)
+            if worker:
+                for segment in sentences.feed(piece):
+                    worker.say(segment, answer_id)
+    finally:
+        pieces.close()  # Closes the Ollama stream, so a cancelled answer stops generating
+    if worker:
+        for segment in sentences.flush():
+            worker.say(segment, answer_id)
+    print("\n")
+    if stats:
+        print(f"⏱️ {format_stats(stats)}")
+    if worker and worker.first_audio_at is not None:
+        print(f"🔊 Speaking since {worker.first_audio_at - start:.1f}s (answer took {time.monotonic() - start:.1f}s)")
 
 
 # --- Main App Logic ---
+def answer_input(user_input, worker, cancelled):
+    """Answers one message (searching the web first for /search); runs on its own thread."""
+    if user_input.startswith("/search"):
+        query = user_input.replace("/search", "").strip()
+        web_data = search_web(query)
+        request = {"user_query": query, "use_web": True, "web_content": web_data}
+
+    else:
+        request = {"user_query": user_input}
+
+    if cancelled.is_set():
+        return
+    # Shown (and spoken) while it streams, so the answer starts appearing with its first token
+    stream_answer(request, worker, cancelled)
+    if not cancelled.is_set():
+        print("\nYou: ", end="", flush=True)
+
+
 def run_chat():
-    print("👋 Joel is ready! Type /exit to quit.")
+    print("👋 Joel is ready! Type /exit to quit; a new message (or /stop) cuts the current answer short.")
     use_voice = input("Enable voice? (y/n): ").strip().lower() == "y"
-
+    speech = None
+    if use_voice:
+        try:
+            speech = SpeechWorker()
+            print("🔊 Voice on.")
+        except Exception as e:
+            print(f"🔇 Voice unavailable: {e}")
+
+    # Answers are generated on their own thread, so the prompt keeps reading input meanwhile
+    answering, cancelled = None, None
+    prompt = "\nYou: "
     while True:
-        user_input = input("\nYou: ").strip()
+        user_input = input(prompt).strip()
+        prompt = "\nYou: "
+        if answering is not None and answering.is_alive():
+            # The user has moved on: stop generating (and reading out) the previous answer
+            cancelled.set()
+            print("⏹️ Stopped.")
+        if speech:
+            speech.interrupt()
 
         if user_input.lower() == "/exit":
             print("Goodbye 👋")
             break
 
-        # Detect web search command
-        if user_input.startswith("/search"):
-            query = user_input.replace("/search", "").strip()
-            web_data = search_web(query)
-            output = generate_response(query, use_web=True, web_content=web_data)
-
-        else:
-            output = generate_response(user_input)
-
-        print(f"\nJoel: {output}\n")
+        if user_input.lower() == "/stop":
+            continue
 
-        if use_voice:
-            speak_text(output)
+        cancelled = threading.Event()
+        answering = threading.Thread(target=answer_input, args=(user_input, speech, cancelled), daemon=True)
+        answering.start()
+        prompt = ""  # The answer thread shows the prompt again when it is done
 
 
 if __name__ == "__main__":